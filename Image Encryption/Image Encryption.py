@@ -1,67 +1,42 @@
 from PIL import Image
 from cryptography.fernet import Fernet
+import argparse
+import getpass
 import os
-from base64 import b64encode, b64decode
+import sys
+from stream_cipher import DEFAULT_CHUNK_SIZE, HEADER, decrypt_stream, encrypt_stream, is_encrypted_stream
+from batch import DEFAULT_LARGE_FILE_SIZE, run_batch
+from keys import derive_key, generate_key, is_passphrase_key_file, load_key, save_key
 
-def generate_key(key_size=32):
+def _write_atomically(output_path, write):
   """
-  Generates a secure random key for encryption.
-
-  Args:
-      key_size (int, optional): The desired key size in bytes. Defaults to 32.
-
-  Returns:
-      bytes: The generated encryption key.
+  Calls write(file) on a temporary file that replaces output_path once write
+  succeeds, so a failed run never leaves a partial output file behind.
   """
 
-  return Fernet.generate_key(key_size)
-
-def save_key(key, key_file_path="image_encryption_key.key"):
+  temporary_path = output_path + ".part"
+  try:
+    with open(temporary_path, 'wb') as output_file:
+      write(output_file)
+    os.replace(temporary_path, output_path)
+  except BaseException:
+    if os.path.exists(temporary_path):
+      os.remove(temporary_path)
+    raise
+
+def encrypt_image(image_path, key, output_dir="encrypted_images", chunk_size=DEFAULT_CHUNK_SIZE):
   """
-  Saves the encryption key to a file securely.
-
-  Args:
-      key (bytes): The encryption key to save.
-      key_file_path (str, optional): The path to the file where the key will be saved.
-          Defaults to "image_encryption_key.key".
-  """
-
-  if not os.path.exists(os.path.dirname(key_file_path)):
-    os.makedirs(os.path.dirname(key_file_path))
+  Encrypts an image into the chunked AES-256-GCM format (see stream_cipher.py).
 
-  with open(key_file_path, 'wb') as key_file:
-    key_file.write(b64encode(key))  # Base64 encode for better portability
-
-def load_key(key_file_path="image_encryption_key.key"):
-  """
-  Loads the encryption key from a file.
-
-  Args:
-      key_file_path (str, optional): The path to the file containing the key.
-          Defaults to "image_encryption_key.key".
-
-  Returns:
-      bytes: The loaded encryption key.
-
-  Raises:
-      FileNotFoundError: If the key file is not found.
-  """
-
-  if not os.path.exists(key_file_path):
-    raise FileNotFoundError(f"Key file not found: {key_file_path}")
-
-  with open(key_file_path, 'rb') as key_file:
-    return b64decode(key_file.read())  # Base64 decode
-
-def encrypt_image(image_path, key, output_dir="encrypted_images"):
-  """
-  Encrypts an image using Fernet encryption.
+  The file is streamed chunk by chunk, so memory use does not depend on the
+  image size, and the output is raw binary (no base64 inflation).
 
   Args:
       image_path (str): The path to the image file to encrypt.
-      key (bytes): The encryption key.
+      key (Key): The encryption key (see keys.py).
       output_dir (str, optional): The directory to save the encrypted image.
           Defaults to "encrypted_images".
+      chunk_size (int, optional): Plaintext bytes per authenticated chunk.
 
   Returns:
       str: The path to the encrypted image file.
@@ -74,23 +49,21 @@ def encrypt_image(image_path, key, output_dir="encrypted_images"):
   encrypted_image_path = os.path.join(output_dir, f"{image_name}.enc")
 
   with open(image_path, 'rb') as image_file:
-    image_data = image_file.read()
-
-  cipher_suite = Fernet(key)
-  encrypted_data = cipher_suite.encrypt(image_data)
-
-  with open(encrypted_image_path, 'wb') as encrypted_file:
-    encrypted_file.write(encrypted_data)
+    _write_atomically(encrypted_image_path,
+                      lambda encrypted_file: encrypt_stream(image_file, encrypted_file, key, chunk_size))
 
   return encrypted_image_path
 
 def decrypt_image(encrypted_image_path, key):
   """
-  Decrypts an encrypted image using Fernet encryption.
+  Decrypts an encrypted image.
+
+  Chunked files are streamed with constant memory; files encrypted by older
+  versions as a single Fernet token are still accepted.
 
   Args:
       encrypted_image_path (str): The path to the encrypted image file.
-      key (bytes): The encryption key.
+      key (Key): The encryption key (see keys.py).
 
   Returns:
       str: The path to the decrypted image file.
@@ -100,9 +73,17 @@ def decrypt_image(encrypted_image_path, key):
   decrypted_image_path = os.path.join(os.path.dirname(encrypted_image_path), f"{image_name}.dec.jpg")
 
   with open(encrypted_image_path, 'rb') as encrypted_file:
+    if is_encrypted_stream(encrypted_file.read(HEADER.size)):
+      encrypted_file.seek(0)
+      _write_atomically(decrypted_image_path,
+                        lambda decrypted_file: decrypt_stream(encrypted_file, decrypted_file, key))
+      return decrypted_image_path
+
+    # Legacy format: the whole image as one Fernet token
+    encrypted_file.seek(0)
     encrypted_data = encrypted_file.read()
 
-  cipher_suite = Fernet(key)
+  cipher_suite = key.fernet if hasattr(key, "fernet") else Fernet(key)
   decrypted_data = cipher_suite.decrypt(encrypted_data)
 
   with open(decrypted_image_path, 'wb') as decrypted_file:
@@ -110,37 +91,89 @@ def decrypt_image(encrypted_image_path, key):
 
   return decrypted_image_path
 
+def batch_main(argv):
+  """
+  Command line batch mode: encrypts or decrypts a whole directory tree (see batch.py).
+
+  Args:
+      argv (list): The command line arguments.
+
+  Returns:
+      int: The exit status, 1 when some files failed.
+  """
+
+  parser = argparse.ArgumentParser(description="Encrypt or decrypt every file of a directory tree")
+  parser.add_argument("mode", choices=["encrypt", "decrypt"])
+  parser.add_argument("input_dir", help="Directory tree to process")
+  parser.add_argument("output_dir", help="Directory receiving the results (the tree is mirrored)")
+  parser.add_argument("--key-file", default="image_encryption_key.key", help="Key file to use")
+  parser.add_argument("--workers", type=int, help="Worker processes (defaults to the CPU count)")
+  parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Plaintext bytes per chunk")
+  parser.add_argument("--large-file-size", type=int, default=DEFAULT_LARGE_FILE_SIZE,
+                      help="Files of at least this many bytes have their chunks processed in parallel")
+  parser.add_argument("--manifest", help="Manifest of completed files (defaults to .manifest.jsonl in output_dir)")
+  parser.add_argument("--quiet", action="store_true", help="Do not print progress")
+  args = parser.parse_args(argv)
+
+  passphrase = None
+  if is_passphrase_key_file(args.key_file):
+    passphrase = getpass.getpass("Passphrase: ")
+  # Derived once here; the workers only receive the resulting key
+  try:
+    key = load_key(args.key_file, passphrase)
+  except (OSError, ValueError) as e:
+    print(f"Error loading key: {e}")
+    return 2
+  result = run_batch(args.mode, args.input_dir, args.output_dir, key, workers=args.workers,
+                     chunk_size=args.chunk_size, large_file_size=args.large_file_size,
+                     manifest_path=args.manifest, progress=not args.quiet)
+  print(f"{args.mode.capitalize()}ed {result.summary()}")
+  for path, error in result.failed:
+    print(f"Failed: {path}: {error}")
+  return 1 if result.failed else 0
+
 if __name__ == "__main__":
   """
   This section handles user interaction and program execution.
   """
 
-  # User choice: Generate or load key
+  # With arguments the tool runs as a batch job, without it asks what to do
+  if len(sys.argv) > 1:
+    sys.exit(batch_main(sys.argv[1:]))
+
+  # User choice: Generate, derive from a passphrase or load key
   while True:
-    choice = input("Do you want to generate a new key (g) or load an existing key (l)? ").lower()
-    if choice in ("g", "l"):
+    choice = input("Do you want to generate a new key (g), derive one from a passphrase (p) "
+                   "or load an existing key (l)? ").lower()
+    if choice in ("g", "p", "l"):
       break
     else:
-      print("Invalid choice. Please enter 'g' or 'l'.")
+      print("Invalid choice. Please enter 'g', 'p' or 'l'.")
 
-  # Generate or load key based on user choice
-  if choice == "g":
+  # Generate, derive or load key based on user choice
+  key_file_path = "image_encryption_key.key"
+  if choice in ("g", "p"):
     try:
-      key = generate_key()
-      print("New key generated successfully!")
+      key = generate_key() if choice == "g" else derive_key(getpass.getpass("Passphrase: "))
+      save_key(key, key_file_path)
+      print("New key", key.key_id, "generated and saved to", key_file_path)
     except Exception as e:
       print(f"Error generating key: {e}")
       exit(1)
   else:
-    key_file_path = "image_encryption_key.key"
     try:
-      key = load_key(key_file_path)
-      print("Key loaded successfully from", key_file_path)
+      passphrase = getpass.getpass("Passphrase: ") if is_passphrase_key_file(key_file_path) else None
+      key = load_key(key_file_path, passphrase)
+      print("Key", key.key_id, "loaded successfully from", key_file_path)
     except FileNotFoundError:
       print(f"Key file not found: {key_file_path}")
       print("Generating a new key...")
       key = generate_key()
+      save_key(key, key_file_path)
       print("New key generated and saved to", key_file_path)
+    except ValueError as e:
+      print(f"Error loading key: {e}")
+      exit(1)
 
   # User choice: Encrypt or decrypt
   while True:
@@ -0,0 +1,298 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from stream_cipher import (DEFAULT_CHUNK_SIZE, HEADER, StreamHeader, chunk_count, decrypt_chunks, decrypt_stream,
+                           encrypt_chunks, encrypt_stream, encrypted_size, plaintext_size, raw_key)
+
+ENCRYPTED_SUFFIX = ".enc"
+MANIFEST_NAME = ".manifest.jsonl"
+# Files of at least this size are split into spans of chunks processed in parallel
+DEFAULT_LARGE_FILE_SIZE = 64 * 1024 * 1024
+DEFAULT_SPAN_CHUNKS = 16
+
+# Raw key of the worker processes, set once per process by the pool initializer (no derivation in the workers)
+_worker_key = None
+
+
+def _init_worker(raw):
+  global _worker_key
+  _worker_key = raw
+
+
+def _process_file(mode, source_path, destination_path, chunk_size):
+  # Small files: one task streams the whole file
+  temporary_path = destination_path + ".part"
+  os.makedirs(os.path.dirname(destination_path) or ".", exist_ok=True)
+  try:
+    with open(source_path, 'rb') as source, open(temporary_path, 'wb') as destination:
+      if mode == "encrypt":
+        done = encrypt_stream(source, destination, _worker_key, chunk_size)
+      else:
+        done = decrypt_stream(source, destination, _worker_key)
+    os.replace(temporary_path, destination_path)
+  except BaseException:
+    if os.path.exists(temporary_path):
+      os.remove(temporary_path)
+    raise
+  return done
+
+
+def _process_span(mode, source_path, temporary_path, packed_header, first, count, total):
+  # Large files: one task handles a span of chunks of a preallocated output file
+  header = StreamHeader.unpack(packed_header)
+  cipher = header.cipher(_worker_key)
+  source_fd = os.open(source_path, os.O_RDONLY)
+  try:
+    destination_fd = os.open(temporary_path, os.O_WRONLY)
+    try:
+      process = encrypt_chunks if mode == "encrypt" else decrypt_chunks
+      return process(source_fd, destination_fd, header, cipher, first, count, total)
+    finally:
+      os.close(destination_fd)
+  finally:
+    os.close(source_fd)
+
+
+def _describe(error):
+  # InvalidTag carries no message, its name says it all
+  return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+def walk_files(root, mode):
+  """
+  Lists the files of a directory tree to process, as sorted relative paths.
+
+  Args:
+      root (str): The directory to walk.
+      mode (str): "encrypt" (every file not ending in .enc) or "decrypt" (the .enc files).
+  """
+
+  files = []
+  for directory, directories, names in os.walk(root):
+    directories.sort()
+    for name in sorted(names):
+      if name == MANIFEST_NAME or name.endswith(".part"):
+        continue
+      if name.endswith(ENCRYPTED_SUFFIX) == (mode == "decrypt"):
+        files.append(os.path.relpath(os.path.join(directory, name), root))
+  return files
+
+
+def output_path(relative_path, output_dir, mode):
+  """Returns the output path of a file: .enc is appended when encrypting and removed when decrypting."""
+  if mode == "encrypt":
+    return os.path.join(output_dir, relative_path + ENCRYPTED_SUFFIX)
+  return os.path.join(output_dir, relative_path[:-len(ENCRYPTED_SUFFIX)])
+
+
+class Manifest:
+  """
+  Append-only record of the files a batch job has completed.
+
+  Each line holds the relative path, size and modification time of a source
+  file. A file is skipped when the job is run again while it is recorded with
+  the same size and modification time and its output still exists, so an
+  interrupted job resumes where it stopped.
+
+  Args:
+      path (str): The manifest file (created if needed).
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.completed = {}
+    if os.path.exists(path):
+      with open(path) as manifest_file:
+        for line in manifest_file:
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            continue  # A line cut short by an interruption
+          self.completed[entry["path"]] = (entry["size"], entry["mtime_ns"])
+    self._file = None
+
+  def is_done(self, relative_path, stat, destination_path):
+    return (self.completed.get(relative_path) == (stat.st_size, stat.st_mtime_ns)
+            and os.path.exists(destination_path))
+
+  def record(self, relative_path, stat):
+    if self._file is None:
+      os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+      self._file = open(self.path, 'a')
+    self._file.write(json.dumps({"path": relative_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}) + "\n")
+    self._file.flush()
+    self.completed[relative_path] = (stat.st_size, stat.st_mtime_ns)
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+
+class BatchResult:
+  """Counters of a batch job, see run_batch."""
+
+  def __init__(self):
+    self.files = 0
+    self.skipped = 0
+    self.failed = []
+    self.bytes = 0
+    self.seconds = 0.0
+
+  @property
+  def throughput(self):
+    """Processed bytes per second."""
+    return self.bytes / self.seconds if self.seconds else 0.0
+
+  def summary(self):
+    return (f"{self.files} files ({self.bytes / 1e6:.1f} MB) in {self.seconds:.2f} s, "
+            f"{self.throughput / 1e6:.1f} MB/s, {self.skipped} skipped, {len(self.failed)} failed")
+
+
+def _progress(result, total_files, started):
+  elapsed = time.monotonic() - started
+  rate = result.bytes / elapsed / 1e6 if elapsed else 0.0
+  sys.stdout.write(f"\r{result.files + result.skipped + len(result.failed)}/{total_files} files, "
+                   f"{result.bytes / 1e6:.1f} MB, {rate:.1f} MB/s")
+  sys.stdout.flush()
+
+
+def run_batch(mode, input_dir, output_dir, key, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              large_file_size=DEFAULT_LARGE_FILE_SIZE, span_chunks=DEFAULT_SPAN_CHUNKS, manifest_path=None,
+              progress=True, max_in_flight=None):
+  """
+  Encrypts or decrypts every file of a directory tree across a process pool.
+
+  The tree is mirrored under output_dir. Files smaller than large_file_size are
+  processed whole by one worker; larger files are split into spans of
+  span_chunks chunks that are encrypted or decrypted by several workers into a
+  preallocated output file. Completed files are recorded in a manifest, so
+  running the same job again skips them.
+
+  Args:
+      mode (str): "encrypt" or "decrypt".
+      input_dir (str): The directory tree to process.
+      output_dir (str): The directory receiving the results.
+      key (Key): The encryption key (see keys.py).
+      workers (int, optional): Number of worker processes. Defaults to the CPU count.
+      chunk_size (int, optional): Plaintext bytes per chunk when encrypting.
+      large_file_size (int, optional): Size from which the chunks of a file are parallelised.
+      span_chunks (int, optional): Chunks per parallel task of a large file.
+      manifest_path (str, optional): The manifest file. Defaults to .manifest.jsonl in output_dir.
+      progress (bool, optional): Print progress while the job runs.
+      max_in_flight (int, optional): Tasks submitted to the pool but not yet collected, so memory
+          does not grow with the size of the tree. Defaults to 4 per worker.
+
+  Returns:
+      BatchResult: Counts, failures and throughput of the job.
+  """
+
+  if mode not in ("encrypt", "decrypt"):
+    raise ValueError(f"Invalid mode: {mode}")
+  manifest = Manifest(manifest_path or os.path.join(output_dir, MANIFEST_NAME))
+  files = walk_files(input_dir, mode)
+  result = BatchResult()
+  started = time.monotonic()
+  last_progress = 0.0
+
+  if max_in_flight is None:
+    max_in_flight = 4 * (workers or os.cpu_count() or 1)
+
+  # future -> (relative path, source stat, destination path, pending spans entry or None)
+  pending = {}
+
+  def collect():
+    nonlocal last_progress
+    finished, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+    for future in finished:
+      relative_path, stat, destination_path, entry = pending.pop(future)
+      error = future.exception()
+      if error is None:
+        result.bytes += future.result()
+      if entry is None:
+        if error is None:
+          result.files += 1
+          manifest.record(relative_path, stat)
+        else:
+          result.failed.append((relative_path, _describe(error)))
+        continue
+
+      if error is not None and entry["error"] is None:
+        entry["error"] = _describe(error)
+      entry["remaining"] -= 1
+      if entry["remaining"] == 0 and entry["submitted"]:
+        finish_large_file(entry, relative_path, stat, destination_path)
+    if progress and time.monotonic() - last_progress >= 0.5:
+      last_progress = time.monotonic()
+      _progress(result, len(files), started)
+
+  def finish_large_file(entry, relative_path, stat, destination_path):
+    temporary_path = destination_path + ".part"
+    if entry["error"] is None:
+      os.replace(temporary_path, destination_path)
+      result.files += 1
+      manifest.record(relative_path, stat)
+    else:
+      os.remove(temporary_path)
+      result.failed.append((relative_path, entry["error"]))
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(raw_key(key),)) as pool:
+    for relative_path in files:
+      while len(pending) >= max_in_flight:
+        collect()
+      source_path = os.path.join(input_dir, relative_path)
+      destination_path = output_path(relative_path, output_dir, mode)
+      stat = os.stat(source_path)
+      if manifest.is_done(relative_path, stat, destination_path):
+        result.skipped += 1
+        continue
+
+      if stat.st_size < large_file_size:
+        future = pool.submit(_process_file, mode, source_path, destination_path, chunk_size)
+        pending[future] = (relative_path, stat, destination_path, None)
+        continue
+
+      # Large file: the header and the output size are set here, the workers fill in the chunks
+      try:
+        with open(source_path, 'rb') as source:
+          header = StreamHeader(chunk_size) if mode == "encrypt" else StreamHeader.unpack(source.read(HEADER.size))
+        if mode == "encrypt":
+          total = chunk_count(stat.st_size, header.chunk_size)
+          size = encrypted_size(stat.st_size, header.chunk_size)
+        else:
+          size = plaintext_size(stat.st_size, header.chunk_size)
+          total = chunk_count(size, header.chunk_size)
+        temporary_path = destination_path + ".part"
+        os.makedirs(os.path.dirname(destination_path) or ".", exist_ok=True)
+        with open(temporary_path, 'wb') as destination:
+          if mode == "encrypt":
+            destination.write(header.packed)
+          destination.truncate(size)
+      except (OSError, ValueError) as e:
+        result.failed.append((relative_path, str(e)))
+        continue
+      # The spans are submitted as room frees up; the file is finished once all are submitted and done
+      entry = {"remaining": 0, "error": None, "submitted": False}
+      for first in range(0, total, span_chunks):
+        while len(pending) >= max_in_flight:
+          collect()
+        future = pool.submit(_process_span, mode, source_path, temporary_path, header.packed, first,
+                             min(span_chunks, total - first), total)
+        pending[future] = (relative_path, stat, destination_path, entry)
+        entry["remaining"] += 1
+      entry["submitted"] = True
+      if entry["remaining"] == 0:
+        finish_large_file(entry, relative_path, stat, destination_path)
+
+    while pending:
+      collect()
+
+  manifest.close()
+  result.seconds = time.monotonic() - started
+  if progress:
+    _progress(result, len(files), started)
+    print()
+  return result
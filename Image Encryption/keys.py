@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+from base64 import b64decode, urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+try:
+  from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography < 44
+  Argon2id = None
+
+KEYFILE_VERSION = 1
+KEY_SIZE = 32
+
+# Default cost parameters, about a quarter to half a second per derivation
+ARGON2_PARAMETERS = {"iterations": 3, "lanes": 4, "memory_cost": 64 * 1024}
+SCRYPT_PARAMETERS = {"n": 2 ** 17, "r": 8, "p": 1}
+
+
+class Key:
+  """
+  An encryption key with its identifier.
+
+  The key ID is a hash of the key, so it names the key in key files and
+  messages without revealing it. The Fernet object used for files in the old
+  single-token format is built once and reused.
+
+  Args:
+      raw (bytes): The 32 key bytes.
+      kdf (dict, optional): The derivation parameters when the key comes from a passphrase.
+  """
+
+  def __init__(self, raw, kdf=None):
+    if len(raw) != KEY_SIZE:
+      raise ValueError(f"The encryption key must be {KEY_SIZE} bytes")
+    self.raw = bytes(raw)
+    self.kdf = kdf
+    self.key_id = hashlib.sha256(b"image-encryption key id" + self.raw).hexdigest()[:16]
+    self._fernet = None
+
+  @property
+  def fernet(self):
+    if self._fernet is None:
+      self._fernet = Fernet(urlsafe_b64encode(self.raw))
+    return self._fernet
+
+  def __repr__(self):
+    return f"Key(key_id={self.key_id!r})"
+
+
+def generate_key():
+  """
+  Generates a secure random key for encryption.
+
+  Returns:
+      Key: The generated encryption key.
+  """
+
+  return Key(os.urandom(KEY_SIZE))
+
+
+@lru_cache(maxsize=16)
+def _derive(passphrase, algorithm, salt, parameters):
+  parameters = dict(parameters)
+  if algorithm == "argon2id":
+    if Argon2id is None:
+      raise ValueError("Argon2id needs cryptography 44 or newer")
+    return Argon2id(salt=salt, length=KEY_SIZE, **parameters).derive(passphrase)
+  if algorithm == "scrypt":
+    return Scrypt(salt=salt, length=KEY_SIZE, **parameters).derive(passphrase)
+  raise ValueError(f"Unknown key derivation function: {algorithm}")
+
+
+def derive_key(passphrase, kdf=None):
+  """
+  Derives a key from a passphrase with Argon2id (or scrypt).
+
+  Derivation is deliberately slow, so results are cached: deriving the same
+  key again, e.g. for every file of a batch, costs nothing.
+
+  Args:
+      passphrase (str): The passphrase.
+      kdf (dict, optional): The parameters of an existing key (algorithm, salt and
+          costs, as stored in its key file). New parameters with a random salt by default.
+
+  Returns:
+      Key: The derived key, with its parameters in kdf.
+  """
+
+  if kdf is None:
+    algorithm = "argon2id" if Argon2id is not None else "scrypt"
+    parameters = ARGON2_PARAMETERS if algorithm == "argon2id" else SCRYPT_PARAMETERS
+    kdf = {"algorithm": algorithm, "salt": urlsafe_b64encode(os.urandom(16)).decode(), **parameters}
+  parameters = tuple(sorted((name, value) for name, value in kdf.items() if name not in ("algorithm", "salt")))
+  raw = _derive(passphrase.encode(), kdf["algorithm"], urlsafe_b64decode(kdf["salt"]), parameters)
+  return Key(raw, kdf)
+
+
+def save_key(key, key_file_path="image_encryption_key.key"):
+  """
+  Saves the encryption key to a key file.
+
+  The key file is JSON holding the format version and the key ID. A random
+  key is stored in it; for a key derived from a passphrase only the derivation
+  parameters are, so the file is useless without the passphrase.
+
+  Args:
+      key (Key): The encryption key to save.
+      key_file_path (str, optional): The path to the file where the key will be saved.
+          Defaults to "image_encryption_key.key".
+  """
+
+  directory = os.path.dirname(key_file_path)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+
+  content = {"version": KEYFILE_VERSION, "key_id": key.key_id}
+  if key.kdf is None:
+    content["key"] = urlsafe_b64encode(key.raw).decode()
+  else:
+    content["kdf"] = key.kdf
+  # Readable by the owner only
+  descriptor = os.open(key_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  with open(descriptor, 'w') as key_file:
+    json.dump(content, key_file, indent=2)
+
+
+def is_passphrase_key_file(key_file_path):
+  """Tells whether a key file holds derivation parameters, i.e. needs a passphrase."""
+  try:
+    with open(key_file_path) as key_file:
+      content = json.load(key_file)
+  except (OSError, ValueError):
+    return False
+  return isinstance(content, dict) and "kdf" in content
+
+
+def load_key(key_file_path="image_encryption_key.key", passphrase=None):
+  """
+  Loads the encryption key from a key file.
+
+  Key files written by older versions (a base64 encoded Fernet key) are still
+  accepted.
+
+  Args:
+      key_file_path (str, optional): The path to the file containing the key.
+          Defaults to "image_encryption_key.key".
+      passphrase (str, optional): The passphrase of a key derived from one.
+
+  Returns:
+      Key: The loaded encryption key.
+
+  Raises:
+      FileNotFoundError: If the key file is not found.
+      ValueError: If the key file is invalid, or the passphrase is missing or wrong.
+  """
+
+  if not os.path.exists(key_file_path):
+    raise FileNotFoundError(f"Key file not found: {key_file_path}")
+
+  with open(key_file_path, 'rb') as key_file:
+    data = key_file.read()
+
+  try:
+    content = json.loads(data)
+  except ValueError:
+    # Old format: the Fernet key (itself urlsafe base64) base64 encoded once more
+    return Key(urlsafe_b64decode(b64decode(data)))
+
+  if not isinstance(content, dict):
+    raise ValueError("Invalid key file")
+  if content.get("version") != KEYFILE_VERSION:
+    raise ValueError(f"Unsupported key file version: {content.get('version')}")
+  if "kdf" in content:
+    if passphrase is None:
+      raise ValueError("This key is derived from a passphrase, which is required")
+    key = derive_key(passphrase, content["kdf"])
+  else:
+    key = Key(urlsafe_b64decode(content["key"]))
+  if key.key_id != content["key_id"]:
+    raise ValueError("Wrong passphrase" if "kdf" in content else "The key does not match its key ID")
+  return key
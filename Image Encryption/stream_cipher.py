@@ -0,0 +1,252 @@
+import os
+import struct
+from base64 import urlsafe_b64decode
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b"IMGENC"
+VERSION = 1
+ALGORITHM_AES_256_GCM = 1
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+TAG_SIZE = 16
+
+# Magic, version, algorithm, plaintext chunk size, per-file salt
+HEADER = struct.Struct(">6sBBI16s")
+# Chunk counter and final-chunk flag, together the 96-bit GCM nonce
+_NONCE = struct.Struct(">QI")
+
+
+class StreamHeader:
+  """
+  Header of a chunked encrypted file.
+
+  Every chunk is sealed with AES-256-GCM under a per-file key derived with HKDF
+  from the encryption key and the random salt of the header. The nonce of a chunk
+  is its counter plus a flag marking the final chunk, and the header is the
+  associated data of every chunk. Reordered, dropped, truncated or appended
+  chunks, and a modified header, therefore all fail authentication.
+
+  Args:
+      chunk_size (int): Plaintext bytes per chunk (the last chunk may be shorter).
+      salt (bytes, optional): 16 byte salt of the file key. Random by default.
+  """
+
+  def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, salt=None):
+    if not 0 < chunk_size < 1 << 32:
+      raise ValueError(f"Invalid chunk size: {chunk_size}")
+    self.chunk_size = chunk_size
+    self.salt = os.urandom(16) if salt is None else salt
+    self.packed = HEADER.pack(MAGIC, VERSION, ALGORITHM_AES_256_GCM, chunk_size, self.salt)
+
+  @classmethod
+  def unpack(cls, data):
+    """
+    Parses a packed header.
+
+    Raises:
+        ValueError: If data is not the header of a supported encrypted file.
+    """
+
+    if len(data) < HEADER.size or not data.startswith(MAGIC):
+      raise ValueError("Not a chunked encrypted file")
+    _, version, algorithm, chunk_size, salt = HEADER.unpack(data[:HEADER.size])
+    if version != VERSION or algorithm != ALGORITHM_AES_256_GCM:
+      raise ValueError(f"Unsupported encrypted file version {version} / algorithm {algorithm}")
+    return cls(chunk_size, salt)
+
+  def cipher(self, key):
+    """
+    Returns the AEAD of this file.
+
+    Args:
+        key (bytes): The encryption key (a Fernet key or 32 raw bytes).
+    """
+
+    return _file_cipher(raw_key(key), self.salt)
+
+  def seal(self, cipher, index, data, final):
+    """Encrypts chunk number index; final marks the last chunk of the file."""
+    return cipher.encrypt(_NONCE.pack(index, final), data, self.packed)
+
+  def open(self, cipher, index, data, final):
+    """
+    Decrypts chunk number index.
+
+    Raises:
+        cryptography.exceptions.InvalidTag: If the chunk is not authentic.
+    """
+
+    return cipher.decrypt(_NONCE.pack(index, final), data, self.packed)
+
+
+@lru_cache(maxsize=64)
+def _file_cipher(raw, salt):
+  # The spans of one large file are handled by the same workers, which reuse the file's AEAD
+  file_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt,
+                  info=b"image-encryption chunk key").derive(raw)
+  return AESGCM(file_key)
+
+
+def raw_key(key):
+  """
+  Returns the 32 raw bytes of an encryption key.
+
+  Accepts a Key (see keys.py), an urlsafe-base64 Fernet key or 32 raw bytes.
+  """
+
+  raw = getattr(key, "raw", None)
+  if raw is not None:
+    return raw
+  if len(key) == 32:
+    return bytes(key)
+  raw = urlsafe_b64decode(key)
+  if len(raw) != 32:
+    raise ValueError("The encryption key must be 32 bytes")
+  return raw
+
+
+def is_encrypted_stream(prefix):
+  """Tells whether a file starting with prefix is in the chunked format."""
+  return prefix.startswith(MAGIC)
+
+
+def encrypt_stream(source, destination, key, chunk_size=DEFAULT_CHUNK_SIZE):
+  """
+  Encrypts a binary stream chunk by chunk, with memory bounded by two chunks.
+
+  Args:
+      source: Readable binary file object with the plaintext.
+      destination: Writable binary file object receiving the encrypted file.
+      key (bytes): The encryption key.
+      chunk_size (int, optional): Plaintext bytes per chunk.
+
+  Returns:
+      int: The number of plaintext bytes encrypted.
+  """
+
+  header = StreamHeader(chunk_size)
+  cipher = header.cipher(key)
+  destination.write(header.packed)
+
+  total = 0
+  index = 0
+  chunk = source.read(chunk_size)
+  while True:
+    # One chunk of read-ahead tells whether the current chunk is the last one
+    following = source.read(chunk_size) if len(chunk) == chunk_size else b""
+    final = not following
+    destination.write(header.seal(cipher, index, chunk, final))
+    total += len(chunk)
+    if final:
+      return total
+    chunk = following
+    index += 1
+
+
+def decrypt_stream(source, destination, key):
+  """
+  Decrypts a stream written by encrypt_stream, with memory bounded by two chunks.
+
+  Args:
+      source: Readable binary file object with the encrypted file.
+      destination: Writable binary file object receiving the plaintext.
+      key (bytes): The encryption key.
+
+  Returns:
+      int: The number of plaintext bytes decrypted.
+
+  Raises:
+      ValueError: If the stream is not a chunked encrypted file.
+      cryptography.exceptions.InvalidTag: If the key is wrong or the file was modified or truncated.
+  """
+
+  header = StreamHeader.unpack(source.read(HEADER.size))
+  cipher = header.cipher(key)
+  record_size = header.chunk_size + TAG_SIZE
+
+  total = 0
+  index = 0
+  record = source.read(record_size)
+  while True:
+    following = source.read(record_size) if len(record) == record_size else b""
+    final = not following
+    chunk = header.open(cipher, index, record, final)
+    destination.write(chunk)
+    total += len(chunk)
+    if final:
+      return total
+    record = following
+    index += 1
+
+
+def chunk_count(plaintext_size, chunk_size):
+  """Returns the number of chunks encrypt_stream writes for plaintext_size bytes (at least one)."""
+  return max(1, -(-plaintext_size // chunk_size))
+
+
+def encrypted_size(plaintext_size, chunk_size):
+  """Returns the size of the encrypted file of plaintext_size bytes."""
+  return HEADER.size + plaintext_size + TAG_SIZE * chunk_count(plaintext_size, chunk_size)
+
+
+def plaintext_size(encrypted_size, chunk_size):
+  """Returns the plaintext size of an encrypted file of encrypted_size bytes."""
+  chunks = max(1, -(-(encrypted_size - HEADER.size) // (chunk_size + TAG_SIZE)))
+  return encrypted_size - HEADER.size - TAG_SIZE * chunks
+
+
+def encrypt_chunks(source_fd, destination_fd, header, cipher, first, count, total):
+  """
+  Encrypts chunks first to first + count - 1 of a file of total chunks in place.
+
+  Chunk positions in both files only depend on the chunk size, so ranges of
+  chunks of one large file can be processed independently (e.g. by several
+  processes) with positioned reads and writes. The destination must already
+  hold the header.
+
+  Args:
+      source_fd (int): File descriptor of the plaintext file.
+      destination_fd (int): File descriptor of the encrypted file.
+      header (StreamHeader): Header of the encrypted file.
+      cipher: The AEAD returned by header.cipher(key).
+      first (int): Index of the first chunk.
+      count (int): Number of chunks.
+      total (int): Number of chunks of the whole file.
+
+  Returns:
+      int: The number of plaintext bytes encrypted.
+  """
+
+  size = header.chunk_size
+  done = 0
+  for index in range(first, first + count):
+    chunk = os.pread(source_fd, size, index * size)
+    os.pwrite(destination_fd, header.seal(cipher, index, chunk, index == total - 1),
+              HEADER.size + index * (size + TAG_SIZE))
+    done += len(chunk)
+  return done
+
+
+def decrypt_chunks(source_fd, destination_fd, header, cipher, first, count, total):
+  """
+  Decrypts chunks first to first + count - 1 of an encrypted file of total chunks
+  in place (see encrypt_chunks).
+
+  Returns:
+      int: The number of plaintext bytes decrypted.
+
+  Raises:
+      cryptography.exceptions.InvalidTag: If a chunk is not authentic.
+  """
+
+  size = header.chunk_size
+  done = 0
+  for index in range(first, first + count):
+    record = os.pread(source_fd, size + TAG_SIZE, HEADER.size + index * (size + TAG_SIZE))
+    chunk = header.open(cipher, index, record, index == total - 1)
+    os.pwrite(destination_fd, chunk, index * size)
+    done += len(chunk)
+  return done
@@ -1,44 +1,186 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
 from scapy.all import *
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-# import time
-from scapy.layers.inet import IP
-import smtplib
-from email.mime.text import MIMEText
+from scapy.layers.inet import IP, TCP, UDP
+from packet_store import PacketStore, ip_to_int, int_to_ip, ips_to_ints
+from detectors import PortScanDetector, DDoSDetector
+from pcap_reader import read_pcap, iter_frames
+from decoder import decode_frame, decode_tcp_segment, LINKTYPE_ETHERNET
+from flow_table import FlowTable
+from http_analysis import HttpAnalyzer
+from cidr_index import CidrIndex
+from report import Report, per_minute_counts
+from alerts import AlertDispatcher, SMTPSink
+from segment_store import SegmentWriter, read_segments
+from capture import CapturePipeline
+from metrics import Metrics, MetricsServer, SnapshotWriter
+from sharding import ShardedCapture, apply_partials, merge_results, read_http_results
+from rules import RuleSet, format_hit, load_rules
 
 # Initial settings
 interface = "eth0"  # Replace with the name of your network interface.
+capture_shards = 1  # Capture processes per interface in fast mode, sharded by flow with a kernel fanout group
 bpf_filter = "ip"  # Filter to select IP packets
 capture_time = 60  # Packet recording time in seconds
+capture_mode = "fast"  # "fast" decodes raw frames with struct, "scapy" dissects every packet with scapy
+output_directory = "traffic_data"  # Captured packets are saved here as rotating Parquet segments
+persist_batch = 65536  # Packets written to the segment files at a time
+ring_size = 65536  # Frames buffered between the capture thread and the analysis workers
+analysis_workers = 1  # Threads draining the capture ring
+socket_buffer = 32 * 1024 * 1024  # Kernel receive buffer of the capture socket in bytes
+report_interval = 300  # Length of the tumbling report windows of the daemon mode in seconds
+deny_networks = []  # CIDR networks whose traffic raises an alert, e.g. ["203.0.113.0/24"]
+report_directory = "traffic_report"  # HTML/PNG report of the capture (charts are drawn headless)
+asset_groups = {}  # Traffic is also reported per asset group, e.g. {"servers": ["10.0.1.0/24"]}
+# Declarative detection rules checked per packet during capture and over the stored packets (see rules.py)
+detection_rules = [
+    {'name': 'large_packet', 'where': {'field': 'packet_size', 'op': '>', 'value': 100},
+     'message': "Suspicious packets detected!"},
+]
+metrics_port = None  # Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (disabled when None)
+metrics_file = None  # Write a Prometheus metrics snapshot to this file periodically (disabled when None)
+metrics_interval = 10  # Seconds between metrics snapshots
+alert_close_timeout = 15  # Seconds the last alert digest may take on exit before it is given up
+
+
+# Runs the streaming detectors on a packet and stores it
+def record_packet(src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port, tcp_flags=0):
+    # Per-stage timing only happens when metrics are enabled (and for sampled packets)
+    timer = metrics.timer('record_packet') if metrics.enabled else None
+    # The analysis state is shared by all analysis workers
+    with record_lock:
+        if metrics.enabled:
+            packets_counter.inc()
+            bytes_counter.inc(packet_size)
+        if timer:
+            timer.lap('lock_wait')
+
+        # Aggregating the packet into its 5-tuple flow
+        flow_table.update(timestamp, src_ip, dst_ip, protocol, source_port, destination_port, packet_size,
+                          tcp_flags)
+        if timer:
+            timer.lap('flow_table')
+
+        if destination_port:
+            # Streaming port scan detection, alerts fire while capture is running
+            port_scan_detector.update(timestamp, src_ip, destination_port)
+            if timer:
+                timer.lap('port_scan_detector')
+
+        ddos_detector.update(timestamp, dst_ip, packet_size)
+        if timer:
+            timer.lap('ddos_detector')
+
+        # Deny list check: one binary search per address
+        if deny_index:
+            denied = deny_index.lookup_one(src_ip) or deny_index.lookup_one(dst_ip)
+            if denied is not None:
+                send_alert(f"Traffic to or from denied network {denied}", kind='deny_list', subject=denied)
+            if timer:
+                timer.lap('deny_list')
+
+        # Detection rules: one compiled closure chain per rule, hits are sent as alerts
+        if rule_set:
+            rule_set.update(src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port,
+                            tcp_flags)
+            if timer:
+                timer.lap('rules')
+
+        # Storing data in the columnar packet store (amortized O(1) per packet)
+        store.append(src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port, tcp_flags)
+        if timer:
+            timer.lap('store')
+        if len(store) - persisted_packets >= persist_batch:
+            persist_packets()
+            if timer:
+                timer.lap('persist')
+
+
+# Feeds a TCP segment of an HTTP connection to the stream reassembly
+def record_http_segment(timestamp, src_ip, dst_ip, source_port, destination_port, seq, tcp_flags, payload):
+    timer = metrics.timer('record_http_segment') if metrics.enabled else None
+    with record_lock:
+        http_analyzer.process(timestamp, src_ip, dst_ip, source_port, destination_port, seq, tcp_flags, payload)
+    if timer:
+        timer.lap('http')
+
+
+# Writes the packets stored since the last call to the segment files
+def persist_packets():
+    global persisted_packets
+    columns = store.columns()
+    segment_writer.write({name: column[persisted_packets:] for name, column in columns.items()})
+    persisted_packets = len(store)
 
 
 # A function to process each packet
 def packet_handler(packetArg):
+    timer = metrics.timer('packet_handler') if metrics.enabled else None
     # Extracting information from the package
     ip_layer = packetArg[IP]
-    src_ip = ip_layer.src
-    dst_ip = ip_layer.dst
+    src_ip = ip_to_int(ip_layer.src)
+    dst_ip = ip_to_int(ip_layer.dst)
     protocol = ip_layer.proto
-    timestamp = packetArg.time
+    timestamp = float(packetArg.time)
     packet_size = len(packetArg)
-
-    # Storing data in a DataFrame
-    data = {'src_ip': src_ip, 'dst_ip': dst_ip, 'protocol': protocol, 'timestamp': timestamp}
-    global df
-    df = df.append(data, ignore_index=True)
-
-
-def send_alert(message):
-    # Alert sending function
-    msg = MIMEText(message)
-    msg['Subject'] = 'Alert: Suspicious Activity Detected'
-    msg['From'] = 'your_email@example.com'
-    msg['To'] = 'recipient@example.com'
-
-    with smtplib.SMTP('smtp.example.com', 587) as server:
-        server.starttls()
-        server.login('your_email@example.com', 'your_password')
-        server.send_message(msg)
+    source_port = destination_port = tcp_flags = 0
+    if TCP in packetArg or UDP in packetArg:
+        transport_layer = packetArg[TCP] if TCP in packetArg else packetArg[UDP]
+        source_port = transport_layer.sport
+        destination_port = transport_layer.dport
+        if TCP in packetArg:
+            tcp_flags = int(packetArg[TCP].flags)
+    if timer:
+        timer.lap('scapy_extract')
+
+    record_packet(src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port, tcp_flags)
+
+    if TCP in packetArg and (source_port in http_analyzer.ports or destination_port in http_analyzer.ports):
+        tcp_layer = packetArg[TCP]
+        record_http_segment(timestamp, src_ip, dst_ip, source_port, destination_port, tcp_layer.seq, tcp_flags,
+                            bytes(tcp_layer.payload))
+
+
+# Fast path: processes a raw frame without building a scapy packet
+def raw_packet_handler(frame, timestamp, linktype=LINKTYPE_ETHERNET, packet_class=Ether):
+    timer = metrics.timer('raw_packet_handler') if metrics.enabled else None
+    decoded = decode_frame(frame, 0, len(frame), linktype)
+    if timer:
+        timer.lap('decode')
+    if decoded is None:
+        # Frames the fixed-offset decoder does not understand get a full scapy dissection
+        packet = packet_class(frame)
+        packet.time = timestamp
+        if timer:
+            timer.lap('scapy_dissect')
+        if IP in packet:
+            packet_handler(packet)
+        return
+    ip_version, src_ip, dst_ip, protocol, source_port, destination_port, tcp_flags = decoded
+    if ip_version != 4:
+        return  # The packet store holds IPv4 addresses only
+    record_packet(src_ip, dst_ip, protocol, timestamp, len(frame), source_port, destination_port, tcp_flags)
+
+    # Only the segments of HTTP connections are decoded down to their payload
+    if protocol == 6 and (source_port in http_analyzer.ports or destination_port in http_analyzer.ports):
+        segment = decode_tcp_segment(frame, 0, len(frame), linktype)
+        if segment is not None:
+            record_http_segment(timestamp, *segment)
+
+
+def send_alert(message, kind=None, subject=None):
+    # Alert sending function: queues the alert, the dispatcher sends it in the next digest
+    # (alerts of the same kind about the same subject are merged into one digest line)
+    timer = metrics.timer('send_alert') if metrics.enabled else None
+    alert_dispatcher.submit(message, kind=kind, subject=subject)
+    if timer:
+        timer.lap('send_alert')
 
 
 def detect_port_scan(df, threshold_port_count=10, threshold_unique_ips=5, window_size=60):
@@ -55,12 +197,13 @@ def detect_port_scan(df, threshold_port_count=10, threshold_unique_ips=5, window
     A list of indices of rows that are likely to contain port scans
     """
 
+    groups = df.groupby(['destination_port', pd.Grouper(key='timestamp', freq=f'{window_size}s')])
+
     # Create a new column to count the number of requests to each port in each time window
-    df['port_count'] = df.groupby(['destination_port', pd.Grouper(key='timestamp', freq=f'{window_size}S')]).size()
+    df['port_count'] = groups['src_ip'].transform('size')
 
     # Create a new column to count the number of unique IP addresses for each port in each time window
-    df['unique_ips'] = df.groupby(['destination_port', pd.Grouper(key='timestamp', freq=f'{window_size}S')])[
-        'source_ip'].nunique()
+    df['unique_ips'] = groups['src_ip'].transform('nunique')
 
     # Identify rows with a number of requests or unique IP addresses exceeding a threshold
     suspicious_indices = df[(df['port_count'] > threshold_port_count) | (df['unique_ips'] > threshold_unique_ips)].index
@@ -82,11 +225,13 @@ def detect_ddos(df, threshold_packets=1000, threshold_bytes=1000000, window_size
     A list of indices of rows that are likely to contain a DDoS attack
     """
 
+    groups = df.groupby(pd.Grouper(key='timestamp', freq=f'{window_size}s'))['packet_size']
+
     # Create a new column to count the number of packets in each time window
-    df['count'] = df.groupby(pd.Grouper(key='timestamp', freq=f'{window_size}S')).size()
+    df['count'] = groups.transform('size')
 
-    # Create a new column to calculate traffic volume in each time window
-    df['bytes'] = df.groupby(pd.Grouper(key='timestamp', freq=f'{window_size}S')).size() * df['packet_size'].mean()
+    # Create a new column with the real traffic volume of each time window
+    df['bytes'] = groups.transform('sum')
 
     # Identify rows whose traffic volume packets exceed the threshold
     suspicious_indices = df[(df['count'] > threshold_packets) | (df['bytes'] > threshold_bytes)].index
@@ -94,34 +239,32 @@ def detect_ddos(df, threshold_packets=1000, threshold_bytes=1000000, window_size
     return suspicious_indices
 
 
-def analyze_http_traffic(df):
+def analyze_http_traffic(analyzer, http_df=None):
     """
     HTTP Traffic Analysis Function
 
     Arguments:
-    df: DataFrame containing traffic data
+    analyzer: HttpAnalyzer that reassembled and parsed the HTTP connections of the capture
+    http_df: Optional transactions parsed elsewhere (e.g. by capture shards), whose
+             statistics were merged into analyzer.stats
 
     Output:
-    New DataFrame containing information extracted from HTTP traffic
+    New DataFrame with one row per HTTP transaction (method, host, path, status code, content type)
     """
 
-    # HTTP packet filtering
-    http_df = df[df['protocol'] == 'tcp']  # Suppose the HTTP protocol is transmitted over TCP.
-    http_df = http_df[http_df['http']]  # Checking for the presence of the HTTP layer in the packet
+    if http_df is None:
+        # Connections still open at the end of the capture are closed so their requests are included
+        analyzer.flush()
+        http_df = analyzer.to_dataframe()
+    http_df['url'] = http_df['host'].astype(str) + http_df['path'].astype(str)
 
-    # Extracting information from the HTTP layer
-    http_df['method'] = http_df.http.method
-    http_df['url'] = http_df.http.Host + http_df.http.Path
-    http_df['status_code'] = http_df.http.response.status_code
-    http_df['content_type'] = http_df.http.response.Content_Type
-
-    # Further analysis (example)
+    # Further analysis (example), maintained while the segments were parsed
     # Number of GET requests
-    get_requests = http_df[http_df['method'] == 'GET'].shape[0]
+    get_requests = analyzer.stats.get_requests
     print("Number of GET requests :", get_requests)
 
     # Most used URLs
-    top_urls = http_df['url'].value_counts().head(10)
+    top_urls = analyzer.stats.top_urls(10)
     print("Most commonly used URLs:")
     print(top_urls)
 
@@ -130,81 +273,26 @@ def analyze_http_traffic(df):
     return http_df
 
 
-# Create an empty DataFrame to store data
-df = pd.DataFrame(columns=['src_ip', 'dst_ip', 'protocol', 'timestamp'])
-
-print("Starting to register packages...")
-sniff(prn=packet_handler, filter=bpf_filter, iface=interface, timeout=capture_time)
-
-# Port Scan Detection
-port_scan_indices = detect_port_scan(df)
-if not port_scan_indices.empty:
-    send_alert("Port scan detected!")
-
-# DDoS Attack Detection
-ddos_indices = detect_ddos(df)
-if not ddos_indices.empty:
-    send_alert("DDoS attack detected!")
-
-# HTTP traffic analysis
-http_df = analyze_http_traffic(df)
-
-# Data analysis
-print("Data analysis...")
-print(df.describe())
+# Add the ability to load data from the segment directory (or a CSV file),
+# optionally only a time range and a subset of the columns
+def load_data(file_path, start=None, end=None, columns=None):
+    if os.path.isdir(file_path):
+        return read_segments(file_path, start=start, end=end, columns=columns)
+    df = pd.read_csv(file_path, usecols=columns)
+    # Addresses saved as dotted strings are packed into integers like the segment files
+    for column in ('src_ip', 'dst_ip'):
+        if column in df and not pd.api.types.is_integer_dtype(df[column]):
+            df[column] = ips_to_ints(df[column])
+    return df
 
-# Calculating basic statistics
-print("basic statistics:")
-print(df.describe())
 
-# Identifying high-traffic IP addresses
-top_ips = df['src_ip'].value_counts().head(10)
-print("high-traffic IP addresses:")
-print(top_ips)
-
-# Drawing a protocol distribution diagram
-plt.figure(figsize=(10, 5))
-df['protocol'].value_counts().plot(kind='bar')
-plt.title('Distribution of protocols')
-plt.xlabel('protocols')
-plt.ylabel('Number')
-plt.show()
-
-# Save data to CSV file
-df.to_csv('traffic_data.csv', index=False)
-
-# Traffic analysis based on time
-time_series = df.set_index('timestamp').resample('1T').count()  # Analysis by the minute
-plt.figure(figsize=(10, 5))
-time_series['src_ip'].plot()
-plt.title('Traffic by time')
-plt.xlabel('Time')
-plt.ylabel('Number of packages')
-plt.show()
-
-
-# Add the ability to load data from a CSV file
-def load_data(file_path):
-    return pd.read_csv(file_path)
-
-
-# Add the ability to identify suspicious packages
-def detect_suspicious_packets(df, suspicious_threshold=100):
-    suspicious_packets = df[df['packet_size'] > suspicious_threshold]
-    return suspicious_packets.index
-
-
-suspicious_indices = detect_suspicious_packets(df)
-if not suspicious_indices.empty:
-    send_alert("Suspicious packets detected!")
-
-# Save suspicious data to CSV file
-if not suspicious_indices.empty:
-    df.loc[suspicious_indices].to_csv('suspicious_packets.csv', index=False)
-
-# Displaying suspicious data
-print("suspicious data:")
-print(df.loc[suspicious_indices])
+# Add the ability to identify suspicious packages: every detection rule is evaluated in one pass over the columns
+def detect_suspicious_packets(df, rules=None):
+    matches = (rule_set if rules is None else rules).evaluate(df)
+    suspicious = np.zeros(len(df), dtype=bool)
+    for mask in matches.values():
+        suspicious |= mask
+    return df.index[suspicious], {name: int(mask.sum()) for name, mask in matches.items()}
 
 
 # Adding traffic analysis capability based on protocol
@@ -213,13 +301,423 @@ def analyze_protocol_traffic(df):
     return protocol_analysis
 
 
-protocol_traffic = analyze_protocol_traffic(df)
-print("Traffic analysis based on protocol:")
-print(protocol_traffic)
-
-# Traffic analysis graph based on protocol
-plt.figure(figsize=(10, 5))
-protocol_traffic.plot(kind='pie', autopct='%1.1f%%')
-plt.title('Traffic analysis based on protocol')
-plt.ylabel('')
-plt.show()
+# Traffic volume per asset group, by source and by destination address
+def analyze_asset_groups(df, index):
+    src_groups = index.categorize(df['src_ip'].to_numpy())
+    dst_groups = index.categorize(df['dst_ip'].to_numpy())
+    return pd.DataFrame({
+        'sent_bytes': df['packet_size'].groupby(src_groups, observed=False).sum(),
+        'received_bytes': df['packet_size'].groupby(dst_groups, observed=False).sum(),
+    })
+
+
+def analyze(df, flows_df, report=None, http_df=None):
+    # HTTP traffic analysis
+    http_df = analyze_http_traffic(http_analyzer, http_df)
+
+    # Data analysis
+    print("Data analysis...")
+    print(df.describe())
+
+    # Calculating basic statistics
+    print("basic statistics:")
+    print(df.describe())
+
+    # Identifying high-traffic IP addresses (from the flow records, not the packets)
+    print("Number of flows:", len(flows_df))
+    top_ips = flows_df.groupby('src_ip')['packets'].sum().nlargest(10).rename(index=int_to_ip)
+    print("high-traffic IP addresses:")
+    print(top_ips)
+
+    # Traffic analysis based on time, pre-aggregated by the minute
+    time_series = per_minute_counts(df['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64))
+
+    if report is not None:
+        report.add_text("Capture", f"{len(df)} packets, {len(flows_df)} flows, {len(http_df)} HTTP transactions")
+        report.add_table("High-traffic IP addresses", top_ips)
+        if len(http_df):
+            report.add_table("Most commonly used URLs", http_analyzer.stats.top_urls(10).rename('requests'))
+
+        # Drawing a protocol distribution diagram
+        report.add_bar('protocols.png', 'Distribution of protocols', df['protocol'].value_counts(),
+                       xlabel='protocols', ylabel='Number')
+
+        # Downsampled, so the chart costs the same for an hour or a week of capture
+        report.add_time_series('traffic_by_time.png', 'Traffic by time', time_series, xlabel='Time',
+                               ylabel='Number of packages')
+
+    suspicious_indices, rule_counts = detect_suspicious_packets(df)
+    if not suspicious_indices.empty:
+        send_alert("Suspicious packets detected! " + ", ".join(f"{name}: {count} packets"
+                                                                for name, count in rule_counts.items() if count))
+
+    # Save suspicious data to CSV file
+    if not suspicious_indices.empty:
+        df.loc[suspicious_indices].to_csv('suspicious_packets.csv', index=False)
+
+    # Displaying suspicious data
+    print("suspicious data:")
+    print(df.loc[suspicious_indices])
+    print("Packets matched per rule:", rule_counts)
+    if report is not None:
+        report.add_text("Suspicious packets", f"{len(suspicious_indices)} packets (see suspicious_packets.csv)")
+        report.add_table("Packets matched per rule", pd.Series(rule_counts, dtype='int64').rename('packets'))
+
+    if asset_index:
+        asset_traffic = analyze_asset_groups(df, asset_index)
+        print("Traffic per asset group:")
+        print(asset_traffic)
+        if report is not None:
+            report.add_table("Traffic per asset group", asset_traffic)
+
+    protocol_traffic = analyze_protocol_traffic(df)
+    print("Traffic analysis based on protocol:")
+    print(protocol_traffic)
+
+    # Traffic analysis graph based on protocol
+    if report is not None and len(protocol_traffic):
+        report.add_pie('protocol_traffic.png', 'Traffic analysis based on protocol', protocol_traffic)
+
+
+# Summary of the packets, flows and detections of one report window
+def summarize_window(window_start, window_end, top_n=10):
+    columns = store.columns()
+    src_ips, counts = np.unique(columns['src_ip'], return_counts=True)
+    top = np.argsort(counts)[::-1][:top_n]
+    protocols = np.bincount(columns['protocol'], minlength=256)
+    groups = {}
+    if asset_index:
+        sent = np.bincount(asset_index.lookup(columns['src_ip']) + 1, weights=columns['packet_size'],
+                           minlength=len(asset_index.labels) + 1)
+        groups = {label: int(sent[code + 1]) for code, label in enumerate(asset_index.labels)}
+    return {
+        'window_start': pd.Timestamp(window_start, unit='s').isoformat(),
+        'window_end': pd.Timestamp(window_end, unit='s').isoformat(),
+        'packets': len(store),
+        'bytes': int(columns['packet_size'].sum()),
+        'flows': len(flow_table.store),
+        'top_ips': {int_to_ip(src_ips[i]): int(counts[i]) for i in top},
+        'protocols': {int(protocol): int(protocols[protocol]) for protocol in np.flatnonzero(protocols)},
+        'asset_group_bytes_sent': groups,
+        'port_scan_alerts': [alert._asdict() for alert in port_scan_detector.alerts],
+        'rule_alerts': [format_hit(hit) for hit in rule_set.alerts],
+        'http': {
+            'transactions': len(http_analyzer.store),
+            'get_requests': http_analyzer.stats.get_requests,
+            'status_codes': {int(code): count for code, count in http_analyzer.stats.status_codes.items()},
+            'top_urls': http_analyzer.stats.top_urls(top_n).to_dict(),
+        },
+        'ddos_alerts': [{**alert._asdict(), 'top_destinations': [(int_to_ip(dst), count, error)
+                                                                 for dst, count, error in alert.top_destinations]}
+                        for alert in ddos_detector.alerts],
+    }
+
+
+# Ends a report window: saves its packets, emits its summary and releases its memory
+def close_window(window_start, window_end, report_path):
+    global persisted_packets
+    with record_lock:
+        persist_packets()
+        summary = summarize_window(window_start, window_end)
+        # The buffers keep their capacity, so memory stays flat from one window to the next
+        store.clear()
+        persisted_packets = 0
+        flow_table.store.clear()
+        port_scan_detector.alerts.clear()
+        ddos_detector.alerts.clear()
+        rule_set.alerts.clear()
+        http_analyzer.store.clear()
+        http_analyzer.stats.clear()
+
+    print("Window report:", json.dumps(summary))
+    with open(report_path, 'a') as report_file:
+        report_file.write(json.dumps(summary) + '\n')
+
+
+# Alerts are coalesced per minute and e-mailed from a background thread over one SMTP connection
+alert_dispatcher = AlertDispatcher([
+    SMTPSink('smtp.example.com', 587, username='your_email@example.com', password='your_password',
+             sender='your_email@example.com', recipients=['recipient@example.com']),
+])
+
+# Hot-path instrumentation, switched on by --metrics-port / --metrics-file
+metrics = Metrics()
+packets_counter = metrics.counter('packets', "Packets analysed")
+bytes_counter = metrics.counter('bytes', "Bytes analysed")
+metrics.gauge('stored_packets', "Packets held in the packet store", lambda: len(store))
+metrics.gauge('active_flows', "Flows tracked by the flow table", lambda: len(flow_table))
+metrics.gauge('http_connections', "Connections tracked by the HTTP reassembly", lambda: len(http_analyzer))
+metrics.counter_function('late_packets', "Packets too old for the detector windows",
+                         lambda: port_scan_detector.late_packets, detector='port_scan')
+metrics.counter_function('late_packets', "Packets too old for the detector windows",
+                         lambda: ddos_detector.late_packets, detector='ddos')
+metrics.counter_function('late_packets', "Packets too old for the detector windows",
+                         lambda: rule_set.late_packets, detector='rules')
+metrics.counter_function('alerts_submitted', "Alerts queued for the dispatcher", lambda: alert_dispatcher.submitted)
+metrics.gauge('alert_queue_depth', "Alerts waiting for the next digest", lambda: alert_dispatcher.pending())
+metrics.counter_function('alerts_dropped', "Alerts dropped because the alert queue was full",
+                         lambda: alert_dispatcher.dropped)
+metrics.counter_function('alert_digests', "Digests sent", lambda: alert_dispatcher.sent_digests, result='sent')
+metrics.counter_function('alert_digests', "Digests sent", lambda: alert_dispatcher.failed_digests, result='failed')
+
+
+# Exposes the counters of a capture pipeline (evaluated when the metrics are read)
+def register_pipeline_metrics(pipeline):
+    metrics.gauge('capture_queue_depth', "Frames waiting in the capture ring", lambda: len(pipeline.ring))
+    metrics.gauge('capture_queue_high_watermark', "Highest capture ring depth", lambda: pipeline.ring.high_watermark)
+    metrics.counter_function('captured_frames', "Frames read from the capture socket",
+                             lambda: pipeline.ring.pushed + pipeline.ring.dropped)
+    metrics.counter_function('dropped_frames', "Frames dropped", lambda: pipeline.ring.dropped, where='ring')
+    metrics.counter_function('dropped_frames', "Frames dropped", lambda: pipeline.kernel_drops, where='kernel')
+    metrics.counter_function('handler_errors', "Frames the analysis failed on", lambda: pipeline.handler_errors)
+
+
+# Create an empty columnar store for the captured packets
+store = PacketStore()
+record_lock = threading.Lock()
+
+# Captured packets are streamed to disk while the capture runs
+segment_writer = SegmentWriter(output_directory)
+persisted_packets = 0
+
+# Flow table aggregating packets per 5-tuple
+flow_table = FlowTable()
+
+# CIDR lookups are binary searches over prebuilt interval indexes
+deny_index = CidrIndex(deny_networks)
+asset_index = CidrIndex((network, group) for group, networks in asset_groups.items() for network in networks)
+
+# Detection rules, compiled once into per-packet closures and column masks
+rule_set = RuleSet(detection_rules,
+                   on_alert=lambda hit: send_alert(format_hit(hit), kind='rule:' + hit.rule, subject=hit.key))
+
+# TCP reassembly and HTTP parsing of the connections to the HTTP ports
+http_analyzer = HttpAnalyzer()
+
+# Port scan detection runs per packet during capture
+port_scan_detector = PortScanDetector(
+    on_alert=lambda alert: send_alert(f"Port scan detected on port {alert.destination_port}: "
+                                      f"{alert.packet_count} requests from ~{alert.unique_sources} sources",
+                                      kind='port_scan', subject=alert.destination_port))
+
+# DDoS detection keeps exact sliding window totals and the heaviest destinations
+ddos_detector = DDoSDetector(
+    on_alert=lambda alert: send_alert(
+        f"DDoS attack detected: {alert.packet_count} packets / {alert.byte_count} bytes in the last window, "
+        f"top destinations: {', '.join(int_to_ip(dst) for dst, _, _ in alert.top_destinations[:3])}",
+        kind='ddos', subject=alert.top_destinations[0][0] if alert.top_destinations else None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Network Traffic Analyzer")
+    parser.add_argument('--interface', nargs='+', default=[interface],
+                        help="Network interfaces to capture from")
+    parser.add_argument('--shards', type=int, default=capture_shards,
+                        help="Capture processes per interface in fast mode (sharded by flow)")
+    parser.add_argument('--filter', default=bpf_filter, help="BPF filter applied to the live capture")
+    parser.add_argument('--capture-time', type=int, default=capture_time, help="Capture time in seconds")
+    parser.add_argument('--capture-mode', choices=['fast', 'scapy'], default=capture_mode,
+                        help="Decode raw frames with the fast-path decoder or dissect them with scapy")
+    parser.add_argument('--pcap', help="Analyze a pcap/pcapng file instead of capturing live")
+    parser.add_argument('--workers', type=int, help="Worker processes used to parse the pcap file")
+    parser.add_argument('--http', action='store_true',
+                        help="Also reassemble the HTTP connections of the pcap file (one extra sequential pass)")
+    parser.add_argument('--output-dir', default=output_directory, help="Directory of the saved packet segments")
+    parser.add_argument('--ring-size', type=int, default=ring_size,
+                        help="Frames buffered between the capture thread and the analysis workers")
+    parser.add_argument('--analysis-workers', type=int, default=analysis_workers,
+                        help="Threads draining the capture ring in fast mode")
+    parser.add_argument('--socket-buffer', type=int, default=socket_buffer,
+                        help="Kernel receive buffer of the capture socket in bytes")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Capture until stopped and report every --report-interval seconds")
+    parser.add_argument('--report-interval', type=int, default=report_interval,
+                        help="Length of the daemon report windows in seconds")
+    parser.add_argument('--report-dir', default=report_directory, help="Directory of the HTML/PNG report")
+    parser.add_argument('--no-report', action='store_true', help="Only print the analysis, draw no charts")
+    parser.add_argument('--metrics-port', type=int, default=metrics_port,
+                        help="Serve Prometheus metrics on this local port")
+    parser.add_argument('--metrics-file', default=metrics_file, help="Write Prometheus metrics snapshots to this file")
+    parser.add_argument('--metrics-interval', type=float, default=metrics_interval,
+                        help="Seconds between metrics snapshots")
+    parser.add_argument('--deny', action='append', default=[], metavar='CIDR',
+                        help="Alert on traffic to or from this network (repeatable)")
+    parser.add_argument('--rules', action='append', default=[], metavar='FILE',
+                        help="Also apply the detection rules of this JSON file (repeatable)")
+    parser.add_argument('--asset-group', action='append', default=[], metavar='NAME=CIDR[,CIDR...]',
+                        help="Report traffic of these networks under NAME (repeatable)")
+    args = parser.parse_args()
+    if args.daemon and args.capture_mode == 'fast' and (len(args.interface) > 1 or args.shards > 1):
+        parser.error("sharded capture (--shards, several interfaces) is only available for timed captures")
+
+    for network in args.deny:
+        deny_index.add(network)
+    for path in args.rules:
+        for rule in load_rules(path):
+            rule_set.add(rule)
+    for group in args.asset_group:
+        name, _, networks = group.partition('=')
+        for network in networks.split(','):
+            asset_index.add(network, name)
+
+    segment_writer.directory = args.output_dir
+    metrics_exporters = []
+    if args.metrics_port is not None or args.metrics_file:
+        metrics.enabled = True
+        if args.metrics_port is not None:
+            metrics_exporters.append(MetricsServer(metrics, args.metrics_port).start())
+        if args.metrics_file:
+            metrics_exporters.append(SnapshotWriter(metrics, args.metrics_file, args.metrics_interval).start())
+
+    alert_dispatcher.start()
+    try:
+        if args.daemon:
+            run_daemon(args)
+        else:
+            run(args)
+    finally:
+        # Saves the remaining packets and sends the last digest
+        persist_packets()
+        segment_writer.close()
+        if not alert_dispatcher.close(timeout=alert_close_timeout):
+            print("Gave up sending the last alert digest")
+        for exporter in metrics_exporters:
+            exporter.close()
+
+
+def run(args):
+    http_df = None
+    if args.pcap:
+        print("Reading packets from", args.pcap)
+        read_pcap(args.pcap, store=store, workers=args.workers)
+        if args.http:
+            for frame, timestamp, linktype in iter_frames(args.pcap):
+                segment = decode_tcp_segment(frame, 0, len(frame), linktype)
+                if segment is not None:
+                    http_analyzer.process(timestamp, *segment)
+        df = store.to_dataframe()
+        flow_table.ingest(store.columns())
+        flow_table.flush()
+        flows_df = flow_table.to_dataframe()
+
+        # Port Scan Detection (each probe of a scan opens its own flow)
+        port_scan_indices = detect_port_scan(flows_df.rename(columns={'first_seen': 'timestamp'}))
+        if not port_scan_indices.empty:
+            send_alert("Port scan detected!")
+
+        # DDoS Attack Detection
+        ddos_indices = detect_ddos(df)
+        if not ddos_indices.empty:
+            send_alert("DDoS attack detected!")
+
+        # Deny list check over the whole address columns
+        if deny_index:
+            columns = store.columns()
+            denied = deny_index.contains(columns['src_ip']) | deny_index.contains(columns['dst_ip'])
+            if denied.any():
+                send_alert(f"{int(denied.sum())} packets to or from denied networks")
+    else:
+        print("Starting to register packages...")
+        sharded = args.capture_mode == 'fast' and (len(args.interface) > 1 or args.shards > 1)
+        if sharded:
+            df, http_df = capture_sharded(args)
+        elif args.capture_mode == 'fast':
+            # The capture thread only queues raw frames, the workers decode and analyse them
+            pipeline = CapturePipeline(args.interface[0], args.filter, raw_packet_handler, ring_size=args.ring_size,
+                                       workers=args.analysis_workers, socket_buffer=args.socket_buffer)
+            register_pipeline_metrics(pipeline)
+            pipeline.run(args.capture_time)
+            print("Capture statistics:", pipeline.stats())
+        else:
+            sniff(prn=packet_handler, filter=args.filter, iface=args.interface, timeout=args.capture_time,
+                  store=False)
+
+        # Build the DataFrames once, over views of the stores, when the analysis starts
+        if not sharded:
+            df = store.to_dataframe()
+        flow_table.flush()
+        flows_df = flow_table.to_dataframe()
+
+        # Port Scan Detection (alerts were already sent during capture)
+        print("Port scan alerts:", len(port_scan_detector.alerts))
+
+        # DDoS Attack Detection (alerts were already sent during capture)
+        print("DDoS alerts:", len(ddos_detector.alerts))
+
+    report = None if args.no_report else Report(args.report_dir)
+    analyze(df, flows_df, report, http_df)
+    if report is not None:
+        print("Report written to", report.save())
+
+
+# Captures with one process per shard and merges the shards' detector state and results;
+# returns the packets (read back from the shards' segments) and the HTTP transactions
+def capture_sharded(args):
+    def on_partials(shard_id, partials):
+        with record_lock:
+            denied = apply_partials(partials, port_scan_detector, ddos_detector)
+        for network, packets in denied.items():
+            send_alert(f"Traffic to or from denied network {network} ({packets} packets)", kind='deny_list',
+                       subject=network)
+
+    capture = ShardedCapture(args.interface, args.filter, args.shards, on_partials, options={
+        'window_size': port_scan_detector.window_size,
+        'precision': port_scan_detector.precision,
+        'bucket_size': ddos_detector.bucket_size,
+        'top_k': ddos_detector.top_k,
+        'output_directory': args.output_dir,
+        'persist_batch': persist_batch,
+        'ring_size': args.ring_size,
+        'socket_buffer': args.socket_buffer,
+        'deny_networks': list(deny_networks) + args.deny,
+    })
+    results = capture.run(args.capture_time)
+    with record_lock:
+        span = merge_results(results, flow_table.store, http_analyzer.stats)
+    for result in results:
+        print(f"Capture statistics of shard {result['shard_id']}:", result['capture'])
+    # The shards saved their packets; only this capture's time range is read back
+    if span is None:
+        df = store.to_dataframe()
+    else:
+        df = read_segments(args.output_dir, start=pd.Timestamp(span[0]), end=pd.Timestamp(span[1]))
+    return df, read_http_results(results)
+
+
+def run_daemon(args):
+    # Long-running mode: capture continuously and analyse in tumbling windows
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = os.path.join(args.output_dir, 'window_reports.jsonl')
+
+    print("Starting continuous capture, reporting every", args.report_interval, "seconds...")
+    if args.capture_mode == 'fast':
+        pipeline = CapturePipeline(args.interface[0], args.filter, raw_packet_handler, ring_size=args.ring_size,
+                                   workers=args.analysis_workers, socket_buffer=args.socket_buffer)
+        register_pipeline_metrics(pipeline)
+        pipeline.start()
+        stop_capture = pipeline.stop
+    else:
+        sniffer = AsyncSniffer(prn=packet_handler, filter=args.filter, iface=args.interface, store=False)
+        sniffer.start()
+        stop_capture = sniffer.stop
+
+    window_start = time.time()
+    try:
+        while not stop.wait(window_start + args.report_interval - time.time()):
+            window_end = time.time()
+            close_window(window_start, window_end, report_path)
+            if args.capture_mode == 'fast':
+                print("Capture statistics:", pipeline.stats())
+            window_start = window_end
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_capture()
+        flow_table.flush()
+        close_window(window_start, time.time(), report_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import queue
+import smtplib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from email.mime.text import MIMEText
+
+# kind and subject identify what an alert is about (e.g. 'port_scan' and the port), so repeated
+# detections of the same thing are merged even when their message text differs
+Alert = namedtuple('Alert', ['timestamp', 'message', 'kind', 'subject'], defaults=(None, None))
+
+
+class SMTPSink:
+    """
+    Alert sink sending digests by e-mail
+
+    One SMTP connection is opened on first use and reused for every digest. When the
+    server has dropped it, the sink reconnects once before reporting the failure.
+
+    Arguments:
+    host, port: SMTP server
+    username, password: Login credentials (no login when username is None)
+    sender: From address
+    recipients: List of To addresses
+    starttls: Upgrade the connection with STARTTLS
+    timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None, recipients=(), starttls=True,
+                 timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.recipients = list(recipients)
+        self.starttls = starttls
+        self.timeout = timeout
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+
+    def send(self, subject, body):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(self.recipients)
+
+        if self._server is None:
+            self._connect()
+            self._server.send_message(msg)
+            return
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The pooled connection went stale, reconnect once
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+
+class PrintSink:
+    """Alert sink printing digests to standard output."""
+
+    def send(self, subject, body):
+        print(subject)
+        print(body)
+
+    def close(self):
+        pass
+
+
+class AlertDispatcher:
+    """
+    Asynchronous, batched alert dispatcher
+
+    submit() only puts the alert on a bounded queue, so detections never wait for
+    the network. A background worker collects the alerts of each window seconds,
+    merges the alerts about the same kind and subject (identical messages when no
+    kind is given) and sends one digest per window to every sink. A failing sink is
+    retried with exponential backoff, also while closing; alerts keep queueing in
+    the meantime and are dropped (and counted) only when the queue is full. The
+    worker closes the sinks when it exits, so they are never closed while in use.
+
+    Arguments:
+    sinks: Objects with send(subject, body) and close() methods
+    window: Seconds during which alerts are coalesced into one digest
+    subject: Subject prefix of the digests
+    max_queue: Maximum number of queued alerts
+    max_lines: Maximum number of distinct messages listed in one digest
+    retries: Delivery attempts per sink and digest
+    initial_backoff, max_backoff: Bounds of the retry delay in seconds
+    """
+
+    def __init__(self, sinks, window=60, subject='Alert: Suspicious Activity Detected', max_queue=10000,
+                 max_lines=50, retries=5, initial_backoff=1, max_backoff=300):
+        self.sinks = list(sinks)
+        self.window = window
+        self.subject = subject
+        self.max_lines = max_lines
+        self.retries = retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.submitted = 0
+        self.dropped = 0
+        self.sent_digests = 0
+        self.failed_digests = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        # Set when close() stops waiting for the worker: the digest being sent is not retried any more
+        self._abandon = threading.Event()
+        self._worker = None
+
+    def start(self):
+        """Starts the background worker (idempotent)."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+            self._worker.start()
+        return self
+
+    def submit(self, message, timestamp=None, kind=None, subject=None):
+        """
+        Queues an alert without blocking; returns False when it had to be dropped.
+
+        Alerts with the same kind and subject (e.g. 'port_scan' and the port) are merged in
+        the digest; without a kind, only identical messages are.
+        """
+        try:
+            self._queue.put_nowait(Alert(time.time() if timestamp is None else timestamp, message, kind, subject))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def pending(self):
+        """Returns the number of alerts waiting in the queue."""
+        return self._queue.qsize()
+
+    def close(self, timeout=None):
+        """
+        Sends what is queued as a final digest, stops the worker and closes the sinks.
+
+        The final digest is retried with the same backoff as any other; timeout bounds
+        how long close waits for the worker (None waits for every attempt). When it
+        runs out, the digest is not retried any more and counts as failed once the
+        attempt in progress ends, and the worker closes the sinks when it exits.
+
+        Output:
+        True when the worker has exited and the sinks are closed
+        """
+        self._stop.set()
+        if self._worker is None:
+            self._drain()
+            self._close_sinks()
+            return True
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            self._abandon.set()
+            return False
+        self._worker = None
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+                except queue.Empty:
+                    pass
+            self._deliver(batch + self._take_all())
+        self._drain()
+        self._close_sinks()
+
+    def _close_sinks(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def _take_all(self):
+        alerts = []
+        while True:
+            try:
+                alerts.append(self._queue.get_nowait())
+            except queue.Empty:
+                return alerts
+
+    def _drain(self):
+        batch = self._take_all()
+        if batch:
+            self._deliver(batch)
+
+    def _digest(self, batch):
+        # Alerts about the same kind and subject are merged into one line with the latest
+        # message, their count and time range
+        merged = OrderedDict()
+        for alert in batch:
+            key = alert.message if alert.kind is None else (alert.kind, alert.subject)
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [1, alert.timestamp, alert.timestamp, alert.message]
+            else:
+                entry[0] += 1
+                entry[2] = alert.timestamp
+                entry[3] = alert.message
+
+        lines = []
+        for count, first, last, message in list(merged.values())[:self.max_lines]:
+            when = time.strftime('%H:%M:%S', time.localtime(first))
+            until = time.strftime('%H:%M:%S', time.localtime(last))
+            if until != when:
+                when += '-' + until
+            if count > 1:
+                message += f" (x{count})"
+            lines.append(f"[{when}] {message}")
+        if len(merged) > self.max_lines:
+            lines.append(f"... and {len(merged) - self.max_lines} more distinct alerts")
+        subject = f"{self.subject} ({len(batch)} alert{'s' if len(batch) != 1 else ''})"
+        return subject, '\n'.join(lines)
+
+    def _deliver(self, batch):
+        subject, body = self._digest(batch)
+        for sink in self.sinks:
+            backoff = self.initial_backoff
+            for attempt in range(self.retries):
+                try:
+                    sink.send(subject, body)
+                    self.sent_digests += 1
+                    break
+                except Exception as e:
+                    print(f"Error sending alert digest ({attempt + 1}/{self.retries}): {e}")
+                    # The backoff also applies while closing, so the final digest is not retried
+                    # back-to-back; it is given up when close() stops waiting for it
+                    if attempt + 1 == self.retries or self._abandon.wait(backoff):
+                        self.failed_digests += 1
+                        break
+                    backoff = min(backoff * 2, self.max_backoff)
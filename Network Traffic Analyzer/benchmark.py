@@ -0,0 +1,337 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scapy.all import Ether
+from scapy.layers.inet import IP, TCP, UDP, ICMP
+
+from alerts import AlertDispatcher
+from decoder import decode_frame, LINKTYPE_ETHERNET
+from detectors import PortScanDetector, DDoSDetector
+from packet_store import PacketStore, ip_to_int
+from traffic_generator import generate
+
+ANALYZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Network Traffic Analyzer.py')
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+# Detector thresholds of the replay: the analyzer's own defaults, fixed so detection accuracy
+# is comparable across runs, rates and durations (the command line options override them)
+PORT_SCAN_THRESHOLDS = {'threshold_port_count': 10, 'threshold_unique_ips': 5}
+DDOS_THRESHOLDS = {'threshold_packets': 1000, 'threshold_bytes': 1_000_000}
+
+
+def build_frames(count, seed=0):
+    """
+    Builds a list of raw Ethernet frames with a TCP/UDP/ICMP mix
+
+    Arguments:
+    count: Number of frames
+    seed: Random seed, so runs are comparable
+
+    Output:
+    A list of bytes objects
+    """
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        ip = IP(src=f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                dst=f"192.168.{rng.randrange(4)}.{rng.randrange(1, 255)}")
+        kind = rng.random()
+        if kind < 0.7:
+            transport = TCP(sport=rng.randrange(1024, 65536), dport=rng.choice([80, 443, 22, 8080]))
+        elif kind < 0.95:
+            transport = UDP(sport=rng.randrange(1024, 65536), dport=rng.choice([53, 123, 5353]))
+        else:
+            transport = ICMP()
+        payload = bytes(rng.randrange(0, 1200))
+        frames.append(bytes(Ether() / ip / transport / payload))
+    return frames
+
+
+def scapy_path(frames, timestamps):
+    # The extraction done by packet_handler on a fully dissected scapy packet
+    store = PacketStore()
+    for frame, timestamp in zip(frames, timestamps):
+        packet = Ether(frame)
+        ip_layer = packet[IP]
+        source_port = destination_port = tcp_flags = 0
+        if TCP in packet or UDP in packet:
+            transport_layer = packet[TCP] if TCP in packet else packet[UDP]
+            source_port = transport_layer.sport
+            destination_port = transport_layer.dport
+            if TCP in packet:
+                tcp_flags = int(packet[TCP].flags)
+        store.append(ip_to_int(ip_layer.src), ip_to_int(ip_layer.dst), ip_layer.proto, timestamp, len(packet),
+                     source_port, destination_port, tcp_flags)
+    return store
+
+
+def fast_path(frames, timestamps):
+    # The extraction done by raw_packet_handler with the fixed-offset decoder
+    store = PacketStore()
+    for frame, timestamp in zip(frames, timestamps):
+        ip_version, src_ip, dst_ip, protocol, source_port, destination_port, tcp_flags = decode_frame(frame)
+        store.append(src_ip, dst_ip, protocol, timestamp, len(frame), source_port, destination_port, tcp_flags)
+    return store
+
+
+def run(path, frames, timestamps, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        path(frames, timestamps)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(frames) / best
+
+
+def load_analyzer(output_directory):
+    """
+    Imports a fresh copy of the analyzer script (its file name is not importable)
+    with its segments written to output_directory and its alerts kept, not sent
+    """
+    spec = importlib.util.spec_from_file_location('network_traffic_analyzer', ANALYZER_PATH)
+    analyzer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(analyzer)
+    analyzer.segment_writer.directory = output_directory
+    analyzer.alert_dispatcher = AlertDispatcher([])
+    return analyzer
+
+
+def configure_detectors(analyzer, port_scan_options, ddos_options):
+    # Same alert callbacks as the analyzer, but every alert is kept for scoring
+    analyzer.port_scan_detector = PortScanDetector(on_alert=analyzer.port_scan_detector.on_alert, max_alerts=None,
+                                                   **port_scan_options)
+    analyzer.ddos_detector = DDoSDetector(on_alert=analyzer.ddos_detector.on_alert, max_alerts=None, **ddos_options)
+
+
+def replay(packets, handler, rate=None):
+    """
+    Pushes (timestamp, frame) pairs through handler(frame, timestamp)
+
+    Arguments:
+    packets: Time-ordered (timestamp, frame) pairs
+    handler: Callable invoked for every packet
+    rate: Packets per second to replay at (as fast as possible when None)
+
+    Output:
+    A (latencies, elapsed) tuple: an int64 array of per-packet handler times in
+    nanoseconds and the total replay time in seconds
+    """
+    clock = time.perf_counter_ns
+    latencies = np.empty(len(packets), dtype=np.int64)
+    interval = 1_000_000_000 / rate if rate else 0
+    start = clock()
+    for i, (timestamp, frame) in enumerate(packets):
+        if interval:
+            delay = start + int(i * interval) - clock()
+            if delay > 0:
+                time.sleep(delay / 1_000_000_000)
+        before = clock()
+        handler(frame, timestamp)
+        latencies[i] = clock() - before
+    return latencies, (clock() - start) / 1_000_000_000
+
+
+def background_ports(packets, scenarios, window_size):
+    """
+    Counts the packets and distinct sources of every (window start, destination port)
+    pair, leaving out the packets sent by the scanners of scenarios
+
+    Output:
+    A dict mapping (window_start, destination_port) to a [packets, sources] list
+    """
+    scanners = {source for scenario in scenarios if scenario.kind == 'port_scan' for source in scenario.sources}
+    counts = {}
+    for timestamp, frame in packets:
+        _, src_ip, _, _, _, destination_port, _ = decode_frame(frame)
+        if src_ip in scanners:
+            continue
+        key = (int(timestamp // window_size) * window_size, destination_port)
+        entry = counts.get(key)
+        if entry is None:
+            entry = counts[key] = [0, set()]
+        entry[0] += 1
+        entry[1].add(src_ip)
+    return counts
+
+
+def score(packets, scenarios, port_scan_detector, ddos_detector):
+    """
+    Matches the detectors' alerts against the injected scenarios
+
+    A port scan alert matches a scan when its port was probed, its window overlaps
+    the scan and the other traffic to the port in that window stays below the
+    detector's thresholds, i.e. the alert would not have fired without the scan. A
+    DDoS alert matches a flood when it fires during the flood or the following
+    window. Every other alert counts as a false alert, including port scan alerts
+    raised by a flood.
+    """
+    window_size = port_scan_detector.window_size
+    background = background_ports(packets, scenarios, window_size)
+
+    def caused_by_scan(alert):
+        count, sources = background.get((alert.window_start, alert.destination_port), (0, ()))
+        return (count <= port_scan_detector.threshold_port_count
+                and len(sources) <= port_scan_detector.threshold_unique_ips)
+
+    results = {}
+    matchers = {
+        'port_scan': (list(port_scan_detector.alerts),
+                      lambda scenario, alert: alert.destination_port in scenario.ports
+                      and alert.window_start <= scenario.end and scenario.start < alert.window_start + window_size
+                      and caused_by_scan(alert)),
+        'ddos': (list(ddos_detector.alerts),
+                 lambda scenario, alert: scenario.start <= alert.window_end <= scenario.end + window_size + 1),
+    }
+    for kind, (alerts, matches) in matchers.items():
+        expected = [scenario for scenario in scenarios if scenario.kind == kind]
+        detected = [scenario for scenario in expected if any(matches(scenario, alert) for alert in alerts)]
+        false_alerts = [alert for alert in alerts if not any(matches(scenario, alert) for scenario in expected)]
+        results[kind] = {'scenarios': len(expected), 'detected': len(detected), 'alerts': len(alerts),
+                         'false_alerts': len(false_alerts)}
+    return results
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_replay(path, options):
+    """
+    Generates the traffic and replays it through one analyzer path (runs in its own process)
+
+    Detection accuracy is scored on the same replay, every injected attack
+    included, with the fixed thresholds (see PORT_SCAN_THRESHOLDS and
+    DDOS_THRESHOLDS) unless options overrides them.
+    """
+    packets, scenarios = generate(options['duration'], options['rate'], seed=options['seed'])
+    rss_before = _peak_rss_mb()
+    with tempfile.TemporaryDirectory() as directory:
+        analyzer = load_analyzer(directory)
+        configure_detectors(analyzer, {**PORT_SCAN_THRESHOLDS, **options['port_scan']},
+                            {**DDOS_THRESHOLDS, **options['ddos']})
+        analyzer.metrics.enabled = options['metrics']
+        if path == 'fast':
+            def handler(frame, timestamp):
+                analyzer.raw_packet_handler(frame, timestamp, LINKTYPE_ETHERNET, Ether)
+        else:
+            def handler(frame, timestamp):
+                packet = Ether(frame)
+                packet.time = timestamp
+                analyzer.packet_handler(packet)
+
+        latencies, elapsed = replay(packets, handler, options['replay_rate'])
+        replay_rss_growth = _peak_rss_mb() - rss_before
+        analyzer.flow_table.flush()
+        flows = len(analyzer.flow_table.store)
+        accuracy = score(packets, scenarios, analyzer.port_scan_detector, analyzer.ddos_detector)
+        analyzer.persist_packets()
+        analyzer.segment_writer.close()
+
+    percentiles = np.percentile(latencies, LATENCY_PERCENTILES) / 1000
+    return {
+        'path': path,
+        'packets': len(packets),
+        'packets_per_sec': len(packets) / elapsed,
+        'latency_us': {f"p{p:g}": float(value) for p, value in zip(LATENCY_PERCENTILES, percentiles)},
+        'max_latency_us': float(latencies.max() / 1000),
+        'peak_rss_mb': _peak_rss_mb(),
+        'replay_rss_growth_mb': replay_rss_growth,
+        'flows': flows,
+        'metrics': options['metrics'],
+        'accuracy': accuracy,
+    }
+
+
+def check_accuracy(result):
+    """Fails the benchmark unless every scenario was detected without false alerts (--check-accuracy)."""
+    for kind, accuracy in result['accuracy'].items():
+        if accuracy['detected'] != accuracy['scenarios'] or accuracy['false_alerts']:
+            raise AssertionError(f"[{result['path']}] {kind}: {accuracy['detected']}/{accuracy['scenarios']} "
+                                 f"detected, {accuracy['false_alerts']}/{accuracy['alerts']} false alerts")
+
+
+def print_replay(result):
+    print(f"[{result['path']}] {result['packets']:,} packets, {result['packets_per_sec']:,.0f} packets/sec")
+    latency = ', '.join(f"{name} {value:.1f}" for name, value in result['latency_us'].items())
+    print(f"  latency (us)   : {latency}, max {result['max_latency_us']:.1f}")
+    print(f"  peak RSS       : {result['peak_rss_mb']:.1f} MB (+{result['replay_rss_growth_mb']:.1f} MB during replay)")
+    for kind, accuracy in result['accuracy'].items():
+        print(f"  {kind:15}: {accuracy['detected']}/{accuracy['scenarios']} detected, "
+              f"{accuracy['false_alerts']}/{accuracy['alerts']} false alerts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the traffic analyzer")
+    parser.add_argument('--suite', choices=['decoders', 'replay', 'all'], default='all',
+                        help="decoders compares the packet decoders, replay runs synthetic traffic through the "
+                             "packet handlers and detectors")
+    parser.add_argument('--packets', type=int, default=20000, help="Number of synthetic packets of the decoder suite")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per decoder, the best one is reported")
+    parser.add_argument('--paths', nargs='+', choices=['fast', 'scapy'], default=['fast', 'scapy'],
+                        help="Packet handlers replayed")
+    parser.add_argument('--duration', type=float, default=180, help="Seconds of synthetic traffic to replay")
+    parser.add_argument('--rate', type=float, default=1000, help="Packets/sec of the normal synthetic traffic")
+    parser.add_argument('--replay-rate', type=float, help="Replay at this many packets/sec (default: flat out)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic traffic")
+    parser.add_argument('--scan-port-count', type=int, default=PORT_SCAN_THRESHOLDS['threshold_port_count'],
+                        help="Port scan detector threshold_port_count")
+    parser.add_argument('--scan-unique-ips', type=int, default=PORT_SCAN_THRESHOLDS['threshold_unique_ips'],
+                        help="Port scan detector threshold_unique_ips")
+    parser.add_argument('--ddos-packets', type=int, default=DDOS_THRESHOLDS['threshold_packets'],
+                        help="DDoS detector threshold_packets")
+    parser.add_argument('--ddos-bytes', type=int, default=DDOS_THRESHOLDS['threshold_bytes'],
+                        help="DDoS detector threshold_bytes")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Replay with the analyzer metrics enabled, to measure their overhead")
+    parser.add_argument('--json', help="Also write the results to this JSON file, to compare runs")
+    parser.add_argument('--check-accuracy', action='store_true',
+                        help="Fail when an attack is missed or a false alert is raised (accuracy is only "
+                             "reported otherwise)")
+    args = parser.parse_args()
+
+    results = {}
+    if args.suite in ('decoders', 'all'):
+        frames = build_frames(args.packets)
+        timestamps = [1700000000 + i * 0.0001 for i in range(len(frames))]
+
+        scapy_rate = run(scapy_path, frames, timestamps, args.repeat)
+        fast_rate = run(fast_path, frames, timestamps, args.repeat)
+        print(f"scapy dissection : {scapy_rate:12,.0f} packets/sec")
+        print(f"fast-path decoder: {fast_rate:12,.0f} packets/sec")
+        print(f"speedup          : {fast_rate / scapy_rate:12.1f}x")
+        results['decoders'] = {'scapy_packets_per_sec': scapy_rate, 'fast_packets_per_sec': fast_rate}
+
+    if args.suite in ('replay', 'all'):
+        port_scan = {'threshold_port_count': args.scan_port_count, 'threshold_unique_ips': args.scan_unique_ips}
+        ddos = {'threshold_packets': args.ddos_packets, 'threshold_bytes': args.ddos_bytes}
+        options = {'duration': args.duration, 'rate': args.rate, 'seed': args.seed, 'replay_rate': args.replay_rate,
+                   'metrics': args.metrics, 'port_scan': port_scan, 'ddos': ddos}
+        results['replay'] = []
+        for path in args.paths:
+            # One fresh process per path, so the peak RSS of a run is its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(run_replay, path, options).result()
+            print_replay(result)
+            results['replay'].append(result)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if args.check_accuracy:
+        for result in results.get('replay', []):
+            check_accuracy(result)
+
+
+if __name__ == "__main__":
+    main()
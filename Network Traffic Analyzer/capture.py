@@ -0,0 +1,233 @@
+import select
+import socket
+import struct
+import threading
+import time
+
+from scapy.all import conf, Ether
+
+from decoder import LINKTYPE_ETHERNET
+
+# Linux packet socket statistics (struct tpacket_stats: packets, drops)
+_SOL_PACKET = 263
+_PACKET_STATISTICS = 6
+_TPACKET_STATS = struct.Struct('II')
+# Linux packet fanout: the kernel spreads the frames of an interface over a group of sockets
+_PACKET_FANOUT = 18
+_PACKET_FANOUT_HASH = 0
+_PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+
+
+class FrameRing:
+    """
+    Bounded ring buffer of captured frames
+
+    The producer (capture thread) only moves the tail and the consumers only move
+    the head, so pushing never takes a lock. When the ring is full the new frame is
+    dropped and counted, like a full kernel buffer would, instead of blocking the
+    capture. Consumers take a lock among themselves so several of them can drain
+    the ring in batches.
+
+    Arguments:
+    capacity: Number of frames the ring can hold
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = max(int(capacity), 1)
+        self.pushed = 0
+        self.dropped = 0
+        self.high_watermark = 0
+        self._slots = [None] * self.capacity
+        self._head = 0
+        self._tail = 0
+        self._consumer_lock = threading.Lock()
+        self._not_empty = threading.Event()
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def push(self, item):
+        """Adds an item; returns False when the ring is full and the item was dropped."""
+        depth = self._tail - self._head
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+        self._slots[self._tail % self.capacity] = item
+        self._tail += 1
+        self.pushed += 1
+        if depth >= self.high_watermark:
+            self.high_watermark = depth + 1
+        if not self._not_empty.is_set():
+            self._not_empty.set()
+        return True
+
+    def pop_batch(self, max_items=256, timeout=None):
+        """
+        Removes and returns up to max_items items, oldest first
+
+        Waits up to timeout seconds (forever when None) for the ring to become
+        non-empty and returns an empty list if it stays empty.
+        """
+        if self._tail == self._head:
+            self._not_empty.wait(timeout)
+        with self._consumer_lock:
+            head = self._head
+            count = min(self._tail - head, max_items)
+            batch = []
+            for position in range(head, head + count):
+                slot = position % self.capacity
+                batch.append(self._slots[slot])
+                self._slots[slot] = None
+            self._head = head + count
+            if self._tail == self._head:
+                self._not_empty.clear()
+                # A push may have happened between the check and the clear
+                if self._tail != self._head:
+                    self._not_empty.set()
+        return batch
+
+    def wake(self):
+        """Wakes up every waiting consumer (used at shutdown)."""
+        self._not_empty.set()
+
+
+def _kernel_drops(sock):
+    # Reading PACKET_STATISTICS resets the kernel counters, so the caller accumulates them
+    try:
+        packets, drops = _TPACKET_STATS.unpack(sock.ins.getsockopt(_SOL_PACKET, _PACKET_STATISTICS,
+                                                                   _TPACKET_STATS.size))
+    except (AttributeError, OSError):
+        return None
+    return drops
+
+
+class CapturePipeline:
+    """
+    Capture thread decoupled from the analysis workers
+
+    A dedicated thread only reads raw frames from the capture socket and pushes
+    (frame, timestamp, linktype, packet_class) tuples into a FrameRing; it never
+    decodes them, so slow analysis cannot make the kernel drop packets. One or more
+    worker threads drain the ring in batches and call handler on every frame; the
+    handler must be thread-safe when workers > 1. stats() reports the ring depth,
+    its high watermark and the ring and kernel drop counters, to size ring_size
+    and the socket buffer for the link speed.
+
+    Arguments:
+    iface: Network interface to capture from
+    bpf_filter: BPF filter applied by the kernel
+    handler: Callable handler(frame, timestamp, linktype, packet_class)
+    ring_size: Capacity of the ring buffer in frames
+    workers: Number of analysis worker threads
+    batch_size: Maximum number of frames a worker takes from the ring at a time
+    socket_buffer: Optional kernel receive buffer size of the capture socket in bytes
+    fanout_group: Optional Linux packet fanout group id; the pipelines of one group on
+                  an interface each receive a share of its frames, hashed by flow (both
+                  directions of a connection go to the same socket)
+    """
+
+    def __init__(self, iface, bpf_filter, handler, ring_size=65536, workers=1, batch_size=256, socket_buffer=None,
+                 fanout_group=None):
+        self.iface = iface
+        self.bpf_filter = bpf_filter
+        self.handler = handler
+        self.ring = FrameRing(ring_size)
+        self.workers = max(int(workers), 1)
+        self.batch_size = batch_size
+        self.socket_buffer = socket_buffer
+        self.fanout_group = fanout_group
+        self.processed = 0
+        self.handler_errors = 0
+        self.kernel_drops = 0
+        self._stop_capture = threading.Event()
+        self._stop_workers = threading.Event()
+        self._threads = []
+        self._processed_lock = threading.Lock()
+
+    def _capture(self, sock):
+        linktypes = {}
+        ring = self.ring
+        next_poll = time.monotonic() + 1
+        try:
+            while not self._stop_capture.is_set():
+                if time.monotonic() >= next_poll:
+                    self._poll_kernel_drops(sock)
+                    next_poll += 1
+                if not select.select([sock], [], [], 0.2)[0]:
+                    continue
+                packet_class, frame, timestamp = sock.recv_raw()
+                if frame is None:
+                    continue
+                linktype = linktypes.get(packet_class)
+                if linktype is None:
+                    linktype = linktypes[packet_class] = conf.l2types.layer2num.get(packet_class, LINKTYPE_ETHERNET)
+                ring.push((frame, timestamp or time.time(), linktype, packet_class or Ether))
+        finally:
+            self._poll_kernel_drops(sock)
+            sock.close()
+
+    def _poll_kernel_drops(self, sock):
+        drops = _kernel_drops(sock)
+        if drops:
+            self.kernel_drops += drops
+
+    def _work(self):
+        ring = self.ring
+        handler = self.handler
+        while True:
+            batch = ring.pop_batch(self.batch_size, timeout=0.2)
+            if not batch:
+                if self._stop_workers.is_set() and len(ring) == 0:
+                    return
+                continue
+            for frame, timestamp, linktype, packet_class in batch:
+                try:
+                    handler(frame, timestamp, linktype, packet_class)
+                except Exception as e:
+                    self.handler_errors += 1
+                    print(f"Error processing packet: {e}")
+            with self._processed_lock:
+                self.processed += len(batch)
+
+    def start(self):
+        sock = conf.L2listen(iface=self.iface, filter=self.bpf_filter or None)
+        if self.socket_buffer:
+            sock.ins.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer)
+        if self.fanout_group is not None:
+            # Packed as an unsigned int: the defrag flag sets the sign bit
+            sock.ins.setsockopt(_SOL_PACKET, _PACKET_FANOUT, struct.pack('=I', (self.fanout_group & 0xFFFF)
+                                | ((_PACKET_FANOUT_HASH | _PACKET_FANOUT_FLAG_DEFRAG) << 16)))
+        self._threads = [threading.Thread(target=self._capture, args=(sock,), name='capture', daemon=True)]
+        self._threads += [threading.Thread(target=self._work, name=f'analysis-{i}', daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stops the capture, lets the workers drain the ring and waits for them."""
+        self._stop_capture.set()
+        self._threads[0].join()
+        self._stop_workers.set()
+        self.ring.wake()
+        for thread in self._threads[1:]:
+            thread.join()
+
+    def run(self, timeout):
+        """Captures for timeout seconds, then stops and drains."""
+        self.start()
+        try:
+            time.sleep(timeout)
+        finally:
+            self.stop()
+
+    def stats(self):
+        return {
+            'captured': self.ring.pushed + self.ring.dropped,
+            'processed': self.processed,
+            'queue_depth': len(self.ring),
+            'queue_high_watermark': self.ring.high_watermark,
+            'ring_drops': self.ring.dropped,
+            'kernel_drops': self.kernel_drops,
+            'handler_errors': self.handler_errors,
+        }
@@ -0,0 +1,120 @@
+import bisect
+import ipaddress
+
+import numpy as np
+import pandas as pd
+
+_FAMILIES = {4: (32, np.uint32), 6: (128, np.dtype('S16'))}
+
+
+def _encode(values, version):
+    # IPv4 bounds are uint32; IPv6 bounds are 16 byte big-endian strings, which sort like 128-bit integers
+    if version == 4:
+        return np.array(values, dtype=np.uint32)
+    return np.array([value.to_bytes(16, 'big') for value in values], dtype='S16')
+
+
+class CidrIndex:
+    """
+    Sorted interval index of labelled CIDR networks
+
+    The networks (e.g. an allow or deny list, or asset groups) are flattened once
+    into disjoint address intervals that cover the whole address space, each with
+    the label of the most specific network containing it (or none). A lookup is then
+    a binary search over the interval starts: np.searchsorted for whole columns and
+    bisect for single packets, with no address string parsing.
+
+    IPv4 addresses are looked up as packed integers / uint32 arrays, IPv6 addresses
+    as 128-bit integers / 'S16' arrays of big-endian bytes (see ipv6_to_bytes).
+
+    Arguments:
+    networks: Iterable of CIDR strings, or of (CIDR string, label) pairs
+    """
+
+    def __init__(self, networks=()):
+        self.labels = []
+        self._label_codes = {}
+        self._networks = {4: [], 6: []}
+        self._tables = {}
+        for network in networks:
+            if isinstance(network, str):
+                self.add(network)
+            else:
+                self.add(*network)
+
+    def __len__(self):
+        return len(self._networks[4]) + len(self._networks[6])
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def add(self, cidr, label=None):
+        """Adds a network; the label defaults to the CIDR string itself."""
+        network = ipaddress.ip_network(cidr, strict=False)
+        label = str(network) if label is None else label
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = len(self.labels)
+            self.labels.append(label)
+        self._networks[network.version].append((network.prefixlen, int(network.network_address),
+                                                int(network.broadcast_address), code))
+        self._tables.pop(network.version, None)
+
+    def _table(self, version):
+        table = self._tables.get(version)
+        if table is None:
+            table = self._tables[version] = self._build(version)
+        return table
+
+    def _build(self, version):
+        bits, _ = _FAMILIES[version]
+        networks = sorted(self._networks[version])
+        # Elementary intervals between every network boundary
+        boundaries = sorted({0} | {first for _, first, _, _ in networks}
+                            | {last + 1 for _, _, last, _ in networks if last + 1 < 1 << bits})
+        codes = [-1] * len(boundaries)
+        # Least specific networks first, so more specific ones overwrite them
+        for _, first, last, code in networks:
+            start = bisect.bisect_left(boundaries, first)
+            stop = bisect.bisect_right(boundaries, last)
+            codes[start:stop] = [code] * (stop - start)
+
+        # Adjacent intervals with the same label are merged
+        starts, merged = [], []
+        for boundary, code in zip(boundaries, codes):
+            if not merged or merged[-1] != code:
+                starts.append(boundary)
+                merged.append(code)
+        # Python lists serve single lookups (bisect), arrays serve column lookups (searchsorted)
+        return starts, merged, _encode(starts, version), np.array(merged, dtype=np.int32)
+
+    def lookup(self, addresses):
+        """
+        Returns the label codes (indices into labels, -1 when unlisted) of an array of
+        addresses: a uint32 array of IPv4 addresses or an 'S16' array of IPv6 addresses
+        """
+        addresses = np.asarray(addresses)
+        version = 6 if addresses.dtype.kind == 'S' else 4
+        _, _, starts, codes = self._table(version)
+        positions = np.searchsorted(starts, addresses.astype(_FAMILIES[version][1], copy=False), side='right') - 1
+        return codes[positions]
+
+    def contains(self, addresses):
+        """Returns a boolean mask of the addresses that belong to one of the networks."""
+        return self.lookup(addresses) >= 0
+
+    def categorize(self, addresses):
+        """Returns the labels of an array of addresses as a pandas Categorical (NaN when unlisted)."""
+        return pd.Categorical.from_codes(self.lookup(addresses), self.labels)
+
+    def lookup_one(self, address, ip_version=4):
+        """Returns the label of one packed integer address, or None when it is unlisted."""
+        starts, codes, _, _ = self._table(ip_version)
+        code = codes[bisect.bisect_right(starts, address) - 1]
+        return None if code < 0 else self.labels[code]
+
+    def __contains__(self, address):
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+            return self.lookup_one(int(address), address.version) is not None
+        return self.lookup_one(address) is not None
@@ -0,0 +1,180 @@
+import struct
+
+# Link layer types (see the tcpdump.org LINKTYPE_ list)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+_RAW_LINKTYPES = {12, 14, LINKTYPE_RAW}
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+_VLAN_ETHERTYPES = {0x8100, 0x88A8, 0x9100}
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+# IPv6 extension headers skipped to reach the transport header
+_IPV6_EXTENSION_HEADERS = {0, 43, 60}
+_IPPROTO_FRAGMENT = 44
+_IPPROTO_AH = 51
+# Address family values used for IPv6 by the BSD loopback (null) link type
+_NULL_INET6_FAMILIES = {24, 28, 30}
+
+_ETHERTYPE = struct.Struct('!H')
+_NULL_FAMILY = struct.Struct('=I')
+# version/IHL, total length, flags/fragment offset, protocol, source, destination
+_IPV4_HEADER = struct.Struct('!BxH2xHxB2xII')
+# next header, source, destination (each address as two 64-bit halves)
+_IPV6_HEADER = struct.Struct('!6xB1xQQQQ')
+_EXTENSION_HEADER = struct.Struct('!BB')
+_PORTS = struct.Struct('!HH')
+# TCP flags live in the low byte of the 14th and 15th header bytes
+_TCP_FLAGS_OFFSET = 13
+# source port, destination port, sequence number, data offset, flags
+_TCP_HEADER = struct.Struct('!HHI4xBB')
+
+
+def _network_offset(buf, offset, end, linktype):
+    """Returns (ethertype, offset of the network header) for a frame, or None."""
+    if linktype == LINKTYPE_ETHERNET:
+        position = offset + 12
+        if position + 2 > end:
+            return None
+        (ethertype,) = _ETHERTYPE.unpack_from(buf, position)
+        position += 2
+        while ethertype in _VLAN_ETHERTYPES:
+            if position + 4 > end:
+                return None
+            (ethertype,) = _ETHERTYPE.unpack_from(buf, position + 2)
+            position += 4
+        return ethertype, position
+    if linktype in _RAW_LINKTYPES:
+        if offset >= end:
+            return None
+        version = buf[offset] >> 4
+        return {4: ETHERTYPE_IPV4, 6: ETHERTYPE_IPV6}.get(version), offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        if offset + 16 > end:
+            return None
+        (ethertype,) = _ETHERTYPE.unpack_from(buf, offset + 14)
+        return ethertype, offset + 16
+    if linktype == LINKTYPE_NULL:
+        if offset + 4 > end:
+            return None
+        (family,) = _NULL_FAMILY.unpack_from(buf, offset)
+        if family > 0xFFFF:
+            # Written with the other byte order
+            family = int.from_bytes(family.to_bytes(4, 'little'), 'big')
+        if family == 2:
+            return ETHERTYPE_IPV4, offset + 4
+        return (ETHERTYPE_IPV6 if family in _NULL_INET6_FAMILIES else None), offset + 4
+    return None
+
+
+def _decode_ipv6(buf, position, end):
+    next_header, src_high, src_low, dst_high, dst_low = _IPV6_HEADER.unpack_from(buf, position)
+    src_ip = (src_high << 64) | src_low
+    dst_ip = (dst_high << 64) | dst_low
+    position += 40
+    first_fragment = True
+    while next_header in _IPV6_EXTENSION_HEADERS or next_header in (_IPPROTO_FRAGMENT, _IPPROTO_AH):
+        if position + 8 > end:
+            return 6, src_ip, dst_ip, next_header, 0, 0, 0
+        following, length = _EXTENSION_HEADER.unpack_from(buf, position)
+        if next_header == _IPPROTO_FRAGMENT:
+            first_fragment = struct.unpack_from('!H', buf, position + 2)[0] & 0xFFF8 == 0
+            length = 8
+        elif next_header == _IPPROTO_AH:
+            length = (length + 2) * 4
+        else:
+            length = (length + 1) * 8
+        next_header = following
+        position += length
+
+    source_port, destination_port, tcp_flags = _transport_fields(buf, position, end, next_header, first_fragment)
+    return 6, src_ip, dst_ip, next_header, source_port, destination_port, tcp_flags
+
+
+def _transport_fields(buf, position, end, protocol, first_fragment):
+    # Only the first fragment carries the transport header
+    if protocol not in (IPPROTO_TCP, IPPROTO_UDP) or not first_fragment or position + 4 > end:
+        return 0, 0, 0
+    source_port, destination_port = _PORTS.unpack_from(buf, position)
+    tcp_flags = 0
+    if protocol == IPPROTO_TCP and position + _TCP_FLAGS_OFFSET < end:
+        tcp_flags = buf[position + _TCP_FLAGS_OFFSET]
+    return source_port, destination_port, tcp_flags
+
+
+def decode_frame(buf, offset=0, caplen=None, linktype=LINKTYPE_ETHERNET):
+    """
+    Decodes the IP and TCP/UDP headers of a raw frame at fixed offsets
+
+    Only the fields the analyzer stores are read, straight from the buffer with
+    struct, so no per-packet scapy object is built.
+
+    Arguments:
+    buf: bytes, bytearray, memoryview or mmap holding the frame
+    offset: Offset of the first byte of the frame in buf
+    caplen: Number of captured bytes of the frame (defaults to the rest of buf)
+    linktype: Link layer type of the frame
+
+    Output:
+    A (ip_version, src_ip, dst_ip, protocol, source_port, destination_port, tcp_flags)
+    tuple with packed integer addresses (128-bit for IPv6), or None when the frame is
+    not IP or is truncated
+    """
+    end = len(buf) if caplen is None else offset + caplen
+    network = _network_offset(buf, offset, end, linktype)
+    if network is None:
+        return None
+    ethertype, position = network
+    if ethertype == ETHERTYPE_IPV6:
+        if position + 40 > end:
+            return None
+        return _decode_ipv6(buf, position, end)
+    if ethertype != ETHERTYPE_IPV4 or position + 20 > end:
+        return None
+    version_ihl, _, fragment, protocol, src_ip, dst_ip = _IPV4_HEADER.unpack_from(buf, position)
+    if version_ihl >> 4 != 4:
+        return None
+
+    transport = position + (version_ihl & 0x0F) * 4
+    source_port, destination_port, tcp_flags = _transport_fields(buf, transport, end, protocol,
+                                                                 fragment & 0x1FFF == 0)
+    return 4, src_ip, dst_ip, protocol, source_port, destination_port, tcp_flags
+
+
+def decode_tcp_segment(buf, offset=0, caplen=None, linktype=LINKTYPE_ETHERNET):
+    """
+    Decodes an IPv4 TCP segment down to its payload, for stream reassembly
+
+    Arguments:
+    buf: bytes, bytearray, memoryview or mmap holding the frame
+    offset: Offset of the first byte of the frame in buf
+    caplen: Number of captured bytes of the frame (defaults to the rest of buf)
+    linktype: Link layer type of the frame
+
+    Output:
+    A (src_ip, dst_ip, source_port, destination_port, seq, tcp_flags, payload) tuple
+    where payload is a memoryview of the captured TCP payload, or None when the
+    frame is not an unfragmented IPv4 TCP segment
+    """
+    end = len(buf) if caplen is None else offset + caplen
+    network = _network_offset(buf, offset, end, linktype)
+    if network is None or network[0] != ETHERTYPE_IPV4:
+        return None
+    position = network[1]
+    if position + 20 > end:
+        return None
+    version_ihl, total_length, fragment, protocol, src_ip, dst_ip = _IPV4_HEADER.unpack_from(buf, position)
+    if version_ihl >> 4 != 4 or protocol != IPPROTO_TCP or fragment & 0x3FFF:
+        return None
+    # The IP total length excludes the Ethernet padding of short frames
+    end = min(end, position + total_length)
+    transport = position + (version_ihl & 0x0F) * 4
+    if transport + _TCP_HEADER.size > end:
+        return None
+    source_port, destination_port, seq, data_offset, tcp_flags = _TCP_HEADER.unpack_from(buf, transport)
+    payload_start = min(transport + (data_offset >> 4) * 4, end)
+    return src_ip, dst_ip, source_port, destination_port, seq, tcp_flags, memoryview(buf)[payload_start:end]
@@ -0,0 +1,263 @@
+from collections import deque, namedtuple
+
+from sketches import HyperLogLog, SpaceSaving
+
+PortScanAlert = namedtuple('PortScanAlert', ['window_start', 'destination_port', 'packet_count', 'unique_sources'])
+DDoSAlert = namedtuple('DDoSAlert', ['window_end', 'packet_count', 'byte_count', 'top_destinations'])
+
+
+class _PortWindowState:
+    __slots__ = ('packet_count', 'sources', 'alerted')
+
+    def __init__(self, precision):
+        self.packet_count = 0
+        self.sources = HyperLogLog(precision)
+        self.alerted = False
+
+
+class PortScanDetector:
+    """
+    Streaming port scan detector
+
+    Keeps a request counter and an approximate distinct-source sketch for every
+    (destination_port, window) pair and checks them as each packet arrives, so an
+    alert fires while capture is still running. Windows are tumbling windows of
+    window_size seconds aligned on the epoch (the same buckets pd.Grouper uses);
+    only the newest retained_windows windows are kept, older ones are evicted. Per
+    window memory is bounded by the number of destination ports, never by the
+    number of sources.
+
+    Arguments:
+    threshold_port_count: Threshold number of requests to a port per time window
+    threshold_unique_ips: Threshold number of unique IP addresses connecting to a port
+    window_size: Time window size in seconds
+    retained_windows: Number of most recent windows that still accept late packets
+    precision: HyperLogLog precision of the distinct-source sketches
+    on_alert: Optional callable invoked with a PortScanAlert when a port crosses a threshold
+    max_alerts: Number of recent alerts kept in the alerts attribute
+    """
+
+    def __init__(self, threshold_port_count=10, threshold_unique_ips=5, window_size=60, retained_windows=2,
+                 precision=8, on_alert=None, max_alerts=1000):
+        self.threshold_port_count = threshold_port_count
+        self.threshold_unique_ips = threshold_unique_ips
+        self.window_size = window_size
+        self.retained_windows = max(int(retained_windows), 1)
+        self.precision = precision
+        self.on_alert = on_alert
+        self.alerts = deque(maxlen=max_alerts)
+        self.late_packets = 0
+        self._windows = {}
+        self._latest_window = None
+
+    def update(self, timestamp, src_ip, destination_port):
+        """
+        Accounts one packet in O(1)
+
+        Arguments:
+        timestamp: Capture time in seconds since the epoch
+        src_ip: Source address as a packed integer
+        destination_port: Destination TCP/UDP port
+
+        Output:
+        The PortScanAlert raised by this packet, or None
+        """
+        window = int(timestamp // self.window_size)
+        state = self._state(window, destination_port, 1)
+        if state is None:
+            return None
+        state.packet_count += 1
+        state.sources.add(src_ip)
+        return self._check(window, destination_port, state)
+
+    def merge(self, window, destination_port, packet_count, sources):
+        """
+        Accounts the partial counts of one (window, destination_port) pair collected
+        elsewhere, e.g. by a capture shard
+
+        Arguments:
+        window: Window number (timestamp // window_size)
+        destination_port: Destination TCP/UDP port
+        packet_count: Number of packets of the pair
+        sources: HyperLogLog of their source addresses, with this detector's precision
+
+        Output:
+        The PortScanAlert raised by the merged counts, or None
+        """
+        state = self._state(window, destination_port, packet_count)
+        if state is None:
+            return None
+        state.packet_count += packet_count
+        state.sources.merge(sources)
+        return self._check(window, destination_port, state)
+
+    def _state(self, window, destination_port, packet_count):
+        if self._latest_window is None or window > self._latest_window:
+            self._latest_window = window
+            self._evict()
+        elif window <= self._latest_window - self.retained_windows:
+            self.late_packets += packet_count
+            return None
+
+        ports = self._windows.get(window)
+        if ports is None:
+            ports = self._windows[window] = {}
+        state = ports.get(destination_port)
+        if state is None:
+            state = ports[destination_port] = _PortWindowState(self.precision)
+        return state
+
+    def _check(self, window, destination_port, state):
+        if state.alerted:
+            return None
+
+        unique_sources = state.sources.count()
+        if state.packet_count > self.threshold_port_count or unique_sources > self.threshold_unique_ips:
+            state.alerted = True
+            alert = PortScanAlert(window * self.window_size, destination_port, state.packet_count, unique_sources)
+            self.alerts.append(alert)
+            if self.on_alert is not None:
+                self.on_alert(alert)
+            return alert
+        return None
+
+    def _evict(self):
+        oldest = self._latest_window - self.retained_windows
+        for window in [w for w in self._windows if w <= oldest]:
+            del self._windows[window]
+
+    def tracked_keys(self):
+        """Returns the number of (destination_port, window) pairs currently held in memory."""
+        return sum(len(ports) for ports in self._windows.values())
+
+
+class DDoSDetector:
+    """
+    Streaming DDoS rate detector
+
+    Packet and byte totals are kept exactly in a ring buffer of time buckets that
+    together cover the last window_size seconds, with running sums so the sliding
+    window totals are available in O(1). Every bucket also holds a small
+    Space-Saving summary of destinations, merged only when an alert is raised, so
+    the per-packet cost and the memory use do not depend on the capture length.
+    An alert fires when a threshold is crossed and re-arms once the window drops
+    back below both thresholds.
+
+    Arguments:
+    threshold_packets: Threshold number of packets per time window
+    threshold_bytes: Threshold traffic volume per time window
+    window_size: Time window size in seconds
+    bucket_size: Resolution of the ring buffer in seconds
+    top_k: Number of heavy hitter destinations tracked per bucket and reported in alerts
+    on_alert: Optional callable invoked with a DDoSAlert
+    max_alerts: Number of recent alerts kept in the alerts attribute
+    """
+
+    def __init__(self, threshold_packets=1000, threshold_bytes=1000000, window_size=60, bucket_size=1, top_k=10,
+                 on_alert=None, max_alerts=1000):
+        self.threshold_packets = threshold_packets
+        self.threshold_bytes = threshold_bytes
+        self.window_size = window_size
+        self.bucket_size = bucket_size
+        self.top_k = top_k
+        self.on_alert = on_alert
+        self.alerts = deque(maxlen=max_alerts)
+        self.late_packets = 0
+        self.packet_count = 0
+        self.byte_count = 0
+        self._slots = max(int(round(window_size / bucket_size)), 1)
+        self._bucket_ids = [None] * self._slots
+        self._packets = [0] * self._slots
+        self._bytes = [0] * self._slots
+        self._destinations = [SpaceSaving(top_k) for _ in range(self._slots)]
+        self._head = None
+        self._alerting = False
+
+    def update(self, timestamp, dst_ip, packet_size):
+        """
+        Accounts one packet in O(1)
+
+        Arguments:
+        timestamp: Capture time in seconds since the epoch
+        dst_ip: Destination address as a packed integer
+        packet_size: Packet length in bytes
+
+        Output:
+        The DDoSAlert raised by this packet, or None
+        """
+        bucket = int(timestamp // self.bucket_size)
+        slot = self._slot(bucket, 1)
+        if slot is None:
+            return None
+        self._packets[slot] += 1
+        self._bytes[slot] += packet_size
+        self._destinations[slot].add(dst_ip)
+        self.packet_count += 1
+        self.byte_count += packet_size
+        return self._check(bucket)
+
+    def merge(self, bucket, packet_count, byte_count, destinations):
+        """
+        Accounts the partial totals of one bucket collected elsewhere, e.g. by a capture shard
+
+        Arguments:
+        bucket: Bucket number (timestamp // bucket_size)
+        packet_count, byte_count: Totals of the bucket
+        destinations: SpaceSaving summary of the bucket's destination addresses
+
+        Output:
+        The DDoSAlert raised by the merged totals, or None
+        """
+        slot = self._slot(bucket, packet_count)
+        if slot is None:
+            return None
+        self._packets[slot] += packet_count
+        self._bytes[slot] += byte_count
+        self._destinations[slot].merge(destinations)
+        self.packet_count += packet_count
+        self.byte_count += byte_count
+        return self._check(bucket)
+
+    def _slot(self, bucket, packet_count):
+        if self._head is None or bucket > self._head:
+            self._advance(bucket)
+        elif bucket <= self._head - self._slots:
+            self.late_packets += packet_count
+            return None
+        return bucket % self._slots
+
+    def _check(self, bucket):
+        over = self.packet_count > self.threshold_packets or self.byte_count > self.threshold_bytes
+        if not over:
+            self._alerting = False
+            return None
+        if self._alerting:
+            return None
+        self._alerting = True
+        alert = DDoSAlert((bucket + 1) * self.bucket_size, self.packet_count, self.byte_count,
+                          self.top_destinations())
+        self.alerts.append(alert)
+        if self.on_alert is not None:
+            self.on_alert(alert)
+        return alert
+
+    def _advance(self, bucket):
+        # Expire every bucket that falls out of the window when the head moves to bucket
+        start = bucket - self._slots + 1 if self._head is None else max(self._head + 1, bucket - self._slots + 1)
+        for expired in range(start, bucket + 1):
+            slot = expired % self._slots
+            if self._bucket_ids[slot] is not None:
+                self.packet_count -= self._packets[slot]
+                self.byte_count -= self._bytes[slot]
+            self._bucket_ids[slot] = expired
+            self._packets[slot] = 0
+            self._bytes[slot] = 0
+            self._destinations[slot].clear()
+        self._head = bucket
+
+    def top_destinations(self, n=None):
+        """Returns the heaviest destinations of the current window as (dst_ip, packets, max_error) tuples."""
+        summary = SpaceSaving(self.top_k)
+        for destinations in self._destinations:
+            summary.merge(destinations)
+        return summary.top(n or self.top_k)
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from packet_store import ColumnarStore
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+# Column layout of exported flow records (name -> NumPy dtype)
+FLOW_COLUMNS = {
+    'src_ip': np.uint32,
+    'dst_ip': np.uint32,
+    'source_port': np.uint16,
+    'destination_port': np.uint16,
+    'protocol': np.uint8,
+    'first_seen': np.int64,
+    'last_seen': np.int64,
+    'packets': np.uint64,
+    'bytes': np.uint64,
+    'tcp_flags': np.uint8,
+    'syn_packets': np.uint32,
+}
+
+
+class FlowStore(ColumnarStore):
+    """
+    Columnar store with one row per exported flow (see FLOW_COLUMNS)
+
+    Arguments:
+    capacity: Initial number of flows the store can hold before growing
+    """
+
+    def __init__(self, capacity=16384):
+        super().__init__(FLOW_COLUMNS, capacity, datetime_columns=('first_seen', 'last_seen'))
+
+    def append(self, key, flow):
+        """Adds a finished flow given its 5-tuple key and Flow counters."""
+        i = self._size
+        if i == self._capacity:
+            self._grow(i + 1)
+        arrays = self._arrays
+        src_ip, dst_ip, source_port, destination_port, protocol = key
+        arrays['src_ip'][i] = src_ip
+        arrays['dst_ip'][i] = dst_ip
+        arrays['source_port'][i] = source_port
+        arrays['destination_port'][i] = destination_port
+        arrays['protocol'][i] = protocol
+        arrays['first_seen'][i] = int(flow.first_seen * 1_000_000_000)
+        arrays['last_seen'][i] = int(flow.last_seen * 1_000_000_000)
+        arrays['packets'][i] = flow.packets
+        arrays['bytes'][i] = flow.bytes
+        arrays['tcp_flags'][i] = flow.tcp_flags
+        arrays['syn_packets'][i] = flow.syn_packets
+        self._size = i + 1
+
+
+class Flow:
+    """Counters of one unidirectional 5-tuple flow."""
+
+    __slots__ = ('first_seen', 'last_seen', 'packets', 'bytes', 'tcp_flags', 'syn_packets')
+
+    def __init__(self, timestamp):
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets = 0
+        self.bytes = 0
+        self.tcp_flags = 0
+        self.syn_packets = 0
+
+
+class FlowTable:
+    """
+    Hash-keyed flow table
+
+    Packets are aggregated into flows keyed on the (src_ip, dst_ip, source_port,
+    destination_port, protocol) 5-tuple. Active flows are kept in least recently
+    seen order, so idle flows are found at the front of the table in O(1). A flow
+    is exported to the flow store when it has been idle for idle_timeout seconds,
+    when it has been active for active_timeout seconds (long flows are then
+    exported in slices), when a TCP FIN or RST is seen, or when the table is full.
+
+    Arguments:
+    idle_timeout: Seconds without packets after which a flow is exported
+    active_timeout: Maximum duration of a flow record in seconds
+    max_flows: Maximum number of active flows; the least recently seen one is exported first
+    store: FlowStore receiving exported flows (a new one is created by default)
+    on_export: Optional callable invoked with (key, flow) for every exported flow
+    """
+
+    def __init__(self, idle_timeout=15, active_timeout=300, max_flows=1_000_000, store=None, on_export=None):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.store = FlowStore() if store is None else store
+        self.on_export = on_export
+        self._flows = OrderedDict()
+        self._next_sweep = None
+
+    def __len__(self):
+        return len(self._flows)
+
+    def update(self, timestamp, src_ip, dst_ip, protocol, source_port, destination_port, packet_size, tcp_flags=0):
+        """
+        Accounts one packet to its flow in amortized O(1)
+
+        Arguments:
+        timestamp: Capture time in seconds since the epoch
+        src_ip, dst_ip: Packed integer addresses
+        protocol: IP protocol number
+        source_port, destination_port: TCP/UDP ports, 0 for other protocols
+        packet_size: Packet length in bytes
+        tcp_flags: TCP flags byte, 0 for other protocols
+        """
+        key = (src_ip, dst_ip, source_port, destination_port, protocol)
+        flows = self._flows
+        flow = flows.get(key)
+        if flow is None:
+            if len(flows) >= self.max_flows:
+                self._export(*flows.popitem(last=False))
+            flow = flows[key] = Flow(timestamp)
+        elif timestamp - flow.first_seen >= self.active_timeout:
+            del flows[key]
+            self._export(key, flow)
+            flow = flows[key] = Flow(timestamp)
+        else:
+            flows.move_to_end(key)
+
+        flow.last_seen = timestamp
+        flow.packets += 1
+        flow.bytes += packet_size
+        if tcp_flags:
+            flow.tcp_flags |= tcp_flags
+            if tcp_flags & TCP_SYN:
+                flow.syn_packets += 1
+            if tcp_flags & (TCP_FIN | TCP_RST):
+                del flows[key]
+                self._export(key, flow)
+
+        # Idle flows are swept at most once per second of capture time
+        if self._next_sweep is None or timestamp >= self._next_sweep:
+            self.expire(timestamp)
+            self._next_sweep = timestamp + 1
+
+    def ingest(self, columns):
+        """Accounts a batch of packets given as PacketStore columns (see PacketStore.columns)."""
+        batch = zip(columns['timestamp'].tolist(), columns['src_ip'].tolist(), columns['dst_ip'].tolist(),
+                    columns['protocol'].tolist(), columns['source_port'].tolist(),
+                    columns['destination_port'].tolist(), columns['packet_size'].tolist(),
+                    columns['tcp_flags'].tolist())
+        for timestamp, src_ip, dst_ip, protocol, source_port, destination_port, packet_size, tcp_flags in batch:
+            self.update(timestamp / 1_000_000_000, src_ip, dst_ip, protocol, source_port, destination_port,
+                        packet_size, tcp_flags)
+
+    def expire(self, now):
+        """Exports every flow that has been idle for idle_timeout seconds at time now."""
+        flows = self._flows
+        while flows:
+            key = next(iter(flows))
+            if now - flows[key].last_seen < self.idle_timeout:
+                break
+            self._export(*flows.popitem(last=False))
+
+    def flush(self):
+        """Exports all active flows, e.g. at the end of a capture."""
+        while self._flows:
+            self._export(*self._flows.popitem(last=False))
+
+    def _export(self, key, flow):
+        self.store.append(key, flow)
+        if self.on_export is not None:
+            self.on_export(key, flow)
+
+    def to_dataframe(self):
+        """Returns the exported flows as a DataFrame (call flush first to include active flows)."""
+        return self.store.to_dataframe()
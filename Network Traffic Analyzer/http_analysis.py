@@ -0,0 +1,526 @@
+import re
+from collections import Counter, OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from flow_table import TCP_FIN, TCP_RST, TCP_SYN
+from packet_store import ColumnarStore
+from sketches import SpaceSaving
+
+HTTP_PORTS = (80, 8000, 8080)
+METHODS = ('', 'GET', 'POST', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'PATCH', 'CONNECT', 'TRACE')
+_METHOD_CODES = {method.encode(): code for code, method in enumerate(METHODS) if method}
+
+# Column layout of parsed HTTP transactions; strings are dictionary encoded
+HTTP_COLUMNS = {
+    'timestamp': np.int64,
+    'src_ip': np.uint32,
+    'dst_ip': np.uint32,
+    'source_port': np.uint16,
+    'destination_port': np.uint16,
+    'method': np.uint8,
+    'host': np.uint32,
+    'path': np.uint32,
+    'status_code': np.uint16,
+    'content_type': np.uint32,
+}
+
+_START_LINE = re.compile(rb'(?:GET|POST|HEAD|PUT|DELETE|OPTIONS|PATCH|CONNECT|TRACE) \S+ HTTP/1\.[01]\r\n'
+                         rb'|HTTP/1\.[01] \d{3}')
+_SEQUENCE_SPACE = 1 << 32
+
+
+def _relative(seq, base):
+    # Signed distance from base to seq in the 32-bit sequence space
+    distance = (seq - base) % _SEQUENCE_SPACE
+    return distance - _SEQUENCE_SPACE if distance >= _SEQUENCE_SPACE // 2 else distance
+
+
+class HttpStore(ColumnarStore):
+    """
+    Columnar store of HTTP transactions (see HTTP_COLUMNS)
+
+    Host, path and content type strings are interned once and stored as integer
+    codes; to_dataframe exposes them, and the method, as pandas categoricals.
+    """
+
+    _STRING_COLUMNS = ('host', 'path', 'content_type')
+
+    def __init__(self, capacity=4096):
+        super().__init__(HTTP_COLUMNS, capacity, datetime_columns=('timestamp',))
+        self._strings = {name: {'': 0} for name in self._STRING_COLUMNS}
+
+    def _code(self, column, value):
+        strings = self._strings[column]
+        code = strings.get(value)
+        if code is None:
+            code = strings[value] = len(strings)
+        return code
+
+    def append(self, timestamp, connection, method, host, path, status_code, content_type):
+        i = self._size
+        if i == self._capacity:
+            self._grow(i + 1)
+        arrays = self._arrays
+        src_ip, source_port, dst_ip, destination_port = connection
+        arrays['timestamp'][i] = int(timestamp * 1_000_000_000)
+        arrays['src_ip'][i] = src_ip
+        arrays['dst_ip'][i] = dst_ip
+        arrays['source_port'][i] = source_port
+        arrays['destination_port'][i] = destination_port
+        arrays['method'][i] = method
+        arrays['host'][i] = self._code('host', host)
+        arrays['path'][i] = self._code('path', path)
+        arrays['status_code'][i] = status_code
+        arrays['content_type'][i] = self._code('content_type', content_type)
+        self._size = i + 1
+
+    def clear(self):
+        super().clear()
+        self._strings = {name: {'': 0} for name in self._STRING_COLUMNS}
+
+    def merge(self, other):
+        """Appends the transactions of another HttpStore, translating its string codes."""
+        columns = other.columns()
+        for name in self._STRING_COLUMNS:
+            translation = np.array([self._code(name, value) for value in other._strings[name]], dtype=np.uint32)
+            columns[name] = translation[columns[name]]
+        self.extend(columns)
+
+    def to_dataframe(self):
+        df = super().to_dataframe()
+        df['method'] = pd.Categorical.from_codes(df['method'], METHODS)
+        for name in self._STRING_COLUMNS:
+            df[name] = pd.Categorical.from_codes(df[name], list(self._strings[name]))
+        return df
+
+
+class HttpStats:
+    """
+    Incrementally maintained HTTP aggregations
+
+    Arguments:
+    top_urls: Number of URLs tracked by the Space-Saving summary of the most used URLs
+    """
+
+    def __init__(self, top_urls=1000):
+        self.requests = 0
+        self.responses = 0
+        # Responses without Content-Length whose body ended with the connection close
+        self.close_delimited = 0
+        self.methods = Counter()
+        self.status_codes = Counter()
+        self.content_types = Counter()
+        self.urls = SpaceSaving(top_urls)
+
+    def clear(self):
+        self.requests = 0
+        self.responses = 0
+        self.close_delimited = 0
+        self.methods.clear()
+        self.status_codes.clear()
+        self.content_types.clear()
+        self.urls.clear()
+
+    @property
+    def get_requests(self):
+        return self.methods['GET']
+
+    def add_request(self, method, host, path):
+        self.requests += 1
+        self.methods[method] += 1
+        self.urls.add(host + path)
+
+    def add_response(self, status_code, content_type):
+        self.responses += 1
+        self.status_codes[status_code] += 1
+        if content_type:
+            self.content_types[content_type] += 1
+
+    def merge(self, other):
+        """Adds the aggregations of another HttpStats, e.g. of a capture shard."""
+        self.requests += other.requests
+        self.responses += other.responses
+        self.close_delimited += other.close_delimited
+        self.methods.update(other.methods)
+        self.status_codes.update(other.status_codes)
+        self.content_types.update(other.content_types)
+        self.urls.merge(other.urls)
+
+    def top_urls(self, n=10):
+        """Returns the n most used URLs as a Series of estimated request counts."""
+        top = self.urls.top(n)
+        return pd.Series([count for _, count, _ in top], index=[url for url, _, _ in top], dtype='int64')
+
+
+class HttpMessageParser:
+    """
+    Incremental HTTP/1.x parser for one direction of a TCP stream
+
+    Bytes are fed in stream order; start lines and headers are parsed as soon as
+    they are complete and bodies are skipped using Content-Length or chunked
+    encoding without being buffered. Only max_header_size bytes are ever held.
+    When the stream cannot be parsed (e.g. after a gap), the parser looks for the
+    next start line to resynchronise.
+
+    Arguments:
+    max_header_size: Maximum size of a start line plus headers
+    no_body: Optional callable no_body(index) returning True when the index-th final
+             response not yet paired with its request has no body (answers a HEAD request)
+    """
+
+    def __init__(self, max_header_size=16384, no_body=None):
+        self.max_header_size = max_header_size
+        self.no_body = no_body
+        self.desyncs = 0
+        self._buffer = bytearray()
+        self._state = 'headers'
+        self._remaining = 0
+        self._final_responses = 0
+
+    def lost_sync(self):
+        """Drops the buffered bytes after a gap in the stream."""
+        self._buffer.clear()
+        self._state = 'resync'
+        self.desyncs += 1
+
+    def finish(self):
+        """Ends the stream; returns True when a body delimited by the connection close was pending."""
+        pending = self._state == 'until_close'
+        self._buffer.clear()
+        self._state = 'headers'
+        return pending
+
+    def feed(self, data):
+        """
+        Consumes stream bytes and returns the messages completed so far, as
+        ('request', method, host, path) or ('response', status_code, content_type) tuples
+        """
+        messages = []
+        self._final_responses = 0
+        buffer = self._buffer
+        buffer += data
+        while buffer:
+            state = self._state
+            if state == 'body':
+                taken = min(self._remaining, len(buffer))
+                del buffer[:taken]
+                self._remaining -= taken
+                if self._remaining == 0:
+                    self._state = 'headers'
+            elif state == 'until_close':
+                buffer.clear()
+            elif state == 'resync':
+                match = _START_LINE.search(buffer)
+                if match is None:
+                    # Keep a tail in case a start line is split across segments
+                    del buffer[:max(len(buffer) - 64, 0)]
+                    break
+                del buffer[:match.start()]
+                self._state = 'headers'
+            elif state in ('chunk_size', 'chunk_trailer'):
+                line_end = buffer.find(b'\r\n')
+                if line_end < 0:
+                    if len(buffer) > self.max_header_size:
+                        self.lost_sync()
+                    break
+                line = bytes(buffer[:line_end])
+                del buffer[:line_end + 2]
+                if state == 'chunk_trailer':
+                    if not line:
+                        self._state = 'headers'
+                    continue
+                try:
+                    size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    self.lost_sync()
+                    continue
+                if size == 0:
+                    self._state = 'chunk_trailer'
+                else:
+                    self._state = 'chunk_data'
+                    self._remaining = size + 2  # chunk data and its CRLF
+            elif state == 'chunk_data':
+                taken = min(self._remaining, len(buffer))
+                del buffer[:taken]
+                self._remaining -= taken
+                if self._remaining == 0:
+                    self._state = 'chunk_size'
+            else:
+                header_end = buffer.find(b'\r\n\r\n')
+                if header_end < 0:
+                    if len(buffer) > self.max_header_size:
+                        self.lost_sync()
+                    break
+                head = bytes(buffer[:header_end])
+                del buffer[:header_end + 4]
+                message = self._parse_head(head)
+                if message is None:
+                    self.lost_sync()
+                    continue
+                messages.append(message)
+        return messages
+
+    def _parse_head(self, head):
+        lines = head.split(b'\r\n')
+        parts = lines[0].split(b' ', 2)
+        if len(parts) < 2:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(b':')
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get(b'content-length', b'0'))
+        except ValueError:
+            return None
+        chunked = b'chunked' in headers.get(b'transfer-encoding', b'').lower()
+
+        if parts[0].startswith(b'HTTP/1.'):
+            try:
+                status_code = int(parts[1])
+            except ValueError:
+                return None
+            content_type = headers.get(b'content-type', b'').split(b';', 1)[0].strip().decode('latin-1')
+            if status_code < 200:
+                self._state = 'headers'
+                return 'response', status_code, content_type
+            index = self._final_responses
+            self._final_responses += 1
+            if status_code in (204, 304) or (self.no_body is not None and self.no_body(index)):
+                self._state = 'headers'
+            elif chunked:
+                self._state = 'chunk_size'
+            elif b'content-length' in headers:
+                self._start_body(content_length)
+            else:
+                self._state = 'until_close'
+            return 'response', status_code, content_type
+
+        if parts[0] not in _METHOD_CODES or len(parts) < 3 or not parts[2].startswith(b'HTTP/1.'):
+            return None
+        if chunked:
+            self._state = 'chunk_size'
+        else:
+            self._start_body(content_length)
+        host = headers.get(b'host', b'').decode('latin-1')
+        return 'request', parts[0].decode(), host, parts[1].decode('latin-1')
+
+    def _start_body(self, length):
+        if length > 0:
+            self._state = 'body'
+            self._remaining = length
+        else:
+            self._state = 'headers'
+
+
+class _StreamDirection:
+    __slots__ = ('next_seq', 'pending', 'pending_bytes', 'parser', 'closed')
+
+    def __init__(self, parser):
+        self.next_seq = None
+        self.pending = {}
+        self.pending_bytes = 0
+        self.parser = parser
+        self.closed = False
+
+
+class _Connection:
+    __slots__ = ('client', 'server', 'requests', 'last_seen')
+
+    def __init__(self, timestamp, max_header_size):
+        self.requests = deque()
+        self.client = _StreamDirection(HttpMessageParser(max_header_size))
+        self.server = _StreamDirection(HttpMessageParser(
+            max_header_size, no_body=lambda index: len(self.requests) > index and self.requests[index][1] == 'HEAD'))
+        self.last_seen = timestamp
+
+
+class HttpAnalyzer:
+    """
+    Streaming TCP reassembly and HTTP/1.x transaction extraction
+
+    Segments of connections to one of the HTTP ports are reassembled per direction.
+    Out-of-order segments wait in a per-direction buffer of at most max_buffer
+    bytes; when that overflows, the gap is given up and the parser resynchronises
+    on the next start line. Parsed requests are paired with their responses in
+    order (pipelining) and stored as compact columns in store, while stats keeps
+    the GET count, the most used URLs and other aggregations up to date.
+    Connections are evicted after idle_timeout seconds, on FIN/RST of both sides
+    or RST, or when more than max_connections are open.
+
+    Arguments:
+    ports: Server ports treated as HTTP
+    max_buffer: Maximum out-of-order bytes buffered per direction
+    max_connections: Maximum number of tracked connections
+    idle_timeout: Seconds without segments after which a connection is evicted
+    max_pending_requests: Maximum requests waiting for their response per connection
+    max_header_size: Maximum size of a message start line plus headers
+    """
+
+    def __init__(self, ports=HTTP_PORTS, max_buffer=65536, max_connections=10000, idle_timeout=60,
+                 max_pending_requests=64, max_header_size=16384):
+        self.ports = frozenset(ports)
+        self.max_buffer = max_buffer
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_pending_requests = max_pending_requests
+        self.max_header_size = max_header_size
+        self.store = HttpStore()
+        self.stats = HttpStats()
+        self.gaps = 0
+        self._connections = OrderedDict()
+        self._next_sweep = None
+
+    def __len__(self):
+        return len(self._connections)
+
+    def process(self, timestamp, src_ip, dst_ip, source_port, destination_port, seq, tcp_flags, payload):
+        """
+        Feeds one TCP segment
+
+        Arguments:
+        timestamp: Capture time in seconds since the epoch
+        src_ip, dst_ip: Packed integer IPv4 addresses
+        source_port, destination_port: TCP ports
+        seq: TCP sequence number
+        tcp_flags: TCP flags byte
+        payload: TCP payload (bytes or memoryview)
+        """
+        if destination_port in self.ports:
+            key = (src_ip, source_port, dst_ip, destination_port)
+            from_client = True
+        elif source_port in self.ports:
+            key = (dst_ip, destination_port, src_ip, source_port)
+            from_client = False
+        else:
+            return
+
+        connections = self._connections
+        connection = connections.get(key)
+        if connection is None:
+            if tcp_flags & TCP_RST:
+                return
+            if len(connections) >= self.max_connections:
+                self._close(*connections.popitem(last=False))
+            connection = connections[key] = _Connection(timestamp, self.max_header_size)
+        else:
+            connections.move_to_end(key)
+        connection.last_seen = timestamp
+
+        direction = connection.client if from_client else connection.server
+        if tcp_flags & TCP_SYN:
+            direction.next_seq = (seq + 1) % _SEQUENCE_SPACE
+        elif direction.next_seq is None:
+            # Picked up in the middle of the connection
+            direction.next_seq = seq
+            direction.parser.lost_sync()
+        if len(payload):
+            self._segment(key, connection, direction, from_client, timestamp, seq, payload)
+
+        if tcp_flags & TCP_RST:
+            del connections[key]
+            self._close(key, connection)
+        elif tcp_flags & TCP_FIN:
+            direction.closed = True
+            if connection.client.closed and connection.server.closed:
+                del connections[key]
+                self._close(key, connection)
+
+        if self._next_sweep is None or timestamp >= self._next_sweep:
+            self.expire(timestamp)
+            self._next_sweep = timestamp + 1
+
+    def _segment(self, key, connection, direction, from_client, timestamp, seq, payload):
+        offset = _relative(seq, direction.next_seq)
+        if offset < 0:
+            if -offset >= len(payload):
+                return  # Retransmission of delivered data
+            payload = payload[-offset:]
+            offset = 0
+        if offset > 0:
+            if direction.pending_bytes + len(payload) > self.max_buffer:
+                # The gap will not be filled within the buffer: skip to the first buffered segment
+                self.gaps += 1
+                direction.parser.lost_sync()
+                if direction.pending:
+                    direction.next_seq = min(direction.pending, key=lambda s: _relative(s, direction.next_seq))
+                    self._drain(key, connection, direction, from_client, timestamp)
+                direction.pending_bytes += len(payload) - len(direction.pending.get(seq, b''))
+                direction.pending[seq] = bytes(payload)
+                self._drain(key, connection, direction, from_client, timestamp)
+                return
+            if seq not in direction.pending or len(direction.pending[seq]) < len(payload):
+                direction.pending_bytes += len(payload) - len(direction.pending.get(seq, b''))
+                direction.pending[seq] = bytes(payload)
+            return
+
+        self._deliver(key, connection, direction, from_client, timestamp, payload)
+        if direction.pending:
+            self._drain(key, connection, direction, from_client, timestamp)
+
+    def _drain(self, key, connection, direction, from_client, timestamp):
+        # Delivers buffered segments that became in order
+        progressed = True
+        while direction.pending and progressed:
+            progressed = False
+            for seq in list(direction.pending):
+                offset = _relative(seq, direction.next_seq)
+                if offset > 0:
+                    continue
+                data = direction.pending.pop(seq)
+                direction.pending_bytes -= len(data)
+                if -offset < len(data):
+                    self._deliver(key, connection, direction, from_client, timestamp, data[-offset:])
+                progressed = True
+
+    def _deliver(self, key, connection, direction, from_client, timestamp, data):
+        direction.next_seq = (direction.next_seq + len(data)) % _SEQUENCE_SPACE
+        for message in direction.parser.feed(data):
+            if message[0] == 'request':
+                _, method, host, path = message
+                self.stats.add_request(method, host, path)
+                if len(connection.requests) >= self.max_pending_requests:
+                    self._record(key, connection.requests.popleft(), 0, '')
+                connection.requests.append((timestamp, method, host, path))
+            else:
+                _, status_code, content_type = message
+                self.stats.add_response(status_code, content_type)
+                if status_code < 200:
+                    continue  # Interim responses do not complete the request
+                request = connection.requests.popleft() if connection.requests else (timestamp, '', '', '')
+                self._record(key, request, status_code, content_type)
+
+    def _record(self, key, request, status_code, content_type):
+        timestamp, method, host, path = request
+        self.store.append(timestamp, key, _METHOD_CODES.get(method.encode(), 0), host, path, status_code,
+                          content_type)
+
+    def _close(self, key, connection):
+        if connection.server.parser.finish():
+            self.stats.close_delimited += 1
+        connection.client.parser.finish()
+        # Requests that never got a response are kept with status code 0
+        while connection.requests:
+            self._record(key, connection.requests.popleft(), 0, '')
+
+    def expire(self, now):
+        """Evicts the connections idle for idle_timeout seconds at time now."""
+        connections = self._connections
+        while connections:
+            key = next(iter(connections))
+            if now - connections[key].last_seen < self.idle_timeout:
+                break
+            self._close(*connections.popitem(last=False))
+
+    def flush(self):
+        """Closes every tracked connection, e.g. at the end of a capture."""
+        while self._connections:
+            self._close(*self._connections.popitem(last=False))
+
+    def to_dataframe(self):
+        """Returns the HTTP transactions as a DataFrame (call flush first to include open connections)."""
+        return self.store.to_dataframe()
@@ -0,0 +1,291 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets (1 us to 1 s)
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 0.1, 1.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter (increments from several threads must be serialized by the caller)."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class CounterFunction:
+    """Monotonic counter kept by a component, read from a callable when the metrics are rendered."""
+
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function()
+
+
+class Gauge:
+    """Value read from a callable when the metrics are rendered, so it costs nothing on the hot path."""
+
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function()
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds
+
+    Arguments:
+    buckets: Sorted upper bounds of the buckets
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            yield name + '_bucket', labels + (('le', _format_value(bound)),), cumulative
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class StageTimer:
+    """Measures consecutive stages of one packet: each lap() records the time since the previous one."""
+
+    __slots__ = ('_metrics', '_last')
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+        self._last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        self._metrics.stage(stage).observe((now - self._last) / 1_000_000_000)
+        self._last = now
+
+
+class Metrics:
+    """
+    Registry of the analyzer metrics, rendered in the Prometheus text format
+
+    Call sites test enabled before measuring anything, so a disabled registry
+    costs one attribute check per instrumentation point. Stage latencies are
+    sampled: timer(site) only times one call in sample_every of each call site,
+    which keeps the histograms representative at a fraction of the cost; every
+    site has its own sampling counter, so nested instrumented calls do not
+    change each other's sample rate. Gauges and counter functions are callables
+    evaluated only when the metrics are rendered (queue depths, drop counters
+    kept by the components themselves).
+
+    Arguments:
+    enabled: Whether the hot path records measurements
+    prefix: Prefix of every metric name
+    sample_every: One packet in sample_every has its stages timed
+    """
+
+    def __init__(self, enabled=False, prefix='analyzer_', sample_every=16):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.sample_every = max(int(sample_every), 1)
+        self._timer_calls = {}
+        self._families = OrderedDict()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, kind, name, help_text, labels, factory):
+        name = self.prefix + name
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (kind, help_text, OrderedDict())
+            metric = family[2].get(labels)
+            if metric is None:
+                metric = family[2][labels] = factory()
+        return metric
+
+    # Counter families are registered under their sample name (name_total), which the
+    # 0.0.4 text format requires for the TYPE line to apply to the series
+
+    def counter(self, name, help_text, **labels):
+        return self._metric('counter', name + '_total', help_text, labels, Counter)
+
+    def counter_function(self, name, help_text, function, **labels):
+        """Registers (or replaces) a counter reading the monotonic value function()."""
+        counter = self._metric('counter', name + '_total', help_text, labels, lambda: CounterFunction(function))
+        counter.function = function
+        return counter
+
+    def gauge(self, name, help_text, function, **labels):
+        """Registers (or replaces) a gauge reading function()."""
+        gauge = self._metric('gauge', name, help_text, labels, lambda: Gauge(function))
+        gauge.function = function
+        return gauge
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        return self._metric('histogram', name, help_text, labels, lambda: Histogram(buckets))
+
+    def stage(self, stage):
+        """Returns the latency histogram of a processing stage."""
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = self.histogram('stage_seconds', "Time spent per packet in each stage",
+                                                             stage=stage)
+        return histogram
+
+    def timer(self, site):
+        """
+        Starts timing the stages of one call of an instrumented function (only call
+        when enabled); returns None for the calls of site that are not sampled
+        """
+        calls = self._timer_calls[site] = self._timer_calls.get(site, 0) + 1
+        if calls % self.sample_every:
+            return None
+        return StageTimer(self)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = [(name, kind, help_text, list(metrics.items()))
+                        for name, (kind, help_text, metrics) in self._families.items()]
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    lines.append(f"{sample_name}{_format_labels(sample_labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Serves the rendered metrics over HTTP (GET /metrics) from a background thread
+
+    Arguments:
+    metrics: Metrics registry
+    port: TCP port to listen on
+    host: Address to bind, local only by default
+    """
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SnapshotWriter:
+    """
+    Writes the rendered metrics to a file every interval seconds
+
+    The file is replaced atomically, so a reader (e.g. the node exporter textfile
+    collector) never sees a partial snapshot.
+
+    Arguments:
+    metrics: Metrics registry
+    path: Snapshot file
+    interval: Seconds between snapshots
+    """
+
+    def __init__(self, metrics, path, interval=10):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as snapshot_file:
+            snapshot_file.write(self.metrics.render())
+        os.replace(temporary_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stops the writer after a last snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
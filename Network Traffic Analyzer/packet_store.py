@@ -0,0 +1,175 @@
+import socket
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Column layout of the packet store (name -> NumPy dtype).
+# IP addresses are kept as packed integers and timestamps as nanoseconds since the
+# epoch, so the timestamp column can be viewed as datetime64[ns] without a copy.
+COLUMNS = {
+    'src_ip': np.uint32,
+    'dst_ip': np.uint32,
+    'protocol': np.uint8,
+    'timestamp': np.int64,
+    'packet_size': np.uint32,
+    'source_port': np.uint16,
+    'destination_port': np.uint16,
+    'tcp_flags': np.uint8,
+}
+
+
+def ip_to_int(ip):
+    """Converts a dotted IPv4 address to its packed integer form."""
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    """Converts a packed integer IPv4 address back to dotted notation."""
+    return socket.inet_ntoa(struct.pack('!I', int(value)))
+
+
+def ips_to_ints(ips):
+    """
+    Converts a sequence of dotted IPv4 addresses to a uint32 array in one vectorized pass
+
+    Used on columns loaded as strings (e.g. old CSV exports), so the analysis
+    groups and compares integers instead of hashing strings.
+    """
+    octets = pd.Series(ips, dtype='string').str.split('.', expand=True)
+    if octets.shape[1] != 4:
+        raise ValueError("Not a column of dotted IPv4 addresses")
+    octets = octets.astype(np.uint32).to_numpy()
+    if (octets > 255).any():
+        raise ValueError("Not a column of dotted IPv4 addresses")
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def ints_to_ips(values):
+    """Converts an array of packed IPv4 addresses to an array of dotted strings, for display."""
+    octets = np.ascontiguousarray(values, dtype='>u4').view(np.uint8).reshape(-1, 4).astype(str)
+    ips = octets[:, 0]
+    for i in range(1, 4):
+        ips = np.char.add(np.char.add(ips, '.'), octets[:, i])
+    return ips
+
+
+def ipv6_to_bytes(value):
+    """
+    Converts a 128-bit integer IPv6 address (as returned by the decoder) to its
+    16 byte big-endian form, the element type of the 'S16' address arrays.
+    """
+    return int(value).to_bytes(16, 'big')
+
+
+class ColumnarStore:
+    """
+    Growable columnar store
+
+    Every column is a preallocated NumPy array. When the store is full all columns
+    are doubled in size, so appending a row costs amortized O(1) instead of the
+    full copy made by DataFrame.append. Analysis reads the filled part of the
+    arrays through views (columns / to_dataframe) without copying the data.
+
+    Arguments:
+    schema: Dict of column name -> NumPy dtype
+    capacity: Initial number of rows the store can hold before growing
+    datetime_columns: int64 nanosecond columns exposed as datetime64[ns] by to_dataframe
+    """
+
+    def __init__(self, schema, capacity=65536, datetime_columns=()):
+        self.schema = dict(schema)
+        self.datetime_columns = tuple(datetime_columns)
+        self._capacity = max(int(capacity), 1)
+        self._size = 0
+        self._arrays = {name: np.zeros(self._capacity, dtype=dtype) for name, dtype in self.schema.items()}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def _grow(self, minimum):
+        capacity = self._capacity
+        while capacity < minimum:
+            capacity *= 2
+        for name, array in self._arrays.items():
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            self._arrays[name] = grown
+        self._capacity = capacity
+
+    def extend(self, columns):
+        """
+        Appends a batch of rows given as a dict of arrays in store units
+        (packed addresses, timestamps in nanoseconds), growing the store at most once.
+        """
+        count = len(next(iter(columns.values())))
+        end = self._size + count
+        if end > self._capacity:
+            self._grow(end)
+        for name, array in self._arrays.items():
+            array[self._size:end] = columns[name]
+        self._size = end
+
+    def clear(self):
+        """Forgets all stored rows while keeping the allocated buffers."""
+        self._size = 0
+
+    def columns(self):
+        """
+        Returns the stored rows as a dict of NumPy views (column name -> array).
+        The views share memory with the store and are not copied.
+        """
+        return {name: array[:self._size] for name, array in self._arrays.items()}
+
+    def to_dataframe(self):
+        """
+        Builds a DataFrame over the stored rows without copying the columns.
+        The datetime columns are exposed as datetime64[ns].
+        """
+        columns = self.columns()
+        for name in self.datetime_columns:
+            columns[name] = columns[name].view('datetime64[ns]')
+        return pd.DataFrame(columns, copy=False)
+
+
+class PacketStore(ColumnarStore):
+    """
+    Columnar store with one row per packet (see COLUMNS)
+
+    Arguments:
+    capacity: Initial number of packets the store can hold before growing
+    """
+
+    def __init__(self, capacity=65536):
+        super().__init__(COLUMNS, capacity, datetime_columns=('timestamp',))
+
+    def append(self, src_ip, dst_ip, protocol, timestamp, packet_size, source_port=0, destination_port=0,
+               tcp_flags=0):
+        """
+        Adds one packet to the store
+
+        Arguments:
+        src_ip, dst_ip: Packed integer IPv4 addresses (see ip_to_int)
+        protocol: IP protocol number
+        timestamp: Capture time in seconds since the epoch
+        packet_size: Packet length in bytes
+        source_port, destination_port: TCP/UDP ports, 0 for other protocols
+        tcp_flags: TCP flags byte, 0 for other protocols
+        """
+        i = self._size
+        if i == self._capacity:
+            self._grow(i + 1)
+        arrays = self._arrays
+        arrays['src_ip'][i] = src_ip
+        arrays['dst_ip'][i] = dst_ip
+        arrays['protocol'][i] = protocol
+        arrays['timestamp'][i] = int(timestamp * 1_000_000_000)
+        arrays['packet_size'][i] = packet_size
+        arrays['source_port'][i] = source_port
+        arrays['destination_port'][i] = destination_port
+        arrays['tcp_flags'][i] = tcp_flags
+        self._size = i + 1
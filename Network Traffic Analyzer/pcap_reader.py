@@ -0,0 +1,240 @@
+import array
+import mmap
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from decoder import decode_frame
+from packet_store import COLUMNS, PacketStore
+
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+# Classic pcap magic -> (struct byte order, timestamp units per second)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 10 ** 6),
+    b'\xa1\xb2\xc3\xd4': ('>', 10 ** 6),
+    b'\x4d\x3c\xb2\xa1': ('<', 10 ** 9),
+    b'\xa1\xb2\x3c\x4d': ('>', 10 ** 9),
+}
+
+# pcapng block types
+_BLOCK_SHB = 0x0A0D0D0A
+_BLOCK_IDB = 1
+_BLOCK_SPB = 3
+_BLOCK_EPB = 6
+_OPTION_IF_TSRESOL = 9
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# array.array type codes matching the PacketStore column dtypes
+_TYPECODES = {'src_ip': 'I', 'dst_ip': 'I', 'protocol': 'B', 'timestamp': 'q',
+              'packet_size': 'I', 'source_port': 'H', 'destination_port': 'H', 'tcp_flags': 'B'}
+
+# A byte range [start, end) holding whole records, and what is needed to parse it.
+# interfaces is a tuple of (linktype, timestamp units per second) indexed by interface id.
+Chunk = namedtuple('Chunk', ['start', 'end', 'format', 'byte_order', 'interfaces'])
+
+
+def _pcap_chunks(buf, chunk_size):
+    byte_order, units = PCAP_MAGIC[bytes(buf[:4])]
+    (linktype,) = struct.unpack_from(byte_order + 'I', buf, 20)
+    interfaces = ((linktype & 0x0FFFFFFF, units),)
+    record_length = struct.Struct(byte_order + 'I')
+    size = len(buf)
+    start = position = 24
+    # Only the 16 byte record headers are touched here; the records are parsed by the workers
+    while position + 16 <= size:
+        (incl_len,) = record_length.unpack_from(buf, position + 8)
+        following = position + 16 + incl_len
+        if following > size:
+            break
+        position = following
+        if position - start >= chunk_size:
+            yield Chunk(start, position, 'pcap', byte_order, interfaces)
+            start = position
+    if position > start:
+        yield Chunk(start, position, 'pcap', byte_order, interfaces)
+
+
+def _timestamp_units(buf, position, end, byte_order):
+    # Walk the Interface Description Block options looking for if_tsresol
+    option_header = struct.Struct(byte_order + 'HH')
+    while position + 4 <= end:
+        code, length = option_header.unpack_from(buf, position)
+        if code == 0:
+            break
+        if code == _OPTION_IF_TSRESOL and length >= 1:
+            resolution = buf[position + 4]
+            if resolution & 0x80:
+                return 2 ** (resolution & 0x7F)
+            return 10 ** resolution
+        position += 4 + (length + 3) // 4 * 4
+    return 10 ** 6
+
+
+def _pcapng_chunks(buf, chunk_size):
+    size = len(buf)
+    byte_order = '<'
+    interfaces = []
+    start = None
+    position = 0
+    while position + 12 <= size:
+        if bytes(buf[position:position + 4]) == PCAPNG_MAGIC:
+            # The byte order magic of a Section Header Block sets the order for the whole section
+            byte_order = '<' if bytes(buf[position + 8:position + 12]) == b'\x4d\x3c\x2b\x1a' else '>'
+        block_type, block_length = struct.unpack_from(byte_order + 'II', buf, position)
+        if block_length < 12 or position + block_length > size:
+            break
+
+        if block_type in (_BLOCK_EPB, _BLOCK_SPB):
+            if start is None:
+                start = position
+            if position + block_length - start >= chunk_size:
+                yield Chunk(start, position + block_length, 'pcapng', byte_order, tuple(interfaces))
+                start = None
+        elif block_type in (_BLOCK_IDB, _BLOCK_SHB):
+            # Chunks never span interface or section definitions, so each one carries a complete table
+            if start is not None:
+                yield Chunk(start, position, 'pcapng', byte_order, tuple(interfaces))
+                start = None
+            if block_type == _BLOCK_IDB:
+                (linktype,) = struct.unpack_from(byte_order + 'H', buf, position + 8)
+                units = _timestamp_units(buf, position + 16, position + block_length - 4, byte_order)
+                interfaces.append((linktype, units))
+            else:
+                interfaces = []
+        position += block_length
+
+    if start is not None:
+        yield Chunk(start, position, 'pcapng', byte_order, tuple(interfaces))
+
+
+def _records(buf, chunk):
+    # Yields (offset, caplen, orig_len, linktype, timestamp ns) for every frame of a chunk
+    position = chunk.start
+    if chunk.format == 'pcap':
+        record = struct.Struct(chunk.byte_order + 'IIII')
+        linktype, units = chunk.interfaces[0]
+        scale = 10 ** 9 // units
+        while position < chunk.end:
+            ts_sec, ts_frac, incl_len, orig_len = record.unpack_from(buf, position)
+            yield position + 16, incl_len, orig_len, linktype, ts_sec * 10 ** 9 + ts_frac * scale
+            position += 16 + incl_len
+    else:
+        block_header = struct.Struct(chunk.byte_order + 'II')
+        enhanced = struct.Struct(chunk.byte_order + 'IIIII')
+        simple = struct.Struct(chunk.byte_order + 'I')
+        while position < chunk.end:
+            block_type, block_length = block_header.unpack_from(buf, position)
+            if block_type == _BLOCK_EPB:
+                interface, ts_high, ts_low, caplen, orig_len = enhanced.unpack_from(buf, position + 8)
+                if interface < len(chunk.interfaces):
+                    linktype, units = chunk.interfaces[interface]
+                    ts = (ts_high << 32) | ts_low
+                    yield position + 28, caplen, orig_len, linktype, ts * 10 ** 9 // units
+            elif block_type == _BLOCK_SPB and chunk.interfaces:
+                # Simple Packet Blocks carry no timestamp
+                (orig_len,) = simple.unpack_from(buf, position + 8)
+                yield position + 12, min(orig_len, block_length - 16), orig_len, chunk.interfaces[0][0], 0
+            position += block_length
+
+
+def _parse_chunk(path, chunk):
+    """Parses the records of one chunk into typed columns (runs in a worker process)."""
+    columns = {name: array.array(code) for name, code in _TYPECODES.items()}
+    src_ips, dst_ips = columns['src_ip'], columns['dst_ip']
+    protocols, timestamps = columns['protocol'], columns['timestamp']
+    sizes = columns['packet_size']
+    source_ports, destination_ports = columns['source_port'], columns['destination_port']
+    tcp_flags = columns['tcp_flags']
+
+    def add(buf, offset, caplen, orig_len, linktype, nanoseconds):
+        decoded = decode_frame(buf, offset, caplen, linktype)
+        # The packet store holds IPv4 addresses only
+        if decoded is None or decoded[0] != 4:
+            return
+        src_ips.append(decoded[1])
+        dst_ips.append(decoded[2])
+        protocols.append(decoded[3])
+        timestamps.append(nanoseconds)
+        sizes.append(orig_len)
+        source_ports.append(decoded[4])
+        destination_ports.append(decoded[5])
+        tcp_flags.append(decoded[6])
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for offset, caplen, orig_len, linktype, nanoseconds in _records(buf, chunk):
+            add(buf, offset, caplen, orig_len, linktype, nanoseconds)
+
+    return {name: np.frombuffer(column, dtype=COLUMNS[name]) for name, column in columns.items()}
+
+
+def _chunks(buf, path, chunk_size):
+    magic = bytes(buf[:4])
+    if magic == PCAPNG_MAGIC:
+        return _pcapng_chunks(buf, chunk_size)
+    if magic in PCAP_MAGIC:
+        return _pcap_chunks(buf, chunk_size)
+    raise ValueError(f"Not a pcap/pcapng file: {path}")
+
+
+def iter_frames(path):
+    """
+    Yields the frames of a pcap or pcapng file sequentially, in file order
+
+    Used by the analyses that need the packet payloads (e.g. HTTP reassembly),
+    which read_pcap does not keep.
+
+    Arguments:
+    path: Path of the pcap/pcapng file
+
+    Output:
+    (frame, timestamp in seconds, linktype) tuples; frame is a bytes copy of the captured data
+    """
+    if os.path.getsize(path) < 24:
+        raise ValueError(f"Not a pcap/pcapng file: {path}")
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for chunk in _chunks(buf, path, DEFAULT_CHUNK_SIZE):
+            for offset, caplen, orig_len, linktype, nanoseconds in _records(buf, chunk):
+                yield buf[offset:offset + caplen], nanoseconds / 1_000_000_000, linktype
+
+
+def read_pcap(path, store=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Loads a pcap or pcapng file into a packet store
+
+    The file is memory-mapped and split into chunks of about chunk_size bytes at
+    record boundaries. The chunks are parsed in a process pool with the fixed-offset
+    header decoder and merged into the store in file order. Frames that are not IPv4
+    are skipped.
+
+    Arguments:
+    path: Path of the pcap/pcapng file
+    store: PacketStore to append to (a new one is created by default)
+    workers: Number of worker processes (defaults to the number of CPUs, 1 parses in-process)
+    chunk_size: Approximate number of bytes handed to a worker at a time
+
+    Output:
+    The PacketStore holding the packets of the file
+    """
+    store = PacketStore() if store is None else store
+    if os.path.getsize(path) < 24:
+        raise ValueError(f"Not a pcap/pcapng file: {path}")
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        chunks = _chunks(buf, path, chunk_size)
+
+        if workers == 1:
+            for columns in map(partial(_parse_chunk, path), chunks):
+                store.extend(columns)
+            return store
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Chunks are submitted while the boundaries are still being found
+            futures = [pool.submit(_parse_chunk, path, chunk) for chunk in chunks]
+            for future in futures:
+                store.extend(future.result())
+    return store
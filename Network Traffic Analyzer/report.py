@@ -0,0 +1,195 @@
+import html
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_POINTS = 1000
+MINUTES_PER_DAY = 24 * 60
+
+
+def _pyplot():
+    # matplotlib is only imported once a report is actually drawn, with a backend that needs no display
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling
+
+    Keeps the first and last points and, from each of threshold - 2 buckets, the
+    point forming the largest triangle with the point kept before it and the mean
+    of the next bucket, which preserves the visual shape of the series.
+
+    Arguments:
+    x, y: Numeric arrays of the same length, x sorted
+    threshold: Number of points to keep
+
+    Output:
+    The indices of the kept points
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following_end = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[end:following_end].mean() if following_end > end else x[-1]
+        mean_y = y[end:following_end].mean() if following_end > end else y[-1]
+        area = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = kept[i + 1] = start + int(np.argmax(area))
+    return kept
+
+
+def min_max(y, buckets):
+    """
+    Min/max downsampling: keeps the minimum and maximum of each of buckets equal
+    slices of y, so spikes survive. Returns the sorted indices of the kept points.
+    """
+    n = len(y)
+    if 2 * buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)[:-1]
+    positions = np.arange(n)
+    # Position of the extreme of each bucket: its value is found with reduceat, then located in the bucket
+    bucket_of = np.repeat(np.arange(buckets), np.diff(np.r_[edges, n]))
+    lowest = np.minimum.reduceat(y, edges)[bucket_of] == y
+    highest = np.maximum.reduceat(y, edges)[bucket_of] == y
+    first_low = np.minimum.reduceat(np.where(lowest, positions, n), edges)
+    first_high = np.minimum.reduceat(np.where(highest, positions, n), edges)
+    return np.unique(np.r_[first_low, first_high])
+
+
+def downsample(series, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """
+    Reduces a numeric Series to at most max_points points for plotting
+
+    Arguments:
+    series: Series indexed by time (or any sorted numeric index)
+    max_points: Maximum number of points kept
+    method: 'lttb' (shape preserving) or 'minmax' (extremes preserving)
+    """
+    if len(series) <= max_points:
+        return series
+    values = series.to_numpy(dtype=np.float64)
+    if method == 'minmax':
+        kept = min_max(values, max_points // 2)
+    else:
+        index = series.index
+        x = index.asi8 if isinstance(index, pd.DatetimeIndex) else np.asarray(index, dtype=np.float64)
+        kept = lttb(x, values, max_points)
+    return series.iloc[kept]
+
+
+def per_minute_counts(timestamps_ns):
+    """
+    Number of packets per minute of an int64 nanosecond timestamp array, as a Series
+    indexed by minute, equivalent to resample('1min').count() without building a
+    time-indexed DataFrame.
+
+    Packets without a timestamp (0 or less, e.g. pcapng Simple Packet Blocks) are
+    left out. Minutes without packets are filled in with zeros as long as the span
+    holds no more minutes than there are packets (or a day), so memory is bounded
+    by the input rather than by the distance between the oldest and newest
+    timestamps; beyond that only the observed minutes are returned.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    timestamps_ns = timestamps_ns[timestamps_ns > 0]
+    if len(timestamps_ns) == 0:
+        return pd.Series(dtype='int64', index=pd.DatetimeIndex([]))
+    minute_ns = 60 * 1_000_000_000
+    minutes, counts = np.unique(timestamps_ns // minute_ns, return_counts=True)
+    first = minutes[0]
+    span = int(minutes[-1] - first) + 1
+    if span > len(minutes) and span <= max(len(timestamps_ns), MINUTES_PER_DAY):
+        dense = np.zeros(span, dtype=counts.dtype)
+        dense[minutes - first] = counts
+        minutes, counts = first + np.arange(span), dense
+    return pd.Series(counts, index=pd.to_datetime(minutes * minute_ns))
+
+
+class Report:
+    """
+    Headless HTML/PNG report bundle
+
+    Charts are drawn with the non-interactive Agg backend into PNG files and
+    referenced, together with the tables, from a single index.html in directory.
+    Time series are downsampled to max_points before drawing, so rendering time
+    does not depend on the length of the capture.
+
+    Arguments:
+    directory: Output directory of the bundle (created if needed)
+    title: Title of the report
+    max_points: Maximum number of points drawn per time series
+    """
+
+    def __init__(self, directory, title='Network traffic report', max_points=DEFAULT_MAX_POINTS):
+        self.directory = directory
+        self.title = title
+        self.max_points = max_points
+        self._sections = []
+        self._plt = None
+
+    def _figure(self, name, title, draw, xlabel=None, ylabel=None):
+        if self._plt is None:
+            self._plt = _pyplot()
+        plt = self._plt
+        fig, ax = plt.subplots(figsize=(10, 5))
+        draw(ax)
+        ax.set_title(title)
+        if xlabel is not None:
+            ax.set_xlabel(xlabel)
+        if ylabel is not None:
+            ax.set_ylabel(ylabel)
+        os.makedirs(self.directory, exist_ok=True)
+        fig.savefig(os.path.join(self.directory, name), dpi=100, bbox_inches='tight')
+        plt.close(fig)
+        self._sections.append(f'<h2>{html.escape(title)}</h2>\n<img src="{html.escape(name)}" alt="{html.escape(title)}">')
+
+    def add_bar(self, name, title, series, xlabel=None, ylabel=None):
+        self._figure(name, title, lambda ax: series.plot(kind='bar', ax=ax), xlabel, ylabel)
+
+    def add_pie(self, name, title, series):
+        def draw(ax):
+            series.plot(kind='pie', autopct='%1.1f%%', ax=ax)
+            ax.set_ylabel('')
+        self._figure(name, title, draw)
+
+    def add_time_series(self, name, title, series, xlabel=None, ylabel=None, method='lttb'):
+        points = downsample(series, self.max_points, method)
+        self._figure(name, title, lambda ax: points.plot(ax=ax), xlabel, ylabel)
+
+    def add_table(self, title, data):
+        if isinstance(data, pd.Series):
+            data = data.to_frame()
+        self._sections.append(f'<h2>{html.escape(title)}</h2>\n{data.to_html()}')
+
+    def add_text(self, title, text):
+        self._sections.append(f'<h2>{html.escape(title)}</h2>\n<pre>{html.escape(str(text))}</pre>')
+
+    def save(self):
+        """Writes index.html and returns its path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, 'index.html')
+        generated = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(path, 'w') as report_file:
+            report_file.write(f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                              f'<title>{html.escape(self.title)}</title>\n</head>\n<body>\n'
+                              f'<h1>{html.escape(self.title)}</h1>\n<p>Generated {generated}</p>\n')
+            report_file.write('\n'.join(self._sections))
+            report_file.write('\n</body>\n</html>\n')
+        return path
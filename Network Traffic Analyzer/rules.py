@@ -0,0 +1,407 @@
+import json
+import operator
+from collections import deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cidr_index import CidrIndex
+from packet_store import COLUMNS, int_to_ip
+
+# Order of the packet fields passed to RuleSet.update (the packet store column order)
+FIELDS = tuple(COLUMNS)
+# Fields rules can test and group by (timestamps only define the rate windows)
+RULE_FIELDS = tuple(field for field in FIELDS if field != 'timestamp')
+ADDRESS_FIELDS = ('src_ip', 'dst_ip')
+
+_COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+RuleHit = namedtuple('RuleHit', ['rule', 'message', 'window_start', 'key', 'value'])
+
+
+def _field_index(field):
+    if field not in RULE_FIELDS:
+        raise ValueError(f"Unknown rule field {field!r}, expected one of {', '.join(RULE_FIELDS)}")
+    return FIELDS.index(field)
+
+
+def _all(functions):
+    def match(packet):
+        for function in functions:
+            if not function(packet):
+                return False
+        return True
+    return match
+
+
+def _any(functions):
+    def match(packet):
+        for function in functions:
+            if function(packet):
+                return True
+        return False
+    return match
+
+
+def compile_condition(condition):
+    """
+    Compiles a condition into a per-packet predicate and a column mask function
+
+    A condition is a dict with one of the forms:
+    {'field': f, 'op': '>', 'value': v}: Comparison (==, !=, <, <=, >, >=, or '&' for any of the bits of v set)
+    {'field': f, 'in': [v, ...]}: Membership in a set of values, e.g. ports
+    {'field': f, 'cidr': ['10.0.0.0/8', ...]}: Address in one of the networks
+    {'all': [condition, ...]}, {'any': [condition, ...]}, {'not': condition}
+
+    Output:
+    A (predicate, mask) pair: predicate(packet) tests a tuple of packet fields in
+    FIELDS order; mask(columns, cache) returns the boolean mask of a batch, sharing
+    the masks of identical sub-conditions through the cache dict
+    """
+    key = json.dumps(condition, sort_keys=True)
+
+    if 'all' in condition or 'any' in condition:
+        combine_all = 'all' in condition
+        parts = [compile_condition(part) for part in condition['all' if combine_all else 'any']]
+        if not parts:
+            raise ValueError("'all' and 'any' need at least one condition")
+        predicate = (_all if combine_all else _any)([part[0] for part in parts])
+        reduce = np.logical_and if combine_all else np.logical_or
+
+        def compute(columns, cache):
+            result = parts[0][1](columns, cache)
+            for part in parts[1:]:
+                result = reduce(result, part[1](columns, cache))
+            return result
+
+    elif 'not' in condition:
+        inner_predicate, inner_mask = compile_condition(condition['not'])
+
+        def predicate(packet):
+            return not inner_predicate(packet)
+
+        def compute(columns, cache):
+            return ~inner_mask(columns, cache)
+
+    elif 'field' in condition:
+        field = condition['field']
+        i = _field_index(field)
+        if 'cidr' in condition:
+            if field not in ADDRESS_FIELDS:
+                raise ValueError(f"'cidr' only applies to {' and '.join(ADDRESS_FIELDS)}")
+            index = CidrIndex(condition['cidr'])
+            lookup_one = index.lookup_one
+
+            def predicate(packet):
+                return lookup_one(packet[i]) is not None
+
+            def compute(columns, cache):
+                return index.contains(columns[field])
+
+        elif 'in' in condition:
+            values = frozenset(int(value) for value in condition['in'])
+            array = np.array(sorted(values), dtype=np.int64)
+
+            def predicate(packet):
+                return packet[i] in values
+
+            def compute(columns, cache):
+                return np.isin(columns[field], array)
+
+        elif condition.get('op') == '&':
+            bits = int(condition['value'])
+            limits = np.iinfo(COLUMNS[field])
+            if not 0 < bits <= limits.max:
+                raise ValueError(f"Bit mask {bits} does not fit the {field!r} field (1 to {limits.max})")
+
+            def predicate(packet):
+                return packet[i] & bits != 0
+
+            def compute(columns, cache):
+                return (columns[field] & bits) != 0
+
+        elif condition.get('op') in _COMPARISONS:
+            compare = _COMPARISONS[condition['op']]
+            value = condition['value']
+
+            def predicate(packet):
+                return compare(packet[i], value)
+
+            def compute(columns, cache):
+                return compare(columns[field], value)
+
+        else:
+            raise ValueError(f"Condition on {field!r} needs an 'op' and 'value', an 'in' set or a 'cidr' list")
+    else:
+        raise ValueError(f"Invalid condition {condition!r}")
+
+    def mask(columns, cache):
+        result = cache.get(key)
+        if result is None:
+            result = cache[key] = np.asarray(compute(columns, cache), dtype=bool)
+        return result
+
+    return predicate, mask
+
+
+def _group_starts(groups):
+    # Index of the first element of the run each element of a sorted array belongs to
+    starts = np.r_[True, groups[1:] != groups[:-1]]
+    return np.maximum.accumulate(np.where(starts, np.arange(len(groups)), 0))
+
+
+class Rule:
+    """
+    One declarative detection rule
+
+    A packet matches the rule when it satisfies the condition and, counted with the
+    earlier matching packets of the same window and group, the rate of the group
+    exceeds threshold. The rate is the number of packets, the number of distinct
+    values of the distinct field, or the sum of the sum field. Windows are tumbling
+    windows of window seconds aligned on the epoch, like the detectors' windows.
+    With the default threshold of 0 and no grouping every packet satisfying the
+    condition matches, and the rule reports once per window.
+
+    Arguments:
+    name: Name of the rule
+    where: Condition (see compile_condition), every packet when None
+    window: Window length in seconds
+    by: Fields the rate is grouped by (e.g. ['src_ip'])
+    threshold: The rule matches when the rate is above this value
+    distinct: Field whose distinct values are counted instead of packets
+    sum: Field summed instead of counting packets (e.g. 'packet_size')
+    message: Alert text, the rule name by default
+    """
+
+    def __init__(self, name, where=None, window=60, by=(), threshold=0, distinct=None, sum=None, message=None):
+        if distinct is not None and sum is not None:
+            raise ValueError(f"Rule {name!r} can count distinct values or sum a field, not both")
+        self.name = name
+        self.where = where
+        self.window = window
+        self.by = (by,) if isinstance(by, str) else tuple(by)
+        self.threshold = threshold
+        self.distinct = distinct
+        self.sum = sum
+        self.message = message or f"Rule {name} matched"
+        if where is None:
+            self.predicate, self.mask = (lambda packet: True), (lambda columns, cache: None)
+        else:
+            self.predicate, self.mask = compile_condition(where)
+        self._by_indices = tuple(_field_index(field) for field in self.by)
+        self._distinct_index = None if distinct is None else _field_index(distinct)
+        self._sum_index = None if sum is None else _field_index(sum)
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(**spec)
+
+    def group_key(self, packet):
+        """Returns the group of a packet as a tuple of (field, value) pairs."""
+        return tuple((field, packet[i]) for field, i in zip(self.by, self._by_indices))
+
+    def amount(self, packet):
+        """Returns the contribution of a matching packet to its group's rate (see _RuleState)."""
+        if self._sum_index is not None:
+            return packet[self._sum_index]
+        if self._distinct_index is not None:
+            return packet[self._distinct_index]
+        return 1
+
+    def evaluate(self, columns, windows, cache):
+        """Returns the mask of the packets matching the rule in a batch of columns."""
+        condition = self.mask(columns, cache)
+        count = len(windows)
+        if condition is None:
+            condition = np.ones(count, dtype=bool)
+        if self.threshold <= 0 and not self.by and self.distinct is None and self.sum is None:
+            return condition
+
+        # Running rate of every matching packet within its (window, group), in capture order
+        rows = np.flatnonzero(condition)
+        matched = np.zeros(count, dtype=bool)
+        if len(rows) == 0:
+            return matched
+        keys = [windows[rows] // int(self.window * 1_000_000_000)]
+        keys += [np.asarray(columns[field])[rows].astype(np.int64) for field in self.by]
+        _, groups = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+        groups = groups.ravel()
+        order = np.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        starts = _group_starts(sorted_groups)
+        if self.sum is not None:
+            totals = np.cumsum(np.asarray(columns[self.sum])[rows][order], dtype=np.float64)
+            rates = totals - np.r_[0.0, totals][starts]
+        elif self.distinct is not None:
+            values = np.asarray(columns[self.distinct])[rows][order].astype(np.int64)
+            _, first = np.unique(np.stack([sorted_groups, values], axis=1), axis=0, return_index=True)
+            new_values = np.zeros(len(rows), dtype=np.int64)
+            new_values[first] = 1
+            totals = np.cumsum(new_values)
+            rates = totals - np.r_[0, totals][starts]
+        else:
+            rates = np.arange(1, len(rows) + 1) - starts
+
+        matched[rows[order[rates > self.threshold]]] = True
+        return matched
+
+
+class _RuleState:
+    # Per window and group rates of one rule in streaming mode
+    __slots__ = ('rule', 'windows', 'latest_window')
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.windows = {}
+        self.latest_window = None
+
+
+class RuleSet:
+    """
+    Set of detection rules evaluated together
+
+    Every rule is compiled once into two forms: a chain of closures testing one
+    packet, used while capturing (update), and NumPy mask functions over whole
+    columns, used on stored packets (evaluate). A batch is evaluated in a single
+    pass: each column and each distinct sub-condition is computed once and shared
+    by all the rules that use it. In streaming mode each rule reports each window
+    and group once (a RuleHit), the first time its rate exceeds the threshold; only
+    the newest retained_windows windows are kept.
+
+    Arguments:
+    rules: Iterable of Rule objects or rule dicts (see Rule)
+    retained_windows: Number of most recent windows that still accept late packets
+    on_alert: Optional callable invoked with a RuleHit when a rule reports
+    max_alerts: Number of recent hits kept in the alerts attribute
+    """
+
+    def __init__(self, rules=(), retained_windows=2, on_alert=None, max_alerts=1000):
+        self.retained_windows = max(int(retained_windows), 1)
+        self.on_alert = on_alert
+        self.alerts = deque(maxlen=max_alerts)
+        self.late_packets = 0
+        self._states = []
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __bool__(self):
+        return len(self._states) > 0
+
+    def __iter__(self):
+        return (state.rule for state in self._states)
+
+    def add(self, rule):
+        """Adds a Rule or a rule dict; rule names must be unique."""
+        if isinstance(rule, dict):
+            rule = Rule.from_dict(rule)
+        if any(state.rule.name == rule.name for state in self._states):
+            raise ValueError(f"Duplicate rule name {rule.name!r}")
+        self._states.append(_RuleState(rule))
+        return rule
+
+    def update(self, src_ip, dst_ip, protocol, timestamp, packet_size, source_port=0, destination_port=0,
+               tcp_flags=0):
+        """
+        Tests one packet (in packet store units, timestamp in seconds) against every rule
+
+        Output:
+        The list of RuleHits raised by this packet, usually empty
+        """
+        packet = (src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port, tcp_flags)
+        hits = []
+        for state in self._states:
+            rule = state.rule
+            if not rule.predicate(packet):
+                continue
+            window = int(timestamp // rule.window)
+            if state.latest_window is None or window > state.latest_window:
+                state.latest_window = window
+                oldest = window - self.retained_windows
+                for old in [w for w in state.windows if w <= oldest]:
+                    del state.windows[old]
+            elif window <= state.latest_window - self.retained_windows:
+                self.late_packets += 1
+                continue
+
+            groups = state.windows.get(window)
+            if groups is None:
+                groups = state.windows[window] = {}
+            key = rule.group_key(packet)
+            group = groups.get(key)
+            if group is None:
+                # [rate, reported, distinct values seen]
+                group = groups[key] = [0, False, set() if rule.distinct is not None else None]
+            if group[1]:
+                continue
+            amount = rule.amount(packet)
+            if group[2] is not None:
+                if amount in group[2]:
+                    continue
+                group[2].add(amount)
+                amount = 1
+            group[0] += amount
+            if group[0] > rule.threshold:
+                group[1] = True
+                group[2] = None  # No longer needed once the group has reported
+                hit = RuleHit(rule.name, rule.message, window * rule.window, key, group[0])
+                self.alerts.append(hit)
+                hits.append(hit)
+                if self.on_alert is not None:
+                    self.on_alert(hit)
+        return hits
+
+    def evaluate(self, columns):
+        """
+        Evaluates every rule over a batch of packets in one pass
+
+        Arguments:
+        columns: Dict of column arrays (see PacketStore.columns) or a DataFrame of
+                 packets, in capture order
+
+        Output:
+        A dict of rule name -> boolean mask of the matching packets
+        """
+        count = len(columns['timestamp'])
+        arrays = {}
+        for field in FIELDS:
+            if field in columns:
+                array = np.asarray(columns[field])
+                if field == 'timestamp' and array.dtype.kind in 'OSU':
+                    # E.g. a frame read back from CSV holds the timestamps as strings
+                    try:
+                        array = pd.to_datetime(array).values
+                    except (TypeError, ValueError) as e:
+                        raise ValueError(f"Packet timestamps must be datetimes or integer nanoseconds: {e}") from e
+                arrays[field] = array.view(np.int64) if array.dtype.kind == 'M' else array
+        cache = {}
+        return {state.rule.name: state.rule.evaluate(arrays, arrays['timestamp'], cache) if count
+                else np.zeros(0, dtype=bool) for state in self._states}
+
+    def tracked_keys(self):
+        """Returns the number of (rule, window, group) rates currently held in memory."""
+        return sum(len(groups) for state in self._states for groups in state.windows.values())
+
+
+def format_hit(hit):
+    """Returns the alert text of a RuleHit, with the addresses of its group in dotted notation."""
+    group = ', '.join(f"{field} {int_to_ip(value) if field in ADDRESS_FIELDS else value}" for field, value in hit.key)
+    return f"{hit.message}: {hit.value} in the window starting {hit.window_start}" + (f" ({group})" if group else '')
+
+
+def load_rules(path):
+    """Reads a JSON file holding a list of rule dicts."""
+    with open(path) as rules_file:
+        rules = json.load(rules_file)
+    if not isinstance(rules, list):
+        raise ValueError(f"{path} must hold a list of rules")
+    return [Rule.from_dict(rule) for rule in rules]
@@ -0,0 +1,176 @@
+import glob
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from packet_store import COLUMNS
+
+# Arrow types of the stored columns; timestamps are written as typed nanosecond timestamps
+SCHEMA = pa.schema([(name, pa.timestamp('ns') if name == 'timestamp' else pa.from_numpy_dtype(dtype))
+                    for name, dtype in COLUMNS.items()])
+
+IN_PROGRESS_SUFFIX = '.inprogress'
+# segment-<first timestamp ns>-<last timestamp ns>[-<writer tag>].parquet
+_SEGMENT_NAME = re.compile(r'segment-(\d+)-(\d+)(?:-[\w.]+)?\.parquet$')
+
+
+class SegmentWriter:
+    """
+    Rotating Parquet segment writer
+
+    Packets are written to compressed Parquet segment files partitioned by hour
+    (directory/date=YYYY-MM-DD/hour=HH/). Every write() call becomes a row group,
+    so data reaches the disk as the capture runs. A segment is closed and a new one
+    started when it exceeds rotate_bytes, is older than rotate_seconds, or the
+    packets move to another hour. Open segments carry an .inprogress suffix; on
+    close they are renamed to segment-<first ns>-<last ns>.parquet, so readers can
+    skip files outside a time range from the name alone, and a crash loses at
+    most the open segment.
+
+    Arguments:
+    directory: Root directory of the segments
+    rotate_bytes: Maximum size of a segment file in bytes
+    rotate_seconds: Maximum wall clock lifetime of a segment in seconds
+    compression: Parquet compression codec
+    tag: Optional suffix of the segment names, so several writers (e.g. capture shards)
+         can share one directory
+    """
+
+    def __init__(self, directory, rotate_bytes=256 * 1024 * 1024, rotate_seconds=3600, compression='zstd',
+                 tag=None):
+        self.directory = directory
+        self.tag = tag
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compression = compression
+        self.segments_written = 0
+        self._writer = None
+        self._path = None
+        self._partition = None
+        self._opened_at = None
+        self._first = None
+        self._last = None
+
+    @staticmethod
+    def _partition_of(timestamp_ns):
+        return time.strftime('date=%Y-%m-%d/hour=%H', time.gmtime(timestamp_ns // 1_000_000_000))
+
+    def write(self, columns):
+        """
+        Writes a batch of packets given as PacketStore columns (see PacketStore.columns)
+        """
+        timestamps = columns['timestamp']
+        if len(timestamps) == 0:
+            return
+        # Split the batch where the hour partition changes
+        hours = timestamps // 3_600_000_000_000
+        boundaries = np.flatnonzero(np.diff(hours)) + 1
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(timestamps)]):
+            self._write_part({name: column[start:end] for name, column in columns.items()})
+
+    def _write_part(self, columns):
+        timestamps = columns['timestamp']
+        partition = self._partition_of(int(timestamps[0]))
+        if self._writer is not None and (partition != self._partition or self._should_rotate()):
+            self.close()
+        if self._writer is None:
+            self._open(partition, int(timestamps[0]))
+
+        arrays = [pa.array(columns[name].view('datetime64[ns]') if name == 'timestamp' else columns[name],
+                           type=field.type) for name, field in zip(SCHEMA.names, SCHEMA)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=SCHEMA))
+        self._first = min(self._first, int(timestamps.min()))
+        self._last = max(self._last, int(timestamps.max()))
+
+    def _should_rotate(self):
+        if time.monotonic() - self._opened_at >= self.rotate_seconds:
+            return True
+        return os.path.getsize(self._path) >= self.rotate_bytes
+
+    def _open(self, partition, first):
+        directory = os.path.join(self.directory, partition)
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, f"segment-{first}{self._suffix()}{IN_PROGRESS_SUFFIX}")
+        self._writer = pq.ParquetWriter(self._path, SCHEMA, compression=self.compression)
+        self._partition = partition
+        self._opened_at = time.monotonic()
+        self._first = first
+        self._last = first
+
+    def _suffix(self):
+        return '' if self.tag is None else f"-{self.tag}"
+
+    def close(self):
+        """Closes the open segment and gives it its final name."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        final_path = os.path.join(os.path.dirname(self._path),
+                                  f"segment-{self._first}-{self._last}{self._suffix()}.parquet")
+        os.replace(self._path, final_path)
+        self.segments_written += 1
+        self._writer = None
+        self._path = None
+
+
+def _to_ns(value):
+    if value is None:
+        return None
+    return pd.Timestamp(value).value
+
+
+def list_segments(directory, start=None, end=None):
+    """
+    Returns the closed segment files of directory that may hold packets in [start, end]
+
+    Arguments:
+    directory: Root directory of the segments
+    start, end: Optional time bounds (anything pd.Timestamp accepts)
+    """
+    start_ns, end_ns = _to_ns(start), _to_ns(end)
+    selected = []
+    for path in sorted(glob.glob(os.path.join(directory, 'date=*', 'hour=*', 'segment-*.parquet'))):
+        match = _SEGMENT_NAME.search(path)
+        if match is None:
+            continue
+        first, last = int(match.group(1)), int(match.group(2))
+        if (start_ns is not None and last < start_ns) or (end_ns is not None and first > end_ns):
+            continue
+        selected.append(path)
+    return selected
+
+
+def read_segments(directory, start=None, end=None, columns=None):
+    """
+    Loads packets from the segments of directory
+
+    Files outside the time range are skipped by name, row groups outside it are
+    skipped using the Parquet statistics, and only the requested columns are read.
+
+    Arguments:
+    directory: Root directory of the segments
+    start, end: Optional inclusive time bounds (anything pd.Timestamp accepts)
+    columns: Optional list of columns to load
+
+    Output:
+    A DataFrame with the selected packets
+    """
+    files = list_segments(directory, start, end)
+    if not files:
+        return pd.DataFrame({name: pd.Series(dtype=field.type.to_pandas_dtype())
+                             for name, field in zip(SCHEMA.names, SCHEMA) if columns is None or name in columns})
+
+    condition = None
+    if start is not None:
+        condition = ds.field('timestamp') >= pa.scalar(_to_ns(start), type=pa.timestamp('ns'))
+    if end is not None:
+        upper = ds.field('timestamp') <= pa.scalar(_to_ns(end), type=pa.timestamp('ns'))
+        condition = upper if condition is None else condition & upper
+    dataset = ds.dataset(files, schema=SCHEMA, format='parquet')
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
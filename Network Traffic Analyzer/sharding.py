@@ -0,0 +1,316 @@
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+from scapy.all import IP
+
+from capture import CapturePipeline
+from cidr_index import CidrIndex
+from decoder import decode_frame, decode_tcp_segment
+from flow_table import FlowTable
+from http_analysis import HttpAnalyzer
+from packet_store import PacketStore, ip_to_int
+from segment_store import SegmentWriter
+from sketches import HyperLogLog, SpaceSaving
+
+
+class ShardAnalyzer:
+    """
+    Per-packet analysis of one capture shard
+
+    Runs in the shard process: decodes the frames, keeps the shard's flow table
+    and HTTP reassembly (per-flow state, which flow hashing keeps local to one
+    shard), streams the packets to tagged segment files through a packet store
+    that is emptied after every write, and collects
+    mergeable partials of the detector state: per (window, destination port)
+    packet counts with HyperLogLog source sketches, and per time bucket packet and
+    byte totals with Space-Saving destination summaries. The partials are drained
+    every merge interval and merged into the real detectors by the parent process.
+
+    Arguments:
+    shard_id: Index of the shard
+    options: Dict of settings (see ShardedCapture)
+    """
+
+    def __init__(self, shard_id, options):
+        self.shard_id = shard_id
+        self.window_size = options['window_size']
+        self.precision = options['precision']
+        self.bucket_size = options['bucket_size']
+        self.top_k = options['top_k']
+        self.persist_batch = options['persist_batch']
+        self.store = PacketStore()
+        self.flow_table = FlowTable()
+        self.http_analyzer = HttpAnalyzer()
+        self.deny_index = CidrIndex(options['deny_networks'])
+        self.output_directory = options['output_directory']
+        self.segment_writer = SegmentWriter(self.output_directory, tag=f"shard{shard_id}")
+        # Number and time range (ns) of the packets written to the segments
+        self.packets = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._lock = threading.Lock()
+        self._new_partials()
+
+    def _new_partials(self):
+        self._port_partials = {}
+        self._bucket_partials = {}
+        self._denied = Counter()
+
+    def handle(self, frame, timestamp, linktype, packet_class):
+        decoded = decode_frame(frame, 0, len(frame), linktype)
+        if decoded is None:
+            # Frames the fixed-offset decoder does not understand get a full scapy dissection
+            packet = packet_class(frame)
+            if IP not in packet:
+                return
+            layer = packet[IP]
+            transport = layer.payload
+            decoded = (4, ip_to_int(layer.src), ip_to_int(layer.dst), layer.proto, getattr(transport, 'sport', 0),
+                       getattr(transport, 'dport', 0),
+                       int(transport.flags) if layer.proto == 6 and hasattr(transport, 'flags') else 0)
+        ip_version, src_ip, dst_ip, protocol, source_port, destination_port, tcp_flags = decoded
+        if ip_version != 4:
+            return  # The packet store holds IPv4 addresses only
+        packet_size = len(frame)
+
+        segment = None
+        if protocol == 6 and (source_port in self.http_analyzer.ports
+                              or destination_port in self.http_analyzer.ports):
+            segment = decode_tcp_segment(frame, 0, len(frame), linktype)
+
+        with self._lock:
+            self.flow_table.update(timestamp, src_ip, dst_ip, protocol, source_port, destination_port, packet_size,
+                                   tcp_flags)
+
+            if destination_port:
+                key = (int(timestamp // self.window_size), destination_port)
+                partial = self._port_partials.get(key)
+                if partial is None:
+                    partial = self._port_partials[key] = [0, HyperLogLog(self.precision)]
+                partial[0] += 1
+                partial[1].add(src_ip)
+
+            bucket = int(timestamp // self.bucket_size)
+            partial = self._bucket_partials.get(bucket)
+            if partial is None:
+                partial = self._bucket_partials[bucket] = [0, 0, SpaceSaving(self.top_k)]
+            partial[0] += 1
+            partial[1] += packet_size
+            partial[2].add(dst_ip)
+
+            if self.deny_index:
+                denied = self.deny_index.lookup_one(src_ip) or self.deny_index.lookup_one(dst_ip)
+                if denied is not None:
+                    self._denied[denied] += 1
+
+            self.store.append(src_ip, dst_ip, protocol, timestamp, packet_size, source_port, destination_port,
+                              tcp_flags)
+            if len(self.store) >= self.persist_batch:
+                self._persist()
+
+            if segment is not None:
+                self.http_analyzer.process(timestamp, *segment)
+
+    def _persist(self):
+        if not len(self.store):
+            return
+        columns = self.store.columns()
+        self.segment_writer.write(columns)
+        first, last = int(columns['timestamp'].min()), int(columns['timestamp'].max())
+        self.first_timestamp = first if self.first_timestamp is None else min(self.first_timestamp, first)
+        self.last_timestamp = last if self.last_timestamp is None else max(self.last_timestamp, last)
+        self.packets += len(self.store)
+        self.store.clear()
+
+    def drain_partials(self):
+        """Returns the detector partials collected since the previous call and starts new ones."""
+        with self._lock:
+            partials = (self._port_partials, self._bucket_partials, self._denied)
+            self._new_partials()
+        return partials
+
+    def finish(self, capture_stats):
+        """
+        Flushes the shard state and returns what the parent merges into its reports
+
+        Only aggregates travel back to the parent: the flow records, the HTTP
+        statistics and where the rows are. The packets are in the shard's segment
+        files and the HTTP transactions in a Parquet file of the output directory.
+        """
+        with self._lock:
+            self.flow_table.flush()
+            self.http_analyzer.flush()
+            self._persist()
+            self.segment_writer.close()
+            http_path = None
+            if len(self.http_analyzer.store):
+                http_path = os.path.join(self.output_directory,
+                                         f"http-{time.strftime('%Y%m%dT%H%M%S')}-shard{self.shard_id}.parquet")
+                self.http_analyzer.to_dataframe().to_parquet(http_path)
+            return {
+                'shard_id': self.shard_id,
+                'packets': self.packets,
+                'first_timestamp': self.first_timestamp,
+                'last_timestamp': self.last_timestamp,
+                'flows': self.flow_table.store.columns(),
+                'http_path': http_path,
+                'http_stats': self.http_analyzer.stats,
+                'capture': capture_stats,
+            }
+
+
+def _run_shard(shard_id, iface, fanout_group, options, stop, messages):
+    # Entry point of a shard process
+    analyzer = ShardAnalyzer(shard_id, options)
+    pipeline = CapturePipeline(iface, options['bpf_filter'], analyzer.handle, ring_size=options['ring_size'],
+                               socket_buffer=options['socket_buffer'], fanout_group=fanout_group)
+    pipeline.start()
+    messages.put(('started', shard_id, None))
+    try:
+        while not stop.wait(options['merge_interval']):
+            messages.put(('partials', shard_id, analyzer.drain_partials()))
+    finally:
+        pipeline.stop()
+        messages.put(('partials', shard_id, analyzer.drain_partials()))
+        messages.put(('done', shard_id, analyzer.finish(dict(pipeline.stats(), interface=iface))))
+
+
+def apply_partials(partials, port_scan_detector, ddos_detector):
+    """
+    Merges the detector partials of a shard into the global detectors
+
+    Output:
+    A Counter of the denied networks seen by the shard (label -> packets)
+    """
+    port_partials, bucket_partials, denied = partials
+    for (window, destination_port), (packet_count, sources) in sorted(port_partials.items()):
+        port_scan_detector.merge(window, destination_port, packet_count, sources)
+    for bucket, (packet_count, byte_count, destinations) in sorted(bucket_partials.items()):
+        ddos_detector.merge(bucket, packet_count, byte_count, destinations)
+    return denied
+
+
+def merge_results(results, flow_store, http_stats):
+    """
+    Appends the flows and merges the HTTP statistics of every shard, in shard order
+
+    Output:
+    The (first, last) nanosecond timestamps of the packets the shards wrote to
+    their segments, for read_segments, or None when there were no packets
+    """
+    span = None
+    for result in sorted(results, key=lambda result: result['shard_id']):
+        flow_store.extend(result['flows'])
+        http_stats.merge(result['http_stats'])
+        if result['packets']:
+            first, last = result['first_timestamp'], result['last_timestamp']
+            span = (first, last) if span is None else (min(span[0], first), max(span[1], last))
+    return span
+
+
+def read_http_results(results):
+    """Loads the HTTP transactions the shards wrote, as one DataFrame (see HttpAnalyzer.to_dataframe)."""
+    frames = [pd.read_parquet(result['http_path']) for result in results if result['http_path']]
+    if not frames:
+        return HttpAnalyzer().to_dataframe()
+    return pd.concat(frames, ignore_index=True)
+
+
+class ShardedCapture:
+    """
+    Live capture sharded over several processes
+
+    Every interface gets shards_per_interface capture processes. The processes of
+    one interface join a Linux packet fanout group hashed by flow, so the kernel
+    spreads the interface's traffic over them with both directions of a
+    connection in the same shard and no per-flow state shared between processes.
+    Each process decodes and analyses its share (see ShardAnalyzer) without the
+    GIL of the others. Every merge_interval seconds the shards send their
+    detector partials, which on_partials merges into the global detectors (see
+    apply_partials), so thresholds still apply to the traffic of all shards. At
+    the end the shards return their flows and HTTP statistics (see
+    merge_results); their packets and HTTP transactions stay in the files they
+    wrote to output_directory (a temporary directory when none is given).
+
+    Arguments:
+    interfaces: Network interfaces to capture from
+    bpf_filter: BPF filter applied by the kernel
+    shards_per_interface: Capture processes per interface
+    on_partials: Callable on_partials(shard_id, partials) run in the parent process
+    options: Dict of shard settings: window_size, precision, bucket_size, top_k (of
+             the global detectors), output_directory, persist_batch, ring_size,
+             socket_buffer, deny_networks, merge_interval
+    """
+
+    def __init__(self, interfaces, bpf_filter, shards_per_interface=1, on_partials=None, options=None):
+        self.interfaces = list(interfaces)
+        self.shards_per_interface = max(int(shards_per_interface), 1)
+        self.on_partials = on_partials
+        self.options = dict(window_size=60, precision=8, bucket_size=1, top_k=10, output_directory=None,
+                            persist_batch=65536, ring_size=65536, socket_buffer=None, deny_networks=(),
+                            merge_interval=1)
+        self.options.update(options or {})
+        if not self.options['output_directory']:
+            self.options['output_directory'] = tempfile.mkdtemp(prefix='capture-shards-')
+        os.makedirs(self.options['output_directory'], exist_ok=True)
+        self.options['bpf_filter'] = bpf_filter
+        self.results = []
+
+    def _assignments(self):
+        # (iface, fanout group) per shard; one group per interface when it has several shards
+        assignments = []
+        for number, iface in enumerate(self.interfaces):
+            group = (os.getpid() + number) & 0xFFFF if self.shards_per_interface > 1 else None
+            assignments += [(iface, group)] * self.shards_per_interface
+        return assignments
+
+    def run(self, duration):
+        """Captures for duration seconds and returns the results of every shard."""
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        messages = context.Queue()
+        processes = [context.Process(target=_run_shard, args=(shard_id, iface, group, self.options, stop, messages),
+                                     name=f'capture-shard-{shard_id}', daemon=True)
+                     for shard_id, (iface, group) in enumerate(self._assignments())]
+        for process in processes:
+            process.start()
+
+        results = {}
+        started = set()
+        deadline = None
+        try:
+            while len(results) < len(processes):
+                if deadline is None and len(started) == len(processes):
+                    # The capture time starts once every shard listens
+                    deadline = time.monotonic() + duration
+                if deadline is not None and time.monotonic() >= deadline:
+                    stop.set()
+                try:
+                    kind, shard_id, payload = messages.get(timeout=0.2)
+                except queue.Empty:
+                    if any(process.exitcode is not None and shard_id not in results
+                           for shard_id, process in enumerate(processes)):
+                        # A shard failed (e.g. could not open its interface): stop the others
+                        stop.set()
+                    if not any(process.is_alive() for process in processes):
+                        break
+                    continue
+                if kind == 'started':
+                    started.add(shard_id)
+                elif kind == 'partials':
+                    if self.on_partials is not None:
+                        self.on_partials(shard_id, payload)
+                else:
+                    results[shard_id] = payload
+        finally:
+            stop.set()
+            for process in processes:
+                process.join()
+        self.results = [results[shard_id] for shard_id in sorted(results)]
+        return self.results
@@ -0,0 +1,180 @@
+import math
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value):
+    """
+    Mixes an integer into a well distributed 64-bit hash (splitmix64 finalizer).
+    Packed IP addresses and ports are small, clustered integers, so they are mixed
+    before being used as sketch input.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter
+
+    Items are kept in an exact set until there are more than sparse_limit of them,
+    after which the sketch switches to 2**precision one-byte registers. Memory is
+    therefore bounded by max(sparse_limit items, 2**precision bytes) no matter how
+    many distinct items are added.
+
+    Arguments:
+    precision: Number of index bits (4-16); the standard error is about 1.04 / sqrt(2**precision)
+    sparse_limit: Number of distinct items counted exactly before switching to registers
+    """
+
+    __slots__ = ('precision', 'sparse_limit', '_sparse', '_registers', '_harmonic_sum', '_zeros')
+
+    def __init__(self, precision=8, sparse_limit=32):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.sparse_limit = sparse_limit
+        self._sparse = set()
+        self._registers = None
+        # Running sum of 2**-register and count of empty registers, so count() is O(1)
+        self._harmonic_sum = 0.0
+        self._zeros = 0
+
+    def add(self, item):
+        """Adds an integer item to the sketch in O(1)."""
+        if self._registers is None:
+            self._sparse.add(item)
+            if len(self._sparse) > self.sparse_limit:
+                self._densify()
+            return
+        self._add_hash(hash64(item))
+
+    def _add_hash(self, hashed):
+        p = self.precision
+        index = hashed >> (64 - p)
+        remainder = (hashed << p) & _MASK64
+        rank = 64 - p + 1 if remainder == 0 else 65 - remainder.bit_length()
+        current = self._registers[index]
+        if rank > current:
+            self._registers[index] = rank
+            self._harmonic_sum += 2.0 ** -rank - 2.0 ** -current
+            if current == 0:
+                self._zeros -= 1
+
+    def _densify(self):
+        m = 1 << self.precision
+        self._registers = bytearray(m)
+        self._harmonic_sum = float(m)
+        self._zeros = m
+        for item in self._sparse:
+            self._add_hash(hash64(item))
+        self._sparse = None
+
+    def merge(self, other):
+        """Merges another sketch with the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        if other._registers is None:
+            for item in other._sparse:
+                self.add(item)
+            return
+        if self._registers is None:
+            self._densify()
+        self._registers = bytearray(map(max, self._registers, other._registers))
+        self._harmonic_sum = sum(2.0 ** -r for r in self._registers)
+        self._zeros = self._registers.count(0)
+
+    def count(self):
+        """Returns the estimated number of distinct items."""
+        if self._registers is None:
+            return len(self._sparse)
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / self._harmonic_sum
+        zeros = self._zeros
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitter summary
+
+    Tracks at most capacity items. When a new item arrives and the summary is full,
+    the item with the smallest count is replaced and the new item inherits that
+    count as its maximum overestimation error. Any item whose true weight exceeds
+    total_weight / capacity is guaranteed to be present.
+
+    Arguments:
+    capacity: Maximum number of tracked items
+    """
+
+    __slots__ = ('capacity', 'total_weight', '_counts', '_errors')
+
+    def __init__(self, capacity=10):
+        self.capacity = max(int(capacity), 1)
+        self.total_weight = 0
+        self._counts = {}
+        self._errors = {}
+
+    def add(self, item, weight=1):
+        """Adds weight to item; costs O(capacity) at most, independent of the stream length."""
+        self.total_weight += weight
+        counts = self._counts
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+            self._errors[item] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            del self._errors[victim]
+            counts[item] = floor + weight
+            self._errors[item] = floor
+
+    def _floor(self):
+        # Upper bound on the weight of any item the summary does not track
+        return min(self._counts.values()) if len(self._counts) >= self.capacity else 0
+
+    def merge(self, other):
+        """
+        Merges another summary into this one, keeping the capacity heaviest items
+
+        An item tracked by only one side may have been evicted from the other, so
+        it is credited with that side's smallest count, which is also added to its
+        error. Counts stay overestimates and max_error stays an upper bound on the
+        overestimation.
+        """
+        floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for item in self._counts.keys() | other._counts.keys():
+            counts[item] = self._counts.get(item, floor) + other._counts.get(item, other_floor)
+            errors[item] = self._errors.get(item, floor) + other._errors.get(item, other_floor)
+        if len(counts) > self.capacity:
+            keep = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+            counts = {item: counts[item] for item in keep}
+            errors = {item: errors[item] for item in keep}
+        self.total_weight += other.total_weight
+        self._counts = counts
+        self._errors = errors
+
+    def clear(self):
+        self.total_weight = 0
+        self._counts.clear()
+        self._errors.clear()
+
+    def top(self, n=None):
+        """Returns up to n (item, estimated_count, max_error) tuples, heaviest first."""
+        items = sorted(self._counts.items(), key=lambda entry: entry[1], reverse=True)[:n]
+        return [(item, count, self._errors[item]) for item, count in items]
+
+    def __len__(self):
+        return len(self._counts)
@@ -0,0 +1,267 @@
+import email
+import socketserver
+import threading
+import time
+
+import pytest
+
+from alerts import AlertDispatcher, SMTPSink
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib, storing every received message on the server."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost SMTP test server')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                self.server.messages.append(email.message_from_bytes(b''.join(data)))
+                self.reply('250 OK')
+                if self.server.drop_after_message:
+                    # Like a server closing idle connections: the client's pooled connection goes stale
+                    return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.drop_after_message = False
+
+
+class RecordingSink:
+    """Sink recording every digest, failing the first failures sends."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = []
+        self.sent = []
+        self.closed = False
+
+    def send(self, subject, body):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.failures:
+            raise OSError("sink unavailable")
+        self.sent.append((subject, body))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_window_coalesces_alerts_into_one_digest():
+    sink = RecordingSink()
+    dispatcher = AlertDispatcher([sink], window=0.3).start()
+    for port in (22, 80, 443):
+        dispatcher.submit(f"Port scan detected on port {port}")
+    assert wait_for(lambda: sink.sent)
+    time.sleep(0.2)
+    dispatcher.close(timeout=5)
+
+    assert len(sink.sent) == 1
+    subject, body = sink.sent[0]
+    assert subject.endswith("(3 alerts)")
+    assert len(body.splitlines()) == 3
+    assert dispatcher.sent_digests == 1 and dispatcher.submitted == 3
+
+
+def test_digest_merges_alerts_by_kind_and_subject():
+    sink = RecordingSink()
+    dispatcher = AlertDispatcher([sink])
+    dispatcher.submit("Port scan detected on port 80: 120 requests", 1000, kind='port_scan', subject=80)
+    dispatcher.submit("Port scan detected on port 80: 150 requests", 1030, kind='port_scan', subject=80)
+    dispatcher.submit("Port scan detected on port 81: 120 requests", 1040, kind='port_scan', subject=81)
+    dispatcher.submit("Rule hit: 120 requests", 1050, kind='rule:syn_rate', subject=80)
+    dispatcher.submit("Suspicious packets detected!", 1060)
+    dispatcher.submit("Suspicious packets detected!", 1070)
+    dispatcher.close()
+
+    subject, body = sink.sent[0]
+    lines = body.splitlines()
+    assert subject.endswith("(6 alerts)")
+    assert len(lines) == 4
+    # The merged line shows the latest message, the count and the time range
+    assert lines[0].endswith("Port scan detected on port 80: 150 requests (x2)")
+    assert '-' in lines[0].split(']')[0]
+    assert lines[1].endswith("Port scan detected on port 81: 120 requests")
+    assert lines[2].endswith("Rule hit: 120 requests")
+    assert lines[3].endswith("Suspicious packets detected! (x2)")
+
+
+def test_failed_send_is_retried_with_backoff():
+    sink = RecordingSink(failures=2)
+    dispatcher = AlertDispatcher([sink], window=0.05, retries=3, initial_backoff=0.1, max_backoff=1).start()
+    dispatcher.submit("DDoS attack detected")
+    assert wait_for(lambda: sink.sent)
+    dispatcher.close(timeout=5)
+
+    assert len(sink.attempts) == 3
+    first_delay, second_delay = sink.attempts[1] - sink.attempts[0], sink.attempts[2] - sink.attempts[1]
+    assert first_delay >= 0.1
+    assert second_delay >= 0.2
+    assert dispatcher.sent_digests == 1 and dispatcher.failed_digests == 0
+
+
+def test_retries_during_close_are_spaced_by_backoff():
+    sink = RecordingSink(failures=10)
+    dispatcher = AlertDispatcher([sink], window=60, retries=3, initial_backoff=0.1, max_backoff=1).start()
+    dispatcher.submit("DDoS attack detected")
+    dispatcher.close(timeout=5)
+
+    assert len(sink.attempts) == 3
+    assert sink.attempts[1] - sink.attempts[0] >= 0.1
+    assert sink.attempts[2] - sink.attempts[1] >= 0.2
+    assert dispatcher.failed_digests == 1 and sink.closed
+
+
+def test_close_gives_up_retrying_after_its_timeout():
+    sink = RecordingSink(failures=10)
+    dispatcher = AlertDispatcher([sink], window=60, retries=5, initial_backoff=30, max_backoff=60).start()
+    worker = dispatcher._worker
+    dispatcher.submit("DDoS attack detected")
+    started = time.monotonic()
+
+    assert not dispatcher.close(timeout=0.2)
+    assert time.monotonic() - started < 2
+    # The worker stops at once instead of sleeping through the backoff, and closes the sink
+    worker.join(2)
+    assert not worker.is_alive()
+    assert len(sink.attempts) == 1
+    assert dispatcher.failed_digests == 1 and sink.closed
+
+
+def test_sinks_are_not_closed_while_the_worker_sends():
+    class BlockingSink(RecordingSink):
+        def __init__(self):
+            super().__init__()
+            self.sending = threading.Event()
+            self.release = threading.Event()
+            self.closed_while_sending = False
+
+        def send(self, subject, body):
+            self.sending.set()
+            self.release.wait(5)
+            super().send(subject, body)
+
+        def close(self):
+            self.closed_while_sending = self.sending.is_set() and not self.release.is_set()
+            super().close()
+
+    sink = BlockingSink()
+    dispatcher = AlertDispatcher([sink], window=60).start()
+    worker = dispatcher._worker
+    dispatcher.submit("Port scan detected!")
+    dispatcher._stop.set()
+    assert sink.sending.wait(5)
+
+    assert not dispatcher.close(timeout=0.1)
+    assert not sink.closed
+    sink.release.set()
+    worker.join(5)
+    assert sink.closed and not sink.closed_while_sending
+    assert len(sink.sent) == 1
+    # A later close waits for the same worker
+    assert dispatcher.close(timeout=1)
+
+
+def test_close_flushes_queued_alerts():
+    sink = RecordingSink()
+    dispatcher = AlertDispatcher([sink], window=60).start()
+    dispatcher.submit("Traffic to or from denied network 10.0.0.0/8", kind='deny_list', subject='10.0.0.0/8')
+    started = time.monotonic()
+    dispatcher.close(timeout=5)
+
+    # The worker stops waiting for the window and sends what it holds
+    assert time.monotonic() - started < 2
+    assert len(sink.sent) == 1
+    assert dispatcher.pending() == 0 and sink.closed
+
+
+def test_close_without_worker_flushes_queued_alerts():
+    sink = RecordingSink()
+    dispatcher = AlertDispatcher([sink])
+    dispatcher.submit("Port scan detected!")
+    dispatcher.close()
+
+    assert len(sink.sent) == 1 and sink.closed
+
+
+def test_smtp_sink_reuses_its_connection(smtp_server):
+    sink = SMTPSink('127.0.0.1', smtp_server.server_address[1], sender='nta@localhost',
+                    recipients=['admin@localhost'], starttls=False, timeout=5)
+    sink.send('first', 'body 1')
+    sink.send('second', 'body 2')
+    sink.close()
+
+    assert wait_for(lambda: len(smtp_server.messages) == 2)
+    assert smtp_server.connections == 1
+    assert [message['Subject'] for message in smtp_server.messages] == ['first', 'second']
+
+
+def test_smtp_sink_reconnects_after_the_server_drops_the_connection(smtp_server):
+    smtp_server.drop_after_message = True
+    sink = SMTPSink('127.0.0.1', smtp_server.server_address[1], sender='nta@localhost',
+                    recipients=['admin@localhost'], starttls=False, timeout=5)
+    sink.send('first', 'body 1')
+    assert wait_for(lambda: len(smtp_server.messages) == 1)
+    sink.send('second', 'body 2')
+    sink.close()
+
+    assert wait_for(lambda: len(smtp_server.messages) == 2)
+    assert smtp_server.connections == 2
+    assert smtp_server.messages[1]['Subject'] == 'second'
+    assert smtp_server.messages[1].get_payload().strip() == 'body 2'
+
+
+def test_dispatcher_sends_digests_over_smtp(smtp_server):
+    sink = SMTPSink('127.0.0.1', smtp_server.server_address[1], sender='nta@localhost',
+                    recipients=['admin@localhost', 'soc@localhost'], starttls=False, timeout=5)
+    dispatcher = AlertDispatcher([sink], window=60, subject='Alert')
+    dispatcher.submit("Port scan detected on port 22: 50 requests", kind='port_scan', subject=22)
+    dispatcher.submit("Port scan detected on port 22: 80 requests", kind='port_scan', subject=22)
+    dispatcher.close()
+
+    assert wait_for(lambda: smtp_server.messages)
+    message = smtp_server.messages[0]
+    assert message['Subject'] == 'Alert (2 alerts)'
+    assert message['To'] == 'admin@localhost, soc@localhost'
+    assert message.get_payload().strip().endswith("Port scan detected on port 22: 80 requests (x2)")
@@ -0,0 +1,184 @@
+import random
+import struct
+from collections import namedtuple
+
+from packet_store import ip_to_int
+
+# Ground truth of one injected attack; ports is the tuple of targeted destination ports
+Scenario = namedtuple('Scenario', ['kind', 'start', 'end', 'sources', 'targets', 'ports'])
+
+_ETHERNET = struct.Struct('!6s6sH')
+# version/IHL, TOS, total length, id, flags/fragment offset, TTL, protocol, checksum, source, destination
+_IPV4 = struct.Struct('!BBHHHBBHII')
+# ports, sequence, acknowledgement, data offset, flags, window, checksum, urgent pointer
+_TCP = struct.Struct('!HHIIBBHHH')
+_UDP = struct.Struct('!HHHH')
+_ICMP = struct.Struct('!BBHI')
+
+_MACS = b'\x02\x00\x00\x00\x00\x01', b'\x02\x00\x00\x00\x00\x02'
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+TCP_PSH = 0x08
+
+
+def build_frame(src_ip, dst_ip, protocol, source_port=0, destination_port=0, tcp_flags=TCP_ACK, payload_size=0,
+                seq=0):
+    """
+    Packs an Ethernet/IPv4/TCP, UDP or ICMP frame with struct (checksums are left at zero)
+
+    Arguments:
+    src_ip, dst_ip: Packed integer IPv4 addresses
+    protocol: 6 (TCP), 17 (UDP) or 1 (ICMP)
+    source_port, destination_port: TCP/UDP ports
+    tcp_flags: TCP flags byte
+    payload_size: Number of zero payload bytes
+    seq: TCP sequence number
+    """
+    if protocol == 6:
+        transport = _TCP.pack(source_port, destination_port, seq, 0, 5 << 4, tcp_flags, 65535, 0, 0)
+    elif protocol == 17:
+        transport = _UDP.pack(source_port, destination_port, _UDP.size + payload_size, 0)
+    else:
+        transport = _ICMP.pack(8, 0, 0, 0)
+    total_length = 20 + len(transport) + payload_size
+    return b''.join((_ETHERNET.pack(_MACS[1], _MACS[0], 0x0800),
+                     _IPV4.pack(0x45, 0, total_length, 0, 0x4000, 64, protocol, 0, src_ip, dst_ip),
+                     transport, bytes(payload_size)))
+
+
+class TrafficGenerator:
+    """
+    Deterministic synthetic traffic with labelled attacks
+
+    Normal traffic is a mix of clients talking to a pool of servers over TCP
+    (HTTP, HTTPS, SSH), UDP (DNS, NTP) and ICMP, with Poisson arrivals. Port scans
+    and volumetric floods are injected on top, and every injected attack is
+    recorded as a Scenario so detections can be scored.
+
+    Arguments:
+    seed: Random seed, the same seed produces the same packets
+    start_time: Timestamp of the first packet in seconds since the epoch
+    clients, servers: Sizes of the normal client and server address pools
+    """
+
+    def __init__(self, seed=0, start_time=1_700_000_000.0, clients=500, servers=20):
+        self.rng = random.Random(seed)
+        self.start_time = start_time
+        self.clients = [ip_to_int(f"10.0.{i // 250}.{i % 250 + 1}") for i in range(clients)]
+        self.servers = [ip_to_int(f"192.168.0.{i + 1}") for i in range(servers)]
+        self.scenarios = []
+        self._packets = []
+
+    def _arrivals(self, start, duration, rate):
+        # Poisson process: exponential gaps between packets
+        timestamp = self.start_time + start
+        end = timestamp + duration
+        while True:
+            timestamp += self.rng.expovariate(rate)
+            if timestamp >= end:
+                return
+            yield timestamp
+
+    def normal(self, duration, rate, start=0):
+        """Adds duration seconds of normal traffic at rate packets/sec, starting start seconds in."""
+        rng = self.rng
+        for timestamp in self._arrivals(start, duration, rate):
+            client, server = rng.choice(self.clients), rng.choice(self.servers)
+            kind = rng.random()
+            if kind < 0.75:
+                port = rng.choice((80, 443, 443, 22))
+                flags = TCP_ACK | (TCP_PSH if rng.random() < 0.5 else 0)
+                size = rng.choice((0, 0, 512, 1460))
+                if rng.random() < 0.5:
+                    frame = build_frame(client, server, 6, rng.randrange(32768, 61000), port, flags, size)
+                else:
+                    frame = build_frame(server, client, 6, port, rng.randrange(32768, 61000), flags, size)
+            elif kind < 0.97:
+                frame = build_frame(client, server, 17, rng.randrange(32768, 61000), rng.choice((53, 123)),
+                                    payload_size=rng.randrange(32, 512))
+            else:
+                frame = build_frame(client, server, 1, payload_size=56)
+            self._packets.append((timestamp, frame))
+        return self
+
+    def port_sweep(self, start, duration, port=445, hosts=254, rate=50):
+        """Adds one source probing port on hosts addresses of 172.16.0.0/16 with SYNs (horizontal scan)."""
+        rng = self.rng
+        scanner = ip_to_int(f"203.0.113.{rng.randrange(1, 255)}")
+        targets = [ip_to_int(f"172.16.{i // 254}.{i % 254 + 1}") for i in range(hosts)]
+        timestamps = list(self._arrivals(start, duration, rate))
+        for timestamp, target in zip(timestamps, targets * (len(timestamps) // len(targets) + 1)):
+            self._packets.append((timestamp, build_frame(scanner, target, 6, rng.randrange(32768, 61000), port,
+                                                         TCP_SYN)))
+        if timestamps:
+            self.scenarios.append(Scenario('port_scan', timestamps[0], timestamps[-1], (scanner,), tuple(targets),
+                                           (port,)))
+        return self
+
+    def vertical_scan(self, start, ports=range(1, 1025), rate=200):
+        """Adds one source probing every port of ports on a single server with SYNs."""
+        rng = self.rng
+        scanner = ip_to_int(f"198.51.100.{rng.randrange(1, 255)}")
+        target = rng.choice(self.servers)
+        ports = tuple(ports)
+        timestamps = list(self._arrivals(start, len(ports) / rate * 4, rate))[:len(ports)]
+        for timestamp, port in zip(timestamps, ports):
+            self._packets.append((timestamp, build_frame(scanner, target, 6, rng.randrange(32768, 61000), port,
+                                                         TCP_SYN)))
+        if timestamps:
+            self.scenarios.append(Scenario('port_scan', timestamps[0], timestamps[-1], (scanner,), (target,),
+                                           ports[:len(timestamps)]))
+        return self
+
+    def flood(self, start, duration, rate=5000, sources=10000, port=80, payload_size=512):
+        """Adds a volumetric UDP flood from spoofed sources towards one server."""
+        rng = self.rng
+        target = rng.choice(self.servers)
+        timestamps = list(self._arrivals(start, duration, rate))
+        for timestamp in timestamps:
+            source = (100 << 24) | rng.randrange(sources)
+            self._packets.append((timestamp, build_frame(source, target, 17, rng.randrange(1024, 65536), port,
+                                                         payload_size=payload_size)))
+        if timestamps:
+            self.scenarios.append(Scenario('ddos', timestamps[0], timestamps[-1], (), (target,), (port,)))
+        return self
+
+    def packets(self):
+        """Returns the generated (timestamp, frame) pairs in time order."""
+        self._packets.sort(key=lambda packet: packet[0])
+        return self._packets
+
+
+def generate(duration=180, rate=1000, port_scans=1, vertical_scans=1, floods=1, seed=0):
+    """
+    Generates a labelled capture: duration seconds of normal traffic with the attacks
+    spread over it
+
+    Output:
+    A (packets, scenarios) tuple: time-ordered (timestamp, frame) pairs and the
+    Scenario of every injected attack
+    """
+    generator = TrafficGenerator(seed).normal(duration, rate)
+    attacks = [('sweep', i) for i in range(port_scans)] + [('vertical', i) for i in range(vertical_scans)]
+    attacks += [('flood', i) for i in range(floods)]
+    slot = duration / (len(attacks) + 1)
+    for position, (kind, _) in enumerate(attacks, 1):
+        start = slot * position
+        if kind == 'sweep':
+            generator.port_sweep(start, min(slot / 2, 30))
+        elif kind == 'vertical':
+            generator.vertical_scan(start)
+        else:
+            generator.flood(start, min(slot / 2, 10))
+    return generator.packets(), generator.scenarios
+
+
+def write_pcap(path, packets):
+    """Writes (timestamp, frame) pairs to a classic microsecond pcap file with an Ethernet link type."""
+    record = struct.Struct('<IIII')
+    with open(path, 'wb') as pcap_file:
+        pcap_file.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for timestamp, frame in packets:
+            seconds, microseconds = divmod(int(round(timestamp * 1_000_000)), 1_000_000)
+            pcap_file.write(record.pack(seconds, microseconds, len(frame), len(frame)))
+            pcap_file.write(frame)
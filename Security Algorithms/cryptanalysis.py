@@ -0,0 +1,234 @@
+import argparse
+import sys
+
+import numpy as np
+
+from encryption import ALPHABET_SIZE, _letter_positions, _to_codes, caesar_decrypt, vigenere_decrypt
+
+# Relative frequencies of the letters a-z in English text
+ENGLISH_FREQUENCIES = np.array([
+    8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074,
+]) / 100
+# Log-probability of each letter, used to score candidate plaintexts
+ENGLISH_LOG_PROBABILITIES = np.log(ENGLISH_FREQUENCIES)
+# Index of coincidence of English text and of uniformly random letters
+ENGLISH_IOC = float(np.sum(ENGLISH_FREQUENCIES ** 2))
+RANDOM_IOC = 1 / ALPHABET_SIZE
+
+# _SHIFTED[s, j] is the ciphertext letter of plaintext letter j under shift s
+_SHIFTED = (np.arange(ALPHABET_SIZE)[None, :] + np.arange(ALPHABET_SIZE)[:, None]) % ALPHABET_SIZE
+
+
+def letter_indices(text):
+    """
+    Returns the letters of text as alphabet positions (0-25, case folded) in a uint8 array,
+    non-letters dropped.
+    """
+    codes = _to_codes(text)
+    return ((codes[_letter_positions(codes)] | 0x20) - ord('a')).astype(np.uint8)
+
+
+def chi_squared_shifts(counts):
+    """
+    Scores every Caesar shift of letter counts against English in one vectorized step.
+
+    Args:
+        counts (np.ndarray): Letter counts, shape (..., 26).
+
+    Returns:
+        np.ndarray: Chi-squared statistic of each shift, shape (..., 26); lower is more English-like.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1, keepdims=True)
+    # The counts each shift would turn back into plaintext letters a-z
+    observed = counts[..., _SHIFTED]
+    expected = total[..., None] * ENGLISH_FREQUENCIES
+    return np.sum((observed - expected) ** 2 / expected, axis=-1)
+
+
+def log_likelihood_shifts(counts):
+    """Returns the English log-likelihood of every Caesar shift of letter counts (higher is better)."""
+    counts = np.asarray(counts, dtype=np.float64)
+    return counts[..., _SHIFTED] @ ENGLISH_LOG_PROBABILITIES
+
+
+def crack_caesar(ciphertext):
+    """
+    Recovers the shift of a Caesar ciphertext.
+
+    The letter counts are taken once; all 26 shifts are then scored together
+    by chi-squared against English letter frequencies.
+
+    Args:
+        ciphertext (str): The text to be analysed.
+
+    Returns:
+        tuple: The shift, the decrypted text and the chi-squared score of the shift.
+
+    Raises:
+        ValueError: If the ciphertext contains no letters.
+    """
+    letters = letter_indices(ciphertext)
+    if len(letters) == 0:
+        raise ValueError("The ciphertext contains no letters.")
+    counts = np.bincount(letters, minlength=ALPHABET_SIZE)
+    scores = chi_squared_shifts(counts)
+    shift = int(np.argmin(scores))
+    return shift, caesar_decrypt(ciphertext, shift), float(scores[shift])
+
+
+def column_counts(letters, key_length):
+    """Returns the letter counts of each of the key_length columns of a letter array, shape (key_length, 26)."""
+    columns = np.arange(len(letters)) % key_length
+    counts = np.bincount(columns * ALPHABET_SIZE + letters, minlength=key_length * ALPHABET_SIZE)
+    return counts.reshape(key_length, ALPHABET_SIZE)
+
+
+def index_of_coincidence(counts):
+    """Returns the index of coincidence of letter counts, shape (..., 26) -> (...)."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(np.sum(counts * (counts - 1), axis=-1) / (total * (total - 1)))
+
+
+def kasiski_examination(letters, max_key_length=20, sample=200000):
+    """
+    Counts, for every candidate key length, the distances between repeated
+    trigrams that it divides (Kasiski examination).
+
+    The trigrams are encoded as integers and sorted once, so repeats are found
+    without any dictionary. Only the first sample letters are examined.
+
+    Returns:
+        np.ndarray: Votes per key length, indexed by the length (entries 0 and 1 are 0).
+    """
+    letters = letters[:sample].astype(np.int64)
+    votes = np.zeros(max_key_length + 1, dtype=np.int64)
+    if len(letters) < 3:
+        return votes
+    trigrams = letters[:-2] * ALPHABET_SIZE ** 2 + letters[1:-1] * ALPHABET_SIZE + letters[2:]
+    order = np.argsort(trigrams, kind='stable')
+    repeated = trigrams[order][1:] == trigrams[order][:-1]
+    # Distances between consecutive occurrences of the same trigram
+    distances = (order[1:] - order[:-1])[repeated]
+    lengths = np.arange(2, max_key_length + 1)
+    votes[2:] = np.count_nonzero(distances[:, None] % lengths[None, :] == 0, axis=0)
+    return votes
+
+
+def estimate_key_length(letters, max_key_length=20, candidates=3, sample=100000):
+    """
+    Ranks the likely Vigenere key lengths of a ciphertext.
+
+    For every length the average index of coincidence of its columns is
+    computed (columns encrypted with one key letter look like English, 0.0667;
+    wrong lengths mix alphabets and look random, 0.0385). Multiples of the true
+    length score as well as the length itself, so the shortest length scoring
+    close to the best is preferred, and Kasiski votes break near ties. Only the
+    first sample letters are needed to tell the lengths apart.
+
+    Args:
+        letters (np.ndarray): The ciphertext letters (see letter_indices).
+        max_key_length (int): The longest key length considered.
+        candidates (int): Number of lengths returned.
+        sample (int): Number of letters examined.
+
+    Returns:
+        list: Candidate key lengths, most likely first.
+    """
+    letters = letters[:sample]
+    max_key_length = max(1, min(max_key_length, len(letters) // 2))
+    lengths = np.arange(1, max_key_length + 1)
+    ioc = np.array([index_of_coincidence(column_counts(letters, length)).mean() for length in lengths])
+    votes = kasiski_examination(letters, max_key_length, sample)[1:]
+    # Normalized IoC (0 random, 1 English), a small bonus for Kasiski votes and a small penalty for long keys
+    closeness = (ioc - RANDOM_IOC) / (ENGLISH_IOC - RANDOM_IOC)
+    score = closeness + 0.05 * votes / max(votes.max(), 1) - 0.01 * lengths
+    ranked = [int(length) for length in lengths[np.argsort(-score, kind='stable')]]
+    # Clamped to the best value, so some length always qualifies (even when no length looks like English)
+    best = float(closeness.max())
+    threshold = min(0.75, 0.9 * best, best)
+    shortest = next((int(length) for length, value in zip(lengths, closeness) if value >= threshold), ranked[0])
+    return [shortest] + [length for length in ranked if length != shortest][:candidates - 1]
+
+
+def solve_vigenere_key(letters, key_length):
+    """
+    Recovers the key of a given length: every column is a Caesar cipher, and all
+    columns are solved at once by chi-squared over a (key_length, 26, 26) array.
+
+    Returns:
+        tuple: The key (uppercase str) and the English log-likelihood of the decryption.
+    """
+    counts = column_counts(letters, key_length)
+    shifts = np.argmin(chi_squared_shifts(counts), axis=1)
+    likelihood = float(log_likelihood_shifts(counts)[np.arange(key_length), shifts].sum())
+    return ''.join(chr(ord('A') + int(shift)) for shift in shifts), likelihood
+
+
+def crack_vigenere(ciphertext, max_key_length=20, candidates=3):
+    """
+    Recovers the key of a Vigenere ciphertext.
+
+    The key length is estimated with the index of coincidence and Kasiski
+    examination; the best candidate lengths are then solved column by column and
+    the key whose decryption is most English-like (log-likelihood, penalized by
+    the key length) is kept.
+
+    Args:
+        ciphertext (str): The text to be analysed.
+        max_key_length (int): The longest key length considered.
+        candidates (int): Number of key lengths tried.
+
+    Returns:
+        tuple: The key and the decrypted text.
+
+    Raises:
+        ValueError: If the ciphertext contains no letters.
+    """
+    letters = letter_indices(ciphertext)
+    if len(letters) == 0:
+        raise ValueError("The ciphertext contains no letters.")
+    best_key, best_likelihood = None, -np.inf
+    for key_length in estimate_key_length(letters, max_key_length, candidates):
+        key, likelihood = solve_vigenere_key(letters, key_length)
+        # Keys that repeat a shorter key give the same decryption
+        for period in range(1, len(key)):
+            if len(key) % period == 0 and key == key[:period] * (len(key) // period):
+                key = key[:period]
+                break
+        # Every key letter is fitted to the text, so longer keys are penalized (BIC) to avoid overfitting
+        likelihood -= len(key) * 0.5 * np.log(len(letters))
+        if likelihood > best_likelihood:
+            best_key, best_likelihood = key, likelihood
+    return best_key, vigenere_decrypt(ciphertext, best_key)
+
+
+def main(argv=None):
+    """Command line: recovers the key of a Caesar or Vigenere ciphertext read from a file or stdin."""
+    parser = argparse.ArgumentParser(description="Break Caesar and Vigenere ciphertexts")
+    parser.add_argument('cipher', choices=['caesar', 'vigenere'])
+    parser.add_argument('-i', '--input', default='-', help="Ciphertext file, - for stdin")
+    parser.add_argument('--max-key-length', type=int, default=20, help="Longest Vigenere key considered")
+    parser.add_argument('--show', type=int, default=200, help="Characters of the plaintext printed")
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        ciphertext = sys.stdin.read()
+    else:
+        with open(args.input, encoding='utf-8', newline='') as source:
+            ciphertext = source.read()
+
+    if args.cipher == 'caesar':
+        shift, plaintext, _ = crack_caesar(ciphertext)
+        print(f"Shift: {shift}")
+    else:
+        key, plaintext = crack_vigenere(ciphertext, args.max_key_length)
+        print(f"Key: {key}")
+    print(plaintext[:args.show])
+
+
+if __name__ == "__main__":
+    main()
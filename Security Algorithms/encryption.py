@@ -1,10 +1,119 @@
+import argparse
+import io
+import string
+import sys
 from collections import deque
-from pycipher import Caesar, Vigenere
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+ALPHABET_SIZE = 26
+CIPHERS = ('caesar', 'vigenere', 'railfence')
+# Characters read at a time when streaming
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Rail Fence streams are enciphered in independent blocks of this many characters
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# Batches of fewer messages than this are never split across processes
+MIN_MESSAGES_PER_WORKER = 10000
+_UPPER_A, _LOWER_A = ord('A'), ord('a')
+# Alphabet position (0-50, a position plus a shift) -> rotated position + 1
+_ROTATIONS = np.arange(2 * ALPHABET_SIZE, dtype=np.uint8) % ALPHABET_SIZE + 1
+
+
+@lru_cache(maxsize=64)
+def _caesar_tables(shift):
+    """
+    Builds the translation tables of a Caesar shift once: a str.maketrans table for
+    any text, and a bytes.maketrans table for the ASCII fast path.
+    """
+    shift %= ALPHABET_SIZE
+    source = string.ascii_uppercase + string.ascii_lowercase
+    target = (string.ascii_uppercase[shift:] + string.ascii_uppercase[:shift]
+              + string.ascii_lowercase[shift:] + string.ascii_lowercase[:shift])
+    return str.maketrans(source, target), bytes.maketrans(source.encode(), target.encode())
+
+
+def _caesar(text, shift):
+    text_table, bytes_table = _caesar_tables(shift % ALPHABET_SIZE)
+    if text.isascii():
+        # bytes.translate is a single table lookup per byte in C
+        return text.encode('ascii').translate(bytes_table).decode('ascii')
+    return text.translate(text_table)
+
+
+@lru_cache(maxsize=64)
+def _vigenere_shifts(key):
+    """Returns the shifts of a Vigenere key as a read-only uint8 array (non-letters of the key are ignored)."""
+    letters = [ord(char) - _UPPER_A for char in key.upper() if 'A' <= char <= 'Z']
+    if not letters:
+        raise ValueError("The Vigenere key must contain at least one letter.")
+    shifts = np.array(letters, dtype=np.uint8)
+    shifts.flags.writeable = False
+    return shifts
+
+
+def _to_codes(text):
+    """Returns the characters of text as a writable array of code points (uint8 for ASCII text)."""
+    if text.isascii():
+        return np.frombuffer(bytearray(text.encode('ascii')), dtype=np.uint8)
+    return np.frombuffer(bytearray(text.encode('utf-32-le')), dtype=np.uint32)
+
+
+def _from_codes(codes):
+    if codes.dtype == np.uint8:
+        return codes.tobytes().decode('ascii')
+    return codes.tobytes().decode('utf-32-le')
+
+
+def _repeat_key(shifts, count, dtype):
+    """Returns shifts repeated over count positions (a broadcast copy, np.resize is far slower)."""
+    length = len(shifts)
+    repeated = np.empty(count, dtype=dtype)
+    whole = count - count % length
+    repeated[:whole].reshape(-1, length)[:] = shifts
+    repeated[whole:] = shifts[:count - whole]
+    return repeated
+
+
+def _letter_positions(codes):
+    """Returns the indices of the ASCII letters of a code point array."""
+    kind = codes.dtype.type
+    # ASCII letters differ from their lowercase form by bit 0x20 only, so one unsigned comparison finds them
+    return np.flatnonzero(((codes | kind(0x20)) - kind(_LOWER_A)) < ALPHABET_SIZE)
+
+
+def _shift_letters(codes, positions, key):
+    """Shifts the letters at positions in place, each by its entry of key (same dtype as codes)."""
+    kind = codes.dtype.type
+    letters = codes[positions]
+    # The low five bits of a letter are its alphabet position + 1, the high bits its case
+    rotated = _ROTATIONS.astype(codes.dtype, copy=False)[(letters & kind(0x1F)) - kind(1) + key]
+    codes[positions] = (letters & kind(0xE0)) | rotated
+
+
+def _vigenere_codes(codes, shifts, offset=0):
+    """
+    Shifts the letters of a code point array in place, letter i (counting letters
+    only, from offset) by shifts[i % len(shifts)]. Case and non-letters are kept.
+
+    Returns:
+        int: The number of letters shifted.
+    """
+    positions = _letter_positions(codes)
+    count = len(positions)
+    if count:
+        # The key repeated over the letters, starting at the key position of offset
+        _shift_letters(codes, positions, _repeat_key(np.roll(shifts, -(offset % len(shifts))), count, codes.dtype))
+    return count
+
 
 def caesar_encrypt(text, shift):
     """
     Encrypts text using the Caesar Cipher.
 
+    Letters keep their case; digits, punctuation and whitespace are left as they are.
+
     Args:
         text (str): The text to be encrypted.
         shift (int): The number of positions to shift the letters.
@@ -12,7 +121,7 @@ def caesar_encrypt(text, shift):
     Returns:
         str: The encrypted text.
     """
-    return Caesar(shift).encipher(text)
+    return _caesar(text, shift)
 
 def caesar_decrypt(text, shift):
     """
@@ -25,12 +134,15 @@ def caesar_decrypt(text, shift):
     Returns:
         str: The decrypted text.
     """
-    return Caesar(-shift).encipher(text)
+    return _caesar(text, -shift)
 
 def vigenere_encrypt(text, key):
     """
     Encrypts text using the Vigenere Cipher.
 
+    The key advances on letters only; letters keep their case and other
+    characters are left as they are.
+
     Args:
         text (str): The text to be encrypted.
         key (str): The encryption key.
@@ -38,7 +150,9 @@ def vigenere_encrypt(text, key):
     Returns:
         str: The encrypted text.
     """
-    return Vigenere(key).encipher(text)
+    codes = _to_codes(text)
+    _vigenere_codes(codes, _vigenere_shifts(key))
+    return _from_codes(codes)
 
 def vigenere_decrypt(text, key):
     """
@@ -51,7 +165,39 @@ def vigenere_decrypt(text, key):
     Returns:
         str: The decrypted text.
     """
-    return Vigenere(key).decipher(text)
+    codes = _to_codes(text)
+    _vigenere_codes(codes, (ALPHABET_SIZE - _vigenere_shifts(key)) % ALPHABET_SIZE)
+    return _from_codes(codes)
+
+@lru_cache(maxsize=128)
+def _railfence_permutation(length, rails):
+    """
+    Returns the zig-zag permutation of a message: the positions of the message
+    characters in rail order (the order railfence_encrypt reads them out).
+
+    Rail r holds the positions r + k * period going down the zig-zag and
+    period - r + k * period going up, which interleave, so every rail is built
+    from two aranges: O(n) time and memory. The result is cached per
+    (length, rails) as a read-only array.
+    """
+    period = 2 * (rails - 1)
+    if rails == 1 or length <= 1:
+        permutation = np.arange(length)
+    else:
+        parts = []
+        for rail in range(min(rails, length)):
+            down = np.arange(rail, length, period)
+            if rail in (0, rails - 1):
+                parts.append(down)
+                continue
+            up = np.arange(period - rail, length, period)
+            positions = np.empty(len(down) + len(up), dtype=down.dtype)
+            positions[0::2] = down
+            positions[1::2] = up
+            parts.append(positions)
+        permutation = np.concatenate(parts)
+    permutation.flags.writeable = False
+    return permutation
 
 def railfence_encrypt(text, rails):
     """
@@ -64,36 +210,17 @@ def railfence_encrypt(text, rails):
     Returns:
         str: The encrypted ciphertext.
     """
-    
+
     # Handle edge cases
     if rails <= 0:
         raise ValueError("Number of rails must be greater than 0.")
     if not text:
         return ""
 
-    # Create a list of empty strings for each rail
-    rail = ['' for _ in range(rails)]
-    direction = 1  # 1 means moving down, -1 means moving up
-    row = 0  # Start at the first rail
-
-    # Iterate through each character in the input text
-    for char in text:
-        # Append the character to the current rail
-        rail[row] += char
-        
-        # Change direction if we hit the top or bottom rail
-        if row == 0:
-            direction = 1  # Move down
-        elif row == rails - 1:
-            direction = -1  # Move up
-        
-        # Move to the next rail
-        row += direction
-
-    # Join all rails to get the final encrypted text
-    result = ''.join(rail)
-    return result
-    
+    # Reading the rails in order is a gather through the zig-zag permutation
+    codes = _to_codes(text)
+    return _from_codes(codes[_railfence_permutation(len(codes), rails)])
+
 def railfence_decrypt(text, rails):
     """
     Decrypts text using the Railfence Cipher.
@@ -105,43 +232,316 @@ def railfence_decrypt(text, rails):
     Returns:
         str: The decrypted text.
     """
-    n = len(text)
-    rail = [['\n' for _ in range(n)] for _ in range(rails)]
-    direction = None
-    row, col = 0, 0
-
-    for i in range(n):
-        if row == 0:
-            direction = 1
-        if row == rails - 1:
-            direction = -1
+    if rails <= 0:
+        raise ValueError("Number of rails must be greater than 0.")
+    if not text:
+        return ""
 
-        rail[row][col] = '*'
-        col += 1
-        row += direction
+    # The inverse permutation: ciphertext character i goes back to its zig-zag position
+    codes = _to_codes(text)
+    result = np.empty_like(codes)
+    result[_railfence_permutation(len(codes), rails)] = codes
+    return _from_codes(result)
 
-    index = 0
-    for i in range(rails):
-        for j in range(n):
-            if (rail[i][j] == '*' and index < n):
-                rail[i][j] = text[index]
-                index += 1
+def _pack(texts):
+    """
+    Packs messages into one contiguous code point array.
 
+    Returns:
+        tuple: The array and the offsets of the messages in it (len(texts) + 1 entries).
+    """
+    lengths = np.array(list(map(len, texts)), dtype=np.int64)
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return _to_codes(''.join(texts)), offsets
+
+def _unpack(codes, offsets):
+    """Splits a packed array back into its messages."""
+    text = _from_codes(codes)
+    bounds = offsets.tolist()
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+def _fan_out(function, texts, argument, workers):
+    """
+    Runs function(texts, argument) over slices of texts in a process pool when the
+    batch is large enough to pay for it, and joins the results in order.
+    """
+    workers = min(workers or 1, len(texts) // MIN_MESSAGES_PER_WORKER)
+    if workers <= 1:
+        return None
+    size = -(-len(texts) // workers)
+    slices = [texts[start:start + size] for start in range(0, len(texts), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(function, slices, [argument] * len(slices))
+        return [text for result in results for text in result]
+
+def _caesar_many(texts, shift):
+    # One translate over the joined messages
+    text = _caesar(''.join(texts), shift)
     result = []
-    row, col = 0, 0
-    for i in range(n):
-        if row == 0:
-            direction = 1
-        if row == rails - 1:
-            direction = -1
+    start = 0
+    for length in map(len, texts):
+        result.append(text[start:start + length])
+        start += length
+    return result
+
+def _vigenere_many(texts, shifts):
+    codes, offsets = _pack(texts)
+    positions = _letter_positions(codes)
+    if len(positions):
+        # Each message restarts the key: a letter's key position is its rank among the letters of its message
+        first_letter = np.searchsorted(positions, offsets[:-1])
+        letters_per_message = np.diff(np.append(first_letter, len(positions)))
+        key_index = (np.arange(len(positions)) - np.repeat(first_letter, letters_per_message)) % len(shifts)
+        _shift_letters(codes, positions, shifts.astype(codes.dtype)[key_index])
+    return _unpack(codes, offsets)
+
+def _railfence_many(texts, rails, decrypt=False):
+    codes, offsets = _pack(texts)
+    # One gather (or scatter) through the permutations of every message, shifted to the message's offset.
+    # Messages of the same length share their permutation, so the index is built per distinct length.
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    index = np.empty(len(codes), dtype=np.int64)
+    for length in np.unique(lengths):
+        group = starts[lengths == length]
+        length = int(length)
+        index[(group[:, None] + np.arange(length)).ravel()] = (group[:, None]
+                                                               + _railfence_permutation(length, rails)).ravel()
+    if decrypt:
+        result = np.empty_like(codes)
+        result[index] = codes
+    else:
+        result = codes[index]
+    return _unpack(result, offsets)
+
+def _railfence_decrypt_many(texts, rails):
+    return _railfence_many(texts, rails, decrypt=True)
+
+def caesar_encrypt_many(texts, shift, workers=None):
+    """
+    Encrypts many messages with the Caesar Cipher in one call.
 
-        if rail[row][col] != '*':
-            result.append(rail[row][col])
-            col += 1
+    The messages are joined and translated at once, then split back, so the per
+    message cost is a slice instead of a full call.
 
-        row += direction
+    Args:
+        texts (list): The messages to be encrypted.
+        shift (int): The number of positions to shift the letters.
+        workers (int, optional): Processes to split very large batches over
+            (at least MIN_MESSAGES_PER_WORKER messages each).
 
-    return ''.join(result)
+    Returns:
+        list: The encrypted messages, in order.
+    """
+    texts = list(texts)
+    return _fan_out(_caesar_many, texts, shift, workers) or _caesar_many(texts, shift)
+
+def caesar_decrypt_many(texts, shift, workers=None):
+    """Decrypts many Caesar messages in one call (see caesar_encrypt_many)."""
+    return caesar_encrypt_many(texts, -shift, workers)
+
+def vigenere_encrypt_many(texts, key, workers=None):
+    """
+    Encrypts many messages with the Vigenere Cipher in one call.
+
+    The messages are packed into one buffer with an offsets array and their
+    letters shifted in a single vectorized pass; the key restarts at the
+    beginning of every message, as with vigenere_encrypt.
+
+    Args:
+        texts (list): The messages to be encrypted.
+        key (str): The encryption key.
+        workers (int, optional): Processes to split very large batches over
+            (at least MIN_MESSAGES_PER_WORKER messages each).
+
+    Returns:
+        list: The encrypted messages, in order.
+    """
+    texts = list(texts)
+    shifts = _vigenere_shifts(key)
+    return _fan_out(_vigenere_many, texts, shifts, workers) or _vigenere_many(texts, shifts)
+
+def vigenere_decrypt_many(texts, key, workers=None):
+    """Decrypts many Vigenere messages in one call (see vigenere_encrypt_many)."""
+    texts = list(texts)
+    shifts = (ALPHABET_SIZE - _vigenere_shifts(key)) % ALPHABET_SIZE
+    return _fan_out(_vigenere_many, texts, shifts, workers) or _vigenere_many(texts, shifts)
+
+def railfence_encrypt_many(texts, rails, workers=None):
+    """
+    Encrypts many messages with the Railfence Cipher in one call.
+
+    Messages of the same length share one cached permutation, and all of them are
+    applied with a single gather over the packed buffer.
+
+    Args:
+        texts (list): The messages to be encrypted.
+        rails (int): The number of rails.
+        workers (int, optional): Processes to split very large batches over
+            (at least MIN_MESSAGES_PER_WORKER messages each).
+
+    Returns:
+        list: The encrypted messages, in order.
+    """
+    if rails <= 0:
+        raise ValueError("Number of rails must be greater than 0.")
+    texts = list(texts)
+    return _fan_out(_railfence_many, texts, rails, workers) or _railfence_many(texts, rails)
+
+def railfence_decrypt_many(texts, rails, workers=None):
+    """Decrypts many Railfence messages in one call (see railfence_encrypt_many)."""
+    if rails <= 0:
+        raise ValueError("Number of rails must be greater than 0.")
+    texts = list(texts)
+    return _fan_out(_railfence_decrypt_many, texts, rails, workers) or _railfence_decrypt_many(texts, rails)
+
+def _read_chunks(source, chunk_size):
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def transform_chunks(chunks, cipher, key, decrypt=False, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Encrypts or decrypts a text arriving in chunks, yielding the result chunk by chunk.
+
+    Caesar has no state between chunks, and the Vigenere key position is carried
+    over from one chunk to the next, so the output is the same as for the whole
+    text at once whatever the chunking. Rail Fence is a transposition of the whole
+    message, so streams are enciphered in independent blocks of block_size
+    characters (the last block may be shorter): the same block_size must be used
+    to decrypt, and the result only equals railfence_encrypt of the whole text
+    when the text fits in one block.
+
+    Args:
+        chunks (iterable): The text, as an iterable of strings.
+        cipher (str): 'caesar', 'vigenere' or 'railfence'.
+        key: The shift (int), the Vigenere key (str) or the number of rails (int).
+        decrypt (bool): Decrypt instead of encrypt.
+        block_size (int): Characters per Rail Fence block.
+
+    Yields:
+        str: The transformed text, chunk by chunk.
+    """
+    if cipher == 'caesar':
+        shift = -key if decrypt else key
+        for chunk in chunks:
+            yield _caesar(chunk, shift)
+
+    elif cipher == 'vigenere':
+        shifts = _vigenere_shifts(key)
+        if decrypt:
+            shifts = (ALPHABET_SIZE - shifts) % ALPHABET_SIZE
+        offset = 0
+        for chunk in chunks:
+            codes = _to_codes(chunk)
+            offset += _vigenere_codes(codes, shifts, offset)
+            yield _from_codes(codes)
+
+    elif cipher == 'railfence':
+        if key <= 0:
+            raise ValueError("Number of rails must be greater than 0.")
+        if block_size <= 0:
+            raise ValueError("The block size must be greater than 0.")
+        transform = railfence_decrypt if decrypt else railfence_encrypt
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size < block_size:
+                continue
+            text = ''.join(pending)
+            whole = len(text) - len(text) % block_size
+            for start in range(0, whole, block_size):
+                yield transform(text[start:start + block_size], key)
+            pending = [text[whole:]]
+            pending_size = len(text) - whole
+        if pending_size:
+            yield transform(''.join(pending), key)
+
+    else:
+        raise ValueError(f"Unknown cipher: {cipher}")
+
+def transform_file(source, destination, cipher, key, decrypt=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Streams a text file through a cipher with constant memory (see transform_chunks).
+
+    Args:
+        source: Readable text file object (open it with newline='' to keep line endings as they are).
+        destination: Writable text file object.
+        cipher (str): 'caesar', 'vigenere' or 'railfence'.
+        key: The shift (int), the Vigenere key (str) or the number of rails (int).
+        decrypt (bool): Decrypt instead of encrypt.
+        chunk_size (int): Characters read at a time.
+        block_size (int): Characters per Rail Fence block.
+
+    Returns:
+        int: The number of characters written.
+
+    Raises:
+        ValueError: If chunk_size is not greater than 0 (read(0) would end the stream at
+            once, and a negative size would read the whole file).
+    """
+    if chunk_size <= 0:
+        raise ValueError("The chunk size must be greater than 0.")
+    written = 0
+    for chunk in transform_chunks(_read_chunks(source, chunk_size), cipher, key, decrypt, block_size):
+        destination.write(chunk)
+        written += len(chunk)
+    return written
+
+def cli(argv):
+    """
+    Non-interactive mode: streams a file (or stdin) through a cipher to a file (or stdout).
+
+    Args:
+        argv (list): The command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Encrypt or decrypt text files and pipes with classical ciphers")
+    parser.add_argument('cipher', choices=CIPHERS)
+    parser.add_argument('action', choices=['encrypt', 'decrypt'])
+    parser.add_argument('--shift', type=int, help="Caesar shift")
+    parser.add_argument('--key', help="Vigenere key")
+    parser.add_argument('--rails', type=int, help="Number of Rail Fence rails")
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Characters per Rail Fence block (decrypt with the block size used to encrypt)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Characters read at a time")
+    parser.add_argument('-i', '--input', default='-', help="Input file, - for stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output file, - for stdout")
+    parser.add_argument('--encoding', default='utf-8', help="Text encoding of the input and output")
+    args = parser.parse_args(argv)
+
+    key = {'caesar': args.shift, 'vigenere': args.key, 'railfence': args.rails}[args.cipher]
+    if key is None:
+        option = {'caesar': '--shift', 'vigenere': '--key', 'railfence': '--rails'}[args.cipher]
+        parser.error(f"{args.cipher} needs {option}")
+    # Checked before the output file is opened (and truncated)
+    for option, value in (('--chunk-size', args.chunk_size), ('--block-size', args.block_size),
+                          ('--rails', args.rails)):
+        if value is not None and value <= 0:
+            parser.error(f"{option} must be greater than 0")
+
+    # newline='' keeps line endings untouched (Rail Fence moves them around)
+    if args.input == '-':
+        source = io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding, newline='')
+    else:
+        source = open(args.input, encoding=args.encoding, newline='')
+    if args.output == '-':
+        destination = io.TextIOWrapper(sys.stdout.buffer, encoding=args.encoding, newline='')
+    else:
+        destination = open(args.output, 'w', encoding=args.encoding, newline='')
+    try:
+        transform_file(source, destination, args.cipher, key, args.action == 'decrypt', args.chunk_size,
+                       args.block_size)
+    finally:
+        destination.flush()
+        if args.output != '-':
+            destination.close()
+        if args.input != '-':
+            source.close()
 
 def main():
     """
@@ -205,4 +605,8 @@ def main():
             print("Invalid choice. Please select a valid option.")
 
 if __name__ == "__main__":
-    main()
+    # With arguments the tool streams files or pipes, without it asks what to do
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+    else:
+        main()